@@ -523,6 +523,68 @@ vc.disconnect()
                 guest_entity=guest_entity
             )))
 
+    def test_evict_many(self):
+        """
+        That the clients of several auth IDs can be evicted at once.
+        """
+        for i in range(1, 4):
+            self.mounts[i].umount_wait()
+
+        volumeclient_mount = self.mounts[1]
+        self._configure_vc_auth(volumeclient_mount, "manila")
+        guest_mounts = (self.mounts[2], self.mounts[3])
+        guest_entities = ("guest0", "guest1")
+
+        group_id = "grpid"
+        volume_id = "volid"
+
+        mount_path = self._volume_client_python(volumeclient_mount, dedent("""
+            vp = VolumePath("{group_id}", "{volume_id}")
+            create_result = vc.create_volume(vp, 10 * 1024 * 1024)
+            print create_result['mount_path']
+        """.format(
+            group_id=group_id,
+            volume_id=volume_id
+        )))
+
+        # Mount the volume as each of the two auth IDs
+        for i in range(2):
+            self._configure_guest_auth(volumeclient_mount, guest_mounts[i],
+                                       guest_entities[i], mount_path)
+            guest_mounts[i].mountpoint_dir_name = 'mnt.{id}.{suffix}'.format(
+                id=guest_entities[i], suffix=str(i))
+            guest_mounts[i].mount(mount_path=mount_path)
+            guest_mounts[i].write_n_mb("data.bin.{0}".format(i), 1)
+
+        self._volume_client_python(volumeclient_mount, dedent("""
+            vp = VolumePath("{group_id}", "{volume_id}")
+            for guest_entity in {guest_entities}:
+                vc.deauthorize(vp, guest_entity)
+            vc.evict_many({guest_entities})
+        """.format(
+            group_id=group_id,
+            volume_id=volume_id,
+            guest_entities=list(guest_entities)
+        )))
+
+        # Both evicted clients should fail further writes
+        for i in range(2):
+            try:
+                guest_mounts[i].write_n_mb("rogue.bin", 1)
+            except CommandFailedError:
+                pass
+            else:
+                raise RuntimeError("post-eviction write should have failed!")
+            guest_mounts[i].umount_wait()
+
+        self._volume_client_python(volumeclient_mount, dedent("""
+            vp = VolumePath("{group_id}", "{volume_id}")
+            vc.delete_volume(vp)
+            vc.purge_volume(vp)
+        """.format(
+            group_id=group_id,
+            volume_id=volume_id
+        )))
 
     def test_purge(self):
         """
@@ -575,6 +637,129 @@ vc.disconnect()
         self.assertEqual(self.mount_a.ls("volumes/_deleting"), [])
         self.assertEqual(self.mount_a.ls("volumes/"), ["_deleting", group_id])
 
+    def test_purge_tree(self):
+        """
+        That purge_volume removes a several levels deep tree when walking
+        it with several threads, and leaves no checkpoint behind.
+        """
+        self.mount_b.umount_wait()
+        self._configure_vc_auth(self.mount_b, "manila")
+
+        group_id = "grpid"
+        volume_id = "volid"
+
+        mount_path = self._volume_client_python(self.mount_b, dedent("""
+            vp = VolumePath("{group_id}", "{volume_id}")
+            create_result = vc.create_volume(vp, 10)
+            print create_result['mount_path']
+        """.format(
+            group_id=group_id,
+            volume_id=volume_id
+        )))
+
+        # Strip leading "/"
+        mount_path = mount_path[1:]
+
+        # Four directories per level, three levels deep, each with a
+        # few files
+        self.mount_a.run_shell(["bash", "-c", dedent("""
+            cd {mount_path}
+            for a in 0 1 2 3; do
+                for b in 0 1 2 3; do
+                    for c in 0 1 2 3; do
+                        mkdir -p $a/$b/$c
+                        touch $a/f0 $a/$b/f0 $a/$b/$c/f0 $a/$b/$c/f1
+                    done
+                done
+            done
+        """.format(mount_path=mount_path))])
+
+        self._volume_client_python(self.mount_b, dedent("""
+            vp = VolumePath("{group_id}", "{volume_id}")
+            vc.delete_volume(vp)
+            vc.purge_volume(vp, workers=4)
+        """.format(
+            group_id=group_id,
+            volume_id=volume_id
+        )))
+
+        self.assertEqual(self.mount_a.ls("volumes/_deleting"), [])
+        self.assertEqual(self.mount_a.ls("volumes/"), ["_deleting", group_id])
+
+    def test_clone_volume(self):
+        """
+        That clone_volume_to_existing copies a snapshot of a volume, both
+        a tree of many small files and a few large ones, into another
+        volume, and that calling it again is harmless.
+        """
+        self.mount_b.umount_wait()
+        self._configure_vc_auth(self.mount_b, "manila")
+        self.fs.set_allow_new_snaps(True)
+
+        group_id = "grpid"
+        src_volume_id = "srcvolid"
+        dst_volume_id = "dstvolid"
+
+        mount_paths = self._volume_client_python(self.mount_b, dedent("""
+            for volume_id in ["{src_volume_id}", "{dst_volume_id}"]:
+                vp = VolumePath("{group_id}", volume_id)
+                create_result = vc.create_volume(vp, 1024 * 1024 * 1024)
+                print create_result['mount_path']
+        """.format(
+            group_id=group_id,
+            src_volume_id=src_volume_id,
+            dst_volume_id=dst_volume_id
+        ))).split()
+
+        # Strip leading "/"
+        src_path, dst_path = [p[1:] for p in mount_paths]
+
+        self.mount_a.run_shell(["bash", "-c", dedent("""
+            cd {src_path}
+            mkdir small large
+            for a in $(seq 0 9); do
+                mkdir small/$a
+                for b in $(seq 0 99); do
+                    echo $a$b > small/$a/$b
+                done
+            done
+            chmod 0640 small/0/0
+            ln -s 0/0 small/link
+            setfattr -n ceph.quota.max_files -v 1000 small
+            for a in 0 1 2; do
+                dd if=/dev/urandom of=large/$a bs=1M count=64
+            done
+        """.format(src_path=src_path))])
+
+        def checksums(path):
+            return self.mount_a.run_shell(["bash", "-c", dedent("""
+                cd {path}
+                find . ! -type l -exec stat -c '%n %a %s %Y' {{}} \\; | sort
+                find . -type l -exec readlink {{}} \\; | sort
+                find . -type f -exec md5sum {{}} \\; | sort
+            """.format(path=path))]).stdout.getvalue()
+
+        for i in range(2):
+            self._volume_client_python(self.mount_b, dedent("""
+                import time
+                src = VolumePath("{group_id}", "{src_volume_id}")
+                dst = VolumePath("{group_id}", "{dst_volume_id}")
+                vc.create_snapshot_volume(src, "snap1")
+                start = time.time()
+                vc.clone_volume_to_existing(dst, src, "snap1")
+                log.info("clone took {{0:.1f}}s".format(time.time() - start))
+                vc.destroy_snapshot_volume(src, "snap1")
+            """.format(
+                group_id=group_id,
+                src_volume_id=src_volume_id,
+                dst_volume_id=dst_volume_id
+            )))
+
+            self.assertEqual(checksums(src_path), checksums(dst_path))
+            self.assertEqual(
+                self.mount_a.getfattr(os.path.join(dst_path, "small"),
+                                      "ceph.quota.max_files"), "1000")
+
     def test_readonly_authorization(self):
         """
         That guest clients can be restricted to read-only mounts of volumes.
@@ -701,6 +886,66 @@ vc.disconnect()
         expected_result = None
         self.assertItemsEqual(str(expected_result), auths)
 
+    def test_authorize_many(self):
+        """
+        That many auth IDs can be given, and then lose, access to several
+        volumes in one batch.
+        """
+        volumeclient_mount = self.mounts[1]
+        volumeclient_mount.umount_wait()
+        self._configure_vc_auth(volumeclient_mount, "manila")
+
+        group_id = "grpid"
+        volume_ids = ["volid_0", "volid_1"]
+        guest_entities = ["guest{0}".format(i) for i in range(20)]
+
+        # Every guest gets both volumes, odd ones read-only
+        auths = self._volume_client_python(volumeclient_mount, dedent("""
+            vps = [VolumePath("{group_id}", volume_id) for volume_id in {volume_ids}]
+            for vp in vps:
+                vc.create_volume(vp, 1024*1024*10)
+            grants = []
+            for i, guest_entity in enumerate({guest_entities}):
+                for vp in vps:
+                    grants.append((vp, guest_entity, i % 2 == 1, "tenant"))
+            keys = vc.authorize_many(grants)
+            assert sorted(keys) == sorted({guest_entities})
+            assert all(k['auth_key'] for k in keys.values())
+            print sorted(vc.get_authorized_ids(vps[0])) == sorted(vc.get_authorized_ids(vps[1]))
+            print len(vc.get_authorized_ids(vps[0]))
+        """.format(
+            group_id=group_id,
+            volume_ids=volume_ids,
+            guest_entities=guest_entities,
+        )))
+        self.assertEqual(auths.split(), ["True", str(len(guest_entities))])
+
+        # One cap per volume for each guest
+        auth_list = dict((a['entity'], a) for a in self.auth_list())
+        for i, guest_entity in enumerate(guest_entities):
+            mds_caps = auth_list["client." + guest_entity]['caps']['mds']
+            access_level = 'r' if i % 2 == 1 else 'rw'
+            for volume_id in volume_ids:
+                self.assertIn("allow {0} path=/volumes/{1}/{2}".format(
+                    access_level, group_id, volume_id), mds_caps)
+
+        auths = self._volume_client_python(volumeclient_mount, dedent("""
+            vps = [VolumePath("{group_id}", volume_id) for volume_id in {volume_ids}]
+            vc.deauthorize_many([(vp, guest_entity)
+                                 for guest_entity in {guest_entities}
+                                 for vp in vps])
+            print [vc.get_authorized_ids(vp) for vp in vps]
+        """.format(
+            group_id=group_id,
+            volume_ids=volume_ids,
+            guest_entities=guest_entities,
+        )))
+        self.assertEqual(str([None, None]), auths)
+
+        existing_ids = [a['entity'] for a in self.auth_list()]
+        for guest_entity in guest_entities:
+            self.assertNotIn("client." + guest_entity, existing_ids)
+
     def test_multitenant_volumes(self):
         """
         That volume access can be restricted to a tenant.
@@ -946,6 +1191,37 @@ vc.disconnect()
             obj_data = obj_data
         )))
 
+    def test_put_get_large_object(self):
+        """
+        That objects are written and read back in chunks, so they may be
+        larger than one write (or osd_max_write_size).
+        """
+        vc_mount = self.mounts[1]
+        vc_mount.umount_wait()
+        self._configure_vc_auth(vc_mount, "manila")
+
+        obj_name = 'test_vc_obj_large'
+        pool_name = self.fs.get_data_pool_names()[0]
+        # Set the write limit below the object's size
+        self.set_conf("client.manila", "osd max write size", "8")
+
+        self._volume_client_python(vc_mount, dedent("""
+            import hashlib, io, os
+            data = os.urandom(20 * 1024 * 1024 + 123)
+            vc.put_object("{pool_name}", "{obj_name}", io.BytesIO(data))
+            read = hashlib.md5()
+            for chunk in vc.get_object_chunks("{pool_name}", "{obj_name}"):
+                read.update(chunk)
+            assert read.hexdigest() == hashlib.md5(data).hexdigest()
+            assert vc.get_object("{pool_name}", "{obj_name}") == data
+
+            vc.put_object("{pool_name}", "{obj_name}", b"short")
+            assert vc.get_object("{pool_name}", "{obj_name}") == b"short"
+        """.format(
+            pool_name = pool_name,
+            obj_name = obj_name,
+        )))
+
     def test_delete_object(self):
         vc_mount = self.mounts[1]
         vc_mount.umount_wait()
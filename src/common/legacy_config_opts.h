@@ -33,6 +33,8 @@ OPTION(pid_file, OPT_STR) // default changed by common_preinit()
 OPTION(chdir, OPT_STR)
 OPTION(restapi_log_level, OPT_STR) 	// default set by Python code
 OPTION(restapi_base_url, OPT_STR)	// "
+OPTION(restapi_cluster_handles, OPT_INT)
+OPTION(restapi_cache_ttl, OPT_FLOAT)
 OPTION(fatal_signal_handlers, OPT_BOOL)
 SAFE_OPTION(erasure_code_dir, OPT_STR) // default location for erasure-code plugins
 
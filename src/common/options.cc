@@ -308,6 +308,14 @@ std::vector<Option> get_global_options() {
     Option("restapi_base_url", Option::TYPE_STR, Option::LEVEL_ADVANCED)
     .set_description("default set by python code"),
 
+    Option("restapi_cluster_handles", Option::TYPE_INT, Option::LEVEL_ADVANCED)
+    .set_default(4)
+    .set_description("number of cluster connections ceph-rest-api opens in each process, for serving requests concurrently"),
+
+    Option("restapi_cache_ttl", Option::TYPE_FLOAT, Option::LEVEL_ADVANCED)
+    .set_default(1.0)
+    .set_description("seconds ceph-rest-api reuses the response to a read-only command for (0 to disable)"),
+
     Option("erasure_code_dir", Option::TYPE_STR, Option::LEVEL_ADVANCED)
     .set_default(CEPH_PKGLIBDIR"/erasure-code")
     .set_description("directory where erasure-code plugins can be found")
@@ -315,6 +315,10 @@ PyObject *ActivePyModules::get_python(const std::string &what)
       mgr_map.dump(&f);
     });
     return f.get();
+  } else if (what == "module_stats") {
+    PyFormatter f;
+    dump_module_stats(&f);
+    return f.get();
   } else {
     derr << "Python module requested unknown data '" << what << "'" << dendl;
     Py_RETURN_NONE;
@@ -579,6 +583,50 @@ PyObject* ActivePyModules::get_counter_python(
   return f.get();
 }
 
+PyObject* ActivePyModules::get_counters_python(
+    const std::string &svc_type,
+    const std::map<std::string, std::vector<std::string>> &paths)
+{
+  PyThreadState *tstate = PyEval_SaveThread();
+  Mutex::Locker l(lock);
+  PyEval_RestoreThread(tstate);
+
+  PyFormatter f;
+  for (const auto &i : paths) {
+    const auto &svc_id = i.first;
+    f.open_object_section(svc_id.c_str());
+    auto metadata = daemon_state.get(DaemonKey(svc_type, svc_id));
+    if (metadata) {
+      Mutex::Locker l2(metadata->lock);
+      for (const auto &path : i.second) {
+        f.open_array_section(path.c_str());
+        auto counter = metadata->perf_counters.instances.find(path);
+        if (counter != metadata->perf_counters.instances.end()) {
+          for (const auto &datapoint : counter->second.get_data()) {
+            f.open_array_section("datapoint");
+            f.dump_unsigned("t", datapoint.t.sec());
+            f.dump_unsigned("v", datapoint.v);
+            f.close_section();
+          }
+        } else {
+          dout(4) << "Missing counter: '" << path << "' ("
+                  << svc_type << "." << svc_id << ")" << dendl;
+        }
+        f.close_section();
+      }
+    } else {
+      dout(4) << "No daemon state for "
+              << svc_type << "." << svc_id << ")" << dendl;
+      for (const auto &path : i.second) {
+        f.open_array_section(path.c_str());
+        f.close_section();
+      }
+    }
+    f.close_section();
+  }
+  return f.get();
+}
+
 PyObject* ActivePyModules::get_perf_schema_python(
     const std::string svc_type,
     const std::string &svc_id)
@@ -735,3 +783,58 @@ void ActivePyModules::set_uri(const std::string& module_name,
   modules[module_name]->set_uri(uri);
 }
 
+// Upper bounds of the module call latency histogram buckets, in
+// seconds.  The last bucket counts everything slower.
+static const double module_call_buckets[] = {0.001, 0.01, 0.1, 1.0, 10.0};
+static const size_t num_module_call_buckets =
+  sizeof(module_call_buckets) / sizeof(module_call_buckets[0]);
+
+void ActivePyModules::record_module_call(const std::string &module_name,
+					 const std::string &call,
+					 double seconds)
+{
+  Mutex::Locker l(stats_lock);
+
+  auto &stats = module_stats[module_name][call];
+  if (stats.histogram.empty()) {
+    stats.histogram.resize(num_module_call_buckets + 1);
+  }
+  stats.count++;
+  stats.total += seconds;
+  stats.max = std::max(stats.max, seconds);
+  size_t i = 0;
+  while (i < num_module_call_buckets && seconds > module_call_buckets[i]) {
+    ++i;
+  }
+  stats.histogram[i]++;
+}
+
+void ActivePyModules::dump_module_stats(Formatter *f) const
+{
+  Mutex::Locker l(stats_lock);
+
+  f->open_array_section("buckets");
+  for (size_t i = 0; i < num_module_call_buckets; ++i) {
+    f->dump_float("bucket", module_call_buckets[i]);
+  }
+  f->close_section();
+  f->open_object_section("modules");
+  for (const auto &i : module_stats) {
+    f->open_object_section(i.first.c_str());
+    for (const auto &j : i.second) {
+      f->open_object_section(j.first.c_str());
+      f->dump_unsigned("count", j.second.count);
+      f->dump_float("total_seconds", j.second.total);
+      f->dump_float("max_seconds", j.second.max);
+      f->open_array_section("histogram");
+      for (auto n : j.second.histogram) {
+	f->dump_unsigned("count", n);
+      }
+      f->close_section();
+      f->close_section();
+    }
+    f->close_section();
+  }
+  f->close_section();
+}
+
@@ -47,6 +47,20 @@ class ActivePyModules
 
   mutable Mutex lock{"ActivePyModules::lock"};
 
+  // Call counts and latencies of each module's entry points and of its
+  // calls into ceph-mgr, as recorded by MgrModule
+  struct CallStats {
+    uint64_t count = 0;
+    double total = 0.0;
+    double max = 0.0;
+    std::vector<uint64_t> histogram;
+  };
+  // Only ever taken with the GIL held, and nothing else taken under it
+  mutable Mutex stats_lock{"ActivePyModules::stats_lock"};
+  std::map<std::string, std::map<std::string, CallStats>> module_stats;
+
+  void dump_module_stats(Formatter *f) const;
+
 public:
   ActivePyModules(PyModuleConfig const &config_,
             DaemonStateIndex &ds, ClusterState &cs, MonClient &mc,
@@ -71,6 +85,9 @@ public:
     const std::string &svc_type,
     const std::string &svc_id,
     const std::string &path);
+  PyObject *get_counters_python(
+    const std::string &svc_type,
+    const std::map<std::string, std::vector<std::string>> &paths);
   PyObject *get_perf_schema_python(
      const std::string svc_type,
      const std::string &svc_id);
@@ -90,6 +107,9 @@ public:
 
   void set_uri(const std::string& module_name, const std::string &uri);
 
+  void record_module_call(const std::string &module_name,
+			  const std::string &call, double seconds);
+
   // Python command definitions, including callback
   std::vector<ModuleCommand> get_py_commands() const;
 
@@ -464,6 +464,31 @@ get_counter(BaseMgrModule *self, PyObject *args)
       svc_name, svc_id, counter_path);
 }
 
+static PyObject*
+get_counters(BaseMgrModule *self, PyObject *args)
+{
+  char *svc_name = nullptr;
+  PyObject *requests = nullptr;
+  if (!PyArg_ParseTuple(args, "sO:get_counters", &svc_name, &requests)) {
+    return nullptr;
+  }
+  if (!PyList_Check(requests)) {
+    PyErr_SetString(PyExc_TypeError, "requests must be a list");
+    return nullptr;
+  }
+  std::map<std::string, std::vector<std::string>> paths;
+  for (int i = 0; i < PyList_Size(requests); ++i) {
+    char *svc_id = nullptr;
+    char *counter_path = nullptr;
+    if (!PyArg_ParseTuple(PyList_GET_ITEM(requests, i), "ss:request",
+                          &svc_id, &counter_path)) {
+      return nullptr;
+    }
+    paths[svc_id].push_back(counter_path);
+  }
+  return self->py_modules->get_counters_python(svc_name, paths);
+}
+
 static PyObject*
 get_perf_schema(BaseMgrModule *self, PyObject *args)
 {
@@ -502,6 +527,23 @@ ceph_set_uri(BaseMgrModule *self, PyObject *args)
   Py_RETURN_NONE;
 }
 
+static PyObject*
+ceph_record_call(BaseMgrModule *self, PyObject *args)
+{
+  char *call = nullptr;
+  double seconds = 0.0;
+  if (!PyArg_ParseTuple(args, "sd:ceph_record_call", &call, &seconds)) {
+    return nullptr;
+  }
+
+  // Called for every timed call, so keep the GIL: the stats lock is
+  // never held while waiting for it
+  self->py_modules->record_module_call(self->this_module->get_name(),
+                                       call, seconds);
+
+  Py_RETURN_NONE;
+}
+
 static PyObject*
 ceph_have_mon_connection(BaseMgrModule *self, PyObject *args)
 {
@@ -547,6 +589,9 @@ PyMethodDef BaseMgrModule_methods[] = {
   {"_ceph_get_counter", (PyCFunction)get_counter, METH_VARARGS,
     "Get a performance counter"},
 
+  {"_ceph_get_counters", (PyCFunction)get_counters, METH_VARARGS,
+    "Get several performance counters"},
+
   {"_ceph_get_perf_schema", (PyCFunction)get_perf_schema, METH_VARARGS,
     "Get the performance counter schema"},
 
@@ -565,6 +610,9 @@ PyMethodDef BaseMgrModule_methods[] = {
   {"_ceph_set_uri", (PyCFunction)ceph_set_uri, METH_VARARGS,
     "Advertize a service URI served by this module"},
 
+  {"_ceph_record_call", (PyCFunction)ceph_record_call, METH_VARARGS,
+    "Record the duration of a call to a module entry point or into ceph-mgr"},
+
   {"_ceph_have_mon_connection", (PyCFunction)ceph_have_mon_connection,
     METH_NOARGS, "Find out whether this mgr daemon currently has "
                  "a connection to a monitor"},
@@ -12,15 +12,25 @@ LGPL2.  See file COPYING.
 from __future__ import print_function
 import copy
 import errno
+import hashlib
 import json
 import os
-import pprint
 import re
 import socket
 import stat
 import sys
 import threading
-import uuid
+import time
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 
 FLAG_MGR = 8   # command is intended for mgr
@@ -533,6 +543,8 @@ class CephUUID(CephArgtype):
     CephUUID: pretty self-explanatory
     """
     def valid(self, s, partial=False):
+        # imported here to keep it off the CLI's startup path
+        import uuid
         try:
             uuid.UUID(s)
         except Exception as e:
@@ -783,6 +795,108 @@ def parse_json_funcsigs(s, consumer):
     return sigdict
 
 
+class SigCache(object):
+    """
+    On-disk cache of parsed command descriptions, i.e. the output of
+    get_command_descriptions after parse_json_funcsigs(), so that callers
+    that run many short-lived commands can skip both fetching and parsing
+    them.
+
+    Entries are keyed by a tuple chosen by the caller, normally
+    (cluster fsid, target type, daemon version, consumer).  Each entry is pickled
+    into its own file, readable only by the user who wrote it, and is
+    ignored once it is older than `ttl` seconds.  Callers should
+    invalidate() an entry when a command fails to validate against it,
+    and fetch the descriptions again.
+
+    Any problem reading or writing the cache just makes it behave as a
+    miss.
+    """
+    DEFAULT_TTL = 3600
+
+    def __init__(self, path=None, ttl=DEFAULT_TTL):
+        if path is None:
+            path = os.environ.get('CEPH_SIG_CACHE_DIR')
+        if path is None:
+            cache_home = os.environ.get('XDG_CACHE_HOME') or \
+                os.path.join(os.path.expanduser('~'), '.cache')
+            path = os.path.join(cache_home, 'ceph', 'sigs')
+        self.path = path
+        self.ttl = ttl
+
+    def _filename(self, key):
+        # pickles written by one python major version can't always be
+        # read by the other
+        name = repr((sys.version_info[0],) + tuple(key))
+        return os.path.join(self.path,
+                            hashlib.sha1(name.encode('utf-8')).hexdigest())
+
+    def get(self, key):
+        """
+        :return: the sigdict cached under key, or None
+        """
+        filename = self._filename(key)
+        try:
+            with open(filename, 'rb') as f:
+                st = os.fstat(f.fileno())
+                # only trust files that nobody else could have written
+                if st.st_uid != os.getuid() or \
+                        st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+                    return None
+                if time.time() - st.st_mtime > self.ttl:
+                    return None
+                entry = pickle.load(f)
+        except Exception:
+            return None
+        if entry.get('key') != tuple(key):
+            return None
+        return entry['sigdict']
+
+    def put(self, key, sigdict):
+        """
+        Cache sigdict under key, replacing any previous entry
+        """
+        import tempfile
+        try:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path, 0o700)
+            fd, tmpname = tempfile.mkstemp(dir=self.path)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump({'key': tuple(key), 'sigdict': sigdict}, f,
+                                pickle.HIGHEST_PROTOCOL)
+                os.rename(tmpname, self._filename(key))
+            except Exception:
+                os.unlink(tmpname)
+                raise
+        except Exception:
+            pass
+
+    def invalidate(self, key):
+        try:
+            os.unlink(self._filename(key))
+        except OSError:
+            pass
+
+
+def cached_json_funcsigs(cache, key, fetch, consumer):
+    """
+    Return the parsed command descriptions cached under key, or call
+    fetch() for their JSON, parse them with parse_json_funcsigs() and
+    cache the result.  cache may be None to disable caching.
+
+    :return: 2-tuple of (sigdict, whether it came from the cache)
+    """
+    if cache is not None:
+        sigdict = cache.get(key)
+        if sigdict is not None:
+            return sigdict, True
+    sigdict = parse_json_funcsigs(fetch(), consumer)
+    if cache is not None:
+        cache.put(key, sigdict)
+    return sigdict, False
+
+
 def validate_one(word, desc, partial=False):
     """
     validate_one(word, desc, partial=False)
@@ -805,13 +919,17 @@ def matchnum(args, signature, partial=False):
     Returns number of arguments matched in s against signature.
     Can be used to determine most-likely command for full or partial
     matches (partial applies to string matches).
+
+    The count of words seen by each descriptor is kept here rather than
+    on the descriptors, so signature is not modified and doesn't need
+    copying.
     """
     words = args[:]
-    mysig = copy.deepcopy(signature)
     matchcnt = 0
-    for desc in mysig:
-        setattr(desc, 'numseen', 0)
-        while desc.numseen < desc.n:
+    for desc in signature:
+        numseen = 0
+        n = desc.n
+        while numseen < n:
             # if there are no more arguments, return
             if not words:
                 return matchcnt
@@ -821,7 +939,7 @@ def matchnum(args, signature, partial=False):
                 # only allow partial matching if we're on the last supplied
                 # word; avoid matching foo bar and foot bar just because
                 # partial is set
-                validate_one(word, desc, partial and (len(words) == 0))
+                desc.instance.valid(word, partial and (len(words) == 0))
                 valid = True
             except ArgumentError:
                 # matchnum doesn't care about type of error
@@ -835,11 +953,145 @@ def matchnum(args, signature, partial=False):
                 else:
                     # it was required, and didn't match, return
                     return matchcnt
+            numseen += 1
+            if desc.N:
+                n = numseen + 1
         if desc.req:
             matchcnt += 1
     return matchcnt
 
 
+def _prefix_word(s):
+    """
+    Convert s the way CephPrefix.valid() does before comparing it with a
+    prefix; None if it can't match any prefix.
+    """
+    try:
+        s = str(s)
+        if isinstance(s, bytes):
+            s = s.decode('ascii')
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return None
+    return s
+
+
+class _TrieNode(object):
+    __slots__ = ['children', 'ends', 'all']
+
+    def __init__(self):
+        # map of prefix word to _TrieNode
+        self.children = {}
+        # cmdtags whose leading prefix words end at this node
+        self.ends = []
+        # cmdtags of every signature at or below this node
+        self.all = []
+
+
+class CommandTrie(object):
+    """
+    Prefix tree over the leading CephPrefix words of each signature in
+    a sigdict, so that matching a command only has to look at the
+    signatures that share its first words instead of all of them.
+
+    Build it with command_trie(), which reuses the tree for as long as
+    the same sigdict is passed in.
+    """
+    def __init__(self, sigdict):
+        self.sigdict = sigdict
+        self.root = _TrieNode()
+        # position of each cmdtag in sigdict, to keep results in the
+        # same order a plain walk over sigdict would give
+        self.order = {}
+        for cmdtag, cmd in sigdict.items():
+            self.order[cmdtag] = len(self.order)
+            node = self.root
+            node.all.append(cmdtag)
+            for desc in cmd['sig']:
+                if desc.t != CephPrefix:
+                    break
+                node = node.children.setdefault(desc.instance.prefix,
+                                                _TrieNode())
+                node.all.append(cmdtag)
+            node.ends.append(cmdtag)
+
+    def best_matches(self, args):
+        """
+        Find the signatures with the highest matchnum(args, sig,
+        partial=True).  Signatures whose prefix words diverge from args
+        score the number of words they had in common, so only those
+        whose prefix words all match need matchnum() run on them.
+
+        :return: 2-tuple of (best match count, list of cmdtags)
+        """
+        words = [_prefix_word(arg) for arg in args]
+        scored = []    # (matchcnt, [cmdtags])
+        nodes = [(self.root, 0)]
+        while nodes:
+            node, depth = nodes.pop()
+            for cmdtag in node.ends:
+                sig = self.sigdict[cmdtag]['sig']
+                scored.append((matchnum(args, sig, partial=True), [cmdtag]))
+            for prefix, child in node.children.items():
+                if depth == len(words):
+                    # out of words
+                    scored.append((depth, child.all))
+                    continue
+                word = words[depth]
+                if word is not None and \
+                        (prefix == word or (depth == len(words) - 1 and
+                                            prefix.startswith(word))):
+                    nodes.append((child, depth + 1))
+                else:
+                    scored.append((depth, child.all))
+
+        best_match_cnt = 0
+        for matchcnt, _ in scored:
+            best_match_cnt = max(best_match_cnt, matchcnt)
+        bestcmds = []
+        for matchcnt, cmdtags in scored:
+            if matchcnt == best_match_cnt:
+                bestcmds.extend(cmdtags)
+        bestcmds.sort(key=self.order.get)
+        return best_match_cnt, bestcmds
+
+    def candidates(self, words):
+        """
+        The cmdtags of signatures whose leading prefix words are
+        consistent with words: every prefix word that lines up with one
+        of words is equal to it.  This is the set complete() in the CLI
+        needs to consider.
+        """
+        cmdtags = []
+        node = self.root
+        for word in words:
+            cmdtags.extend(node.ends)
+            word = _prefix_word(word)
+            if word not in node.children:
+                break
+            node = node.children[word]
+        else:
+            cmdtags.extend(node.all)
+        cmdtags.sort(key=self.order.get)
+        return cmdtags
+
+
+# The last (sigdict, number of commands, CommandTrie) built
+_last_trie = (None, 0, None)
+
+
+def command_trie(sigdict):
+    """
+    Return a CommandTrie for sigdict, reusing the last one built if it
+    was for the same sigdict.
+    """
+    global _last_trie
+    last_sigdict, last_len, trie = _last_trie
+    if last_sigdict is not sigdict or last_len != len(sigdict):
+        trie = CommandTrie(sigdict)
+        _last_trie = (sigdict, len(sigdict), trie)
+    return trie
+
+
 def get_next_arg(desc, args):
     '''
     Get either the value matching key 'desc.name' or the next arg in
@@ -1003,10 +1255,14 @@ def cmdsiglen(sig):
     return len(some_value['sig'])
 
 
-def validate_command(sigdict, args, verbose=False):
+def validate_command(sigdict, args, verbose=False, quiet=False):
     """
     turn args into a valid dictionary ready to be sent off as JSON,
     validated against sigdict.
+
+    With quiet, say nothing on stderr about invalid commands; for
+    checking whether args are valid against possibly out-of-date
+    descriptions.
     """
     if verbose:
         print("validate_command: " + " ".join(args), file=sys.stderr)
@@ -1015,30 +1271,21 @@ def validate_command(sigdict, args, verbose=False):
     if args:
         # look for best match, accumulate possibles in bestcmds
         # (so we can maybe give a more-useful error message)
-        best_match_cnt = 0
-        bestcmds = []
-        for cmdtag, cmd in sigdict.items():
-            sig = cmd['sig']
-            matched = matchnum(args, sig, partial=True)
-            if matched > best_match_cnt:
-                if verbose:
-                    print("better match: {0} > {1}: {2}:{3} ".format(
-                        matched, best_match_cnt, cmdtag, concise_sig(sig)
-                    ), file=sys.stderr)
-                best_match_cnt = matched
-                bestcmds = [{cmdtag: cmd}]
-            elif matched == best_match_cnt:
-                if verbose:
-                    print("equal match: {0} > {1}: {2}:{3} ".format(
-                        matched, best_match_cnt, cmdtag, concise_sig(sig)
-                    ), file=sys.stderr)
-                bestcmds.append({cmdtag: cmd})
+        best_match_cnt, bestcmds = command_trie(sigdict).best_matches(args)
+        if verbose:
+            for cmdtag in bestcmds:
+                print("best match: {0}: {1}:{2} ".format(
+                    best_match_cnt, cmdtag,
+                    concise_sig(sigdict[cmdtag]['sig'])
+                ), file=sys.stderr)
+        bestcmds = [{cmdtag: sigdict[cmdtag]} for cmdtag in bestcmds]
 
         # Sort bestcmds by number of args so we can try shortest first
         # (relies on a cmdsig being key,val where val is a list of len 1)
         bestcmds_sorted = sorted(bestcmds, key=cmdsiglen)
 
         if verbose:
+            import pprint
             print("bestcmds_sorted: ", file=sys.stderr)
             pprint.PrettyPrinter(stream=sys.stderr).pprint(bestcmds_sorted)
 
@@ -1066,18 +1313,21 @@ def validate_command(sigdict, args, verbose=False):
                     # Solid mismatch on an arg (type, range, etc.)
                     # Stop now, because we have the right command but
                     # some other input is invalid
-                    print("Invalid command: ", e, file=sys.stderr)
-                    print(concise_sig(sig), ': ', cmd['help'], file=sys.stderr)
+                    if not quiet:
+                        print("Invalid command: ", e, file=sys.stderr)
+                        print(concise_sig(sig), ': ', cmd['help'],
+                              file=sys.stderr)
                     return {}
             if found:
                 break
 
         if not found:
-            bestcmds = bestcmds[:10]
-            print('no valid command found; {0} closest matches:'.format(len(bestcmds)), file=sys.stderr)
-            for cmdsig in bestcmds:
-                for (cmdtag, cmd) in cmdsig.items():
-                    print(concise_sig(cmd['sig']), file=sys.stderr)
+            if not quiet:
+                bestcmds = bestcmds[:10]
+                print('no valid command found; {0} closest matches:'.format(len(bestcmds)), file=sys.stderr)
+                for cmdsig in bestcmds:
+                    for (cmdtag, cmd) in cmdsig.items():
+                        print(concise_sig(cmd['sig']), file=sys.stderr)
             return None
 
         return valid_dict
@@ -1151,61 +1401,123 @@ def find_cmd_target(childargs):
     return 'mon', ''
 
 
-class RadosThread(threading.Thread):
-    def __init__(self, target, *args, **kwargs):
-        self.args = args
-        self.kwargs = kwargs
+class ThreadCall(object):
+    """
+    A call to run on a WorkerPool thread.  done is set once target has
+    returned or raised, after which callback (if any) is called with
+    this ThreadCall, still on the worker thread.
+    """
+    def __init__(self, target, args=(), kwargs=None, callback=None):
         self.target = target
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.callback = callback
+        self.retval = None
         self.exception = None
-        threading.Thread.__init__(self)
+        self.done = threading.Event()
 
     def run(self):
         try:
             self.retval = self.target(*self.args, **self.kwargs)
         except Exception as e:
             self.exception = e
+        self.done.set()
+        if self.callback:
+            self.callback(self)
+
+    def wait(self, timeout=0):
+        """
+        Wait for the call to finish, for up to timeout seconds (0 for no
+        limit).  The wait is done in slices of at most POLL_TIME_INCR, so
+        that SIGINT still reaches the waiting thread (as
+        KeyboardInterrupt).
+
+        :return: whether the call finished
+        """
+        deadline = time.time() + timeout if timeout else None
+        while True:
+            wait = POLL_TIME_INCR
+            if deadline is not None:
+                wait = min(wait, deadline - time.time())
+                if wait <= 0:
+                    return self.done.is_set()
+            if self.done.wait(wait):
+                return True
+
+    def result(self):
+        if self.exception:
+            raise self.exception
+        return self.retval
+
+
+class WorkerPool(object):
+    """
+    Daemon threads to make (possibly blocking) librados calls on, so
+    that the caller can give up on them on timeout or SIGINT, and so
+    that the process can exit while they are still blocked.
+
+    Threads are reused from call to call.  A thread stuck in a call
+    that was given up on just stays busy; new threads are started
+    whenever none is idle.
+    """
+    def __init__(self):
+        self._calls = queue.Queue()
+        self._lock = threading.Lock()
+        self._idle = 0
+
+    def _worker(self):
+        while True:
+            call = self._calls.get()
+            call.run()
+            with self._lock:
+                self._idle += 1
+
+    def submit(self, call):
+        """
+        Queue call, a ThreadCall, to run on a worker thread
+        """
+        with self._lock:
+            start = self._idle == 0
+            if not start:
+                self._idle -= 1
+        if start:
+            t = threading.Thread(target=self._worker)
+            t.daemon = True
+            t.start()
+        self._calls.put(call)
 
 
-# time in seconds between each call to t.join() for child thread
+worker_pool = WorkerPool()
+
+
+# longest time in seconds a wait in the main thread goes without
+# checking for SIGINT
 POLL_TIME_INCR = 0.5
 
 
 def run_in_thread(target, *args, **kwargs):
-    interrupt = False
+    """
+    Call target on a worker_pool thread and wait for it, for up to
+    timeout seconds if a timeout keyword argument is given.  On timeout,
+    or if interrupted by SIGINT, give up on the call and return
+    (-EINTR, None, 'Interrupted!').
+    """
     timeout = kwargs.pop('timeout', 0)
-    countdown = timeout
-    t = RadosThread(target, *args, **kwargs)
-
-    # allow the main thread to exit (presumably, avoid a join() on this
-    # subthread) before this thread terminates.  This allows SIGINT
-    # exit of a blocked call.  See below.
-    t.daemon = True
-
-    t.start()
+    call = ThreadCall(target, args, kwargs)
+    worker_pool.submit(call)
     try:
-        # poll for thread exit
-        while t.is_alive():
-            t.join(POLL_TIME_INCR)
-            if timeout and t.is_alive():
-                countdown = countdown - POLL_TIME_INCR
-                if countdown <= 0:
-                    raise KeyboardInterrupt
-
-        t.join()        # in case t exits before reaching the join() above
+        if not call.wait(timeout):
+            raise KeyboardInterrupt
     except KeyboardInterrupt:
-        # ..but allow SIGINT to terminate the waiting.  Note: this
-        # relies on the Linux kernel behavior of delivering the signal
-        # to the main thread in preference to any subthread (all that's
-        # strictly guaranteed is that *some* thread that has the signal
-        # unblocked will receive it).  But there doesn't seem to be
-        # any interface to create t with SIGINT blocked.
-        interrupt = True
-
-    if interrupt:
-        t.retval = -errno.EINTR, None, 'Interrupted!'
-    if t.exception:
-        raise t.exception
-    return t.retval
+        # SIGINT terminates the waiting, leaving the call blocked on
+        # its thread.  Note: this relies on the Linux kernel behavior of
+        # delivering the signal to the main thread in preference to any
+        # subthread (all that's strictly guaranteed is that *some*
+        # thread that has the signal unblocked will receive it).  But
+        # there doesn't seem to be any interface to create threads with
+        # SIGINT blocked.
+        return -errno.EINTR, None, 'Interrupted!'
+    return call.result()
 
 
 def send_command_retry(*args, **kwargs):
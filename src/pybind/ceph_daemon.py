@@ -10,81 +10,187 @@ License version 2, as published by the Free Software
 Foundation.  See file COPYING.
 """
 
+import os
 import sys
 import json
+import numbers
 import socket
 import struct
 import time
 from collections import OrderedDict
 from fcntl import ioctl
 from fnmatch import fnmatch
-from prettytable import PrettyTable, HEADER
+from glob import glob
 from signal import signal, SIGWINCH
 from termios import TIOCGWINSZ
 
-from ceph_argparse import parse_json_funcsigs, validate_command
+from ceph_argparse import validate_command, \
+    cached_json_funcsigs, ThreadCall, worker_pool
 
 COUNTER = 0x8
 LONG_RUNNING_AVG = 0x4
-READ_CHUNK_SIZE = 4096
+# recv_into() takes a signed int, i.e. max 2GB; read at most this much
+# per call
+READ_CHUNK_SIZE = 1 << 20
 
 
-def admin_socket(asok_path, cmd, format=''):
+def _recv_exactly(sock, length):
     """
-    Send a daemon (--admin-daemon) command 'cmd'.  asok_path is the
-    path to the admin socket; cmd is a list of strings; format may be
-    set to one of the formatted forms to get output in that form
-    (daemon commands don't support 'plain' output).
+    Read exactly `length` bytes from sock into a single preallocated
+    buffer, without building up intermediate strings.
+
+    :return: bytearray of length `length`
+    """
+    buf = bytearray(length)
+    view = memoryview(buf)
+    got = 0
+    while got < length:
+        want = min(length - got, READ_CHUNK_SIZE)
+        n = sock.recv_into(view[got:got + want], want)
+        if n == 0:
+            raise RuntimeError("admin socket closed after {0} of {1} "
+                               "bytes".format(got, length))
+        got += n
+    return buf
+
+
+def do_sockio(path, cmd_bytes):
     """
+    Send one command to the admin socket at path and return its reply.
 
-    def do_sockio(path, cmd_bytes):
-        """ helper: do all the actual low-level stream I/O """
-        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    The daemon answers a single command on each connection, so this
+    connects afresh every time.  The reply is read straight into a
+    buffer of the length the daemon announces.
+
+    :return: bytearray
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
         sock.connect(path)
+        sock.sendall(cmd_bytes + b'\0')
         try:
-            sock.sendall(cmd_bytes + b'\0')
-            len_str = sock.recv(4)
-            if len(len_str) < 4:
-                raise RuntimeError("no data returned from admin socket")
-            l, = struct.unpack(">I", len_str)
-            sock_ret = b''
-
-            got = 0
-            while got < l:
-                # recv() receives signed int, i.e max 2GB
-                # workaround by capping READ_CHUNK_SIZE per call.
-                want = min(l - got, READ_CHUNK_SIZE)
-                bit = sock.recv(want)
-                sock_ret += bit
-                got += len(bit)
-
-        except Exception as sock_e:
-            raise RuntimeError('exception: ' + str(sock_e))
-        return sock_ret
+            len_str = _recv_exactly(sock, 4)
+        except RuntimeError:
+            raise RuntimeError("no data returned from admin socket")
+        l, = struct.unpack(">I", bytes(len_str))
+        return _recv_exactly(sock, l)
+    except Exception as sock_e:
+        raise RuntimeError('exception: ' + str(sock_e))
+    finally:
+        sock.close()
+
+
+class AdminSocketClient(object):
+    """
+    Send commands to one daemon's admin socket.
+
+    The daemon's command descriptions are fetched (or taken from
+    sig_cache, a ceph_argparse.SigCache) the first time a command is
+    sent, and reused for later commands for as long as the socket is the
+    same one, i.e. the daemon hasn't restarted.  Programs sending many
+    commands to a daemon, like daemonperf, should keep one of these
+    rather than calling admin_socket() each time.
+    """
 
-    try:
-        cmd_json = do_sockio(asok_path,
+    def __init__(self, asok_path, sig_cache=None):
+        self.asok_path = asok_path
+        self.sig_cache = sig_cache
+
+        # (inode, mtime) of the socket that _sigdict came from
+        self._socket_id = None
+        self._sigdict = None
+
+    def _get_socket_id(self):
+        # A restarted daemon recreates its socket
+        try:
+            st = os.stat(self.asok_path)
+        except OSError:
+            return None
+        return st.st_ino, int(st.st_mtime)
+
+    def get_command_descriptions(self):
+        try:
+            return do_sockio(self.asok_path,
                              b'{"prefix": "get_command_descriptions"}')
-    except Exception as e:
-        raise RuntimeError('exception getting command descriptions: ' + str(e))
+        except Exception as e:
+            raise RuntimeError('exception getting command descriptions: ' + str(e))
+
+    def _get_sigdict(self, socket_id, refresh=False):
+        key = None
+        if self.sig_cache is not None and socket_id is not None:
+            key = ('asok', os.path.abspath(self.asok_path)) + socket_id + \
+                ('cli',)
+            if refresh:
+                self.sig_cache.invalidate(key)
+        return cached_json_funcsigs(
+            self.sig_cache if key else None, key,
+            lambda: self.get_command_descriptions().decode('utf-8'), 'cli')
+
+    def validate(self, cmd):
+        """
+        Validate cmd, a list of strings, against the daemon's commands.
 
-    if cmd == 'get_command_descriptions':
-        return cmd_json
+        :return: dict of the command's arguments, to be sent to the daemon
+        """
+        socket_id = self._get_socket_id()
+        cached = False
+        if self._sigdict is None or socket_id != self._socket_id:
+            self._sigdict, cached = self._get_sigdict(socket_id)
+            self._socket_id = socket_id
+        # only descriptions just read from sig_cache can be stale
+        valid_dict = validate_command(self._sigdict, cmd, quiet=cached)
+        if not valid_dict and cached:
+            # maybe the daemon registered more commands since we cached them
+            self._sigdict, cached = self._get_sigdict(socket_id, refresh=True)
+            valid_dict = validate_command(self._sigdict, cmd)
+        if not valid_dict:
+            raise RuntimeError('invalid command')
+        return valid_dict
+
+    def command(self, cmd, format=''):
+        """
+        Send a command; cmd is a list of strings; format may be set to
+        one of the formatted forms to get output in that form (daemon
+        commands don't support 'plain' output).
 
-    sigdict = parse_json_funcsigs(cmd_json.decode('utf-8'), 'cli')
-    valid_dict = validate_command(sigdict, cmd)
-    if not valid_dict:
-        raise RuntimeError('invalid command')
+        :return: bytearray of the daemon's reply
+        """
+        if cmd == 'get_command_descriptions':
+            return self.get_command_descriptions()
 
-    if format:
-        valid_dict['format'] = format
+        valid_dict = self.validate(cmd)
+        if format:
+            valid_dict['format'] = format
 
-    try:
-        ret = do_sockio(asok_path, json.dumps(valid_dict).encode('utf-8'))
-    except Exception as e:
-        raise RuntimeError('exception: ' + str(e))
+        try:
+            return do_sockio(self.asok_path,
+                             json.dumps(valid_dict).encode('utf-8'))
+        except Exception as e:
+            raise RuntimeError('exception: ' + str(e))
 
-    return ret
+    def command_json(self, cmd, **kwargs):
+        """
+        Send a command and decode its JSON reply; kwargs are passed to
+        json.loads()
+        """
+        return json.loads(self.command(cmd, 'json').decode('utf-8'),
+                          **kwargs)
+
+
+def admin_socket(asok_path, cmd, format='', sig_cache=None):
+    """
+    Send a daemon (--admin-daemon) command 'cmd'.  asok_path is the
+    path to the admin socket; cmd is a list of strings; format may be
+    set to one of the formatted forms to get output in that form
+    (daemon commands don't support 'plain' output).
+
+    If sig_cache (a ceph_argparse.SigCache) is given, the daemon's
+    command descriptions are taken from it while the socket is the same
+    one they were fetched from, i.e. the daemon hasn't restarted.
+
+    :return: bytearray of the daemon's reply
+    """
+    return AdminSocketClient(asok_path, sig_cache).command(cmd, format)
 
 
 class Termsize(object):
@@ -145,6 +251,7 @@ class DaemonWatcher(object):
 
     def __init__(self, asok, statpats=None, min_prio=0):
         self.asok_path = asok
+        self._client = AdminSocketClient(asok)
         self._colored = False
 
         self._stats = None
@@ -154,6 +261,10 @@ class DaemonWatcher(object):
         self._min_prio = min_prio
         self.termsize = Termsize()
 
+        # Room kept at the start of each row for a daemon name, when
+        # showing several daemons
+        self._label_width = 0
+
     def supports_color(self, ostr):
         """
         Returns True if the running system's terminal supports color, and False
@@ -222,7 +333,7 @@ class DaemonWatcher(object):
         '''
         current_fit = OrderedDict()
         if self.termsize.changed or not self._stats_that_fit:
-            width = 0
+            width = self._label_width
             for section_name, names in self._stats.items():
                 for name, stat_data in names.items():
                     width += self.col_width(stat_data) + 1
@@ -244,7 +355,7 @@ class DaemonWatcher(object):
         """
         Print a header row to `ostr`
         """
-        header = ""
+        header = self._label_width * ' '
         stats, _ = self.get_stats_that_fit()
         for section_name, names in stats.items():
             section_width = \
@@ -258,7 +369,7 @@ class DaemonWatcher(object):
         header += "\n"
         ostr.write(self.colorize(header, self.BLUE, True))
 
-        sub_header = ""
+        sub_header = self._label_width * ' '
         for section_name, names in stats.items():
             for stat_name, stat_nick in names.items():
                 sub_header += self.UNDERLINE_SEQ \
@@ -270,10 +381,10 @@ class DaemonWatcher(object):
         sub_header += "\n"
         ostr.write(sub_header)
 
-    def _print_vals(self, ostr, dump, last_dump):
+    def _print_vals(self, ostr, dump, last_dump, label=''):
         """
         Print a single row of values to `ostr`, based on deltas between `dump` and
-        `last_dump`.
+        `last_dump`, starting with `label` if we have room for one.
         """
         val_row = ""
         fit, changed = self.get_stats_that_fit()
@@ -303,6 +414,9 @@ class DaemonWatcher(object):
             val_row = val_row[0:-1]
             val_row += self.colorize("|", self.BLUE)
         val_row = val_row[0:-len(self.colorize("|", self.BLUE))]
+        if self._label_width:
+            val_row = label[0:self._label_width - 1].ljust(
+                self._label_width) + val_row
         ostr.write("{0}\n".format(val_row))
 
     def _should_include(self, sect, name, prio):
@@ -333,9 +447,8 @@ class DaemonWatcher(object):
         Populate our instance-local copy of the daemon's performance counter
         schema, and work out which stats we will display.
         """
-        self._schema = json.loads(
-            admin_socket(self.asok_path, ["perf", "schema"]).decode('utf-8'),
-            object_pairs_hook=OrderedDict)
+        self._schema = self._client.command_json(
+            ["perf", "schema"], object_pairs_hook=OrderedDict)
 
         # Build list of which stats we will display
         self._stats = OrderedDict()
@@ -364,13 +477,13 @@ class DaemonWatcher(object):
 
         self._print_headers(ostr)
 
-        last_dump = json.loads(admin_socket(self.asok_path, ["perf", "dump"]).decode('utf-8'))
+        last_dump = self._client.command_json(["perf", "dump"])
         rows_since_header = 0
 
         try:
             signal(SIGWINCH, self._handle_sigwinch)
             while True:
-                dump = json.loads(admin_socket(self.asok_path, ["perf", "dump"]).decode('utf-8'))
+                dump = self._client.command_json(["perf", "dump"])
                 if rows_since_header >= self.termsize.rows - 2:
                     self._print_headers(ostr)
                     rows_since_header = 0
@@ -394,6 +507,9 @@ class DaemonWatcher(object):
         """
         Show all selected stats with section, full name, nick, and prio
         """
+        # imported here to keep it off the CLI's startup path
+        from prettytable import PrettyTable, HEADER
+
         table = PrettyTable(('section', 'name', 'nick', 'prio'))
         table.align['section'] = 'l'
         table.align['name'] = 'l'
@@ -405,3 +521,177 @@ class DaemonWatcher(object):
                 prio = self._schema[section_name][name].get('priority') or 0
                 table.add_row((section_name, name, nick, prio))
         ostr.write(table.get_string(hrules=HEADER) + '\n')
+
+
+def discover_asoks(run_dir):
+    """
+    Find the admin sockets in run_dir, e.g. /var/run/ceph
+
+    :return: dict of daemon name (e.g. 'osd.0') to socket path
+    """
+    asoks = {}
+    for path in glob(os.path.join(run_dir, '*.asok')):
+        name = os.path.basename(path)[:-len('.asok')]
+        # strip the cluster name, as in ceph-osd.0.asok
+        if '-' in name:
+            name = name.split('-', 1)[1]
+        asoks[name] = path
+    return asoks
+
+
+def _sum_dumps(dumps):
+    """
+    Add up several perf dumps, counter by counter; averages have their
+    sums and counts added, so the total shows the overall average.
+    """
+    total = OrderedDict()
+    for dump in dumps:
+        for key, val in dump.items():
+            if isinstance(val, dict):
+                total[key] = _sum_dumps([total.get(key, {}), val])
+            elif isinstance(val, numbers.Number):
+                total[key] = total.get(key, 0) + val
+    return total
+
+
+class MultiDaemonWatcher(object):
+    """
+    Like DaemonWatcher, for all the daemons with admin sockets in a
+    directory at once.  Each interval, every daemon is polled at the
+    same time; daemons are shown one row each, grouped by type and
+    version, with a row for the total of each group.
+
+    The perf counter schema is only fetched once for each daemon type
+    and version.
+    """
+    def __init__(self, asoks, statpats=None, min_prio=0):
+        """
+        :param asoks: dict of daemon name to admin socket path
+        """
+        self.asoks = asoks
+        self._statpats = statpats
+        self._min_prio = min_prio
+        self._clients = dict((name, AdminSocketClient(path))
+                             for name, path in asoks.items())
+
+        # Map of (daemon type, version) to a DaemonWatcher holding the
+        # schema, used to format that group's rows
+        self._watchers = OrderedDict()
+        # Map of (daemon type, version) to list of daemon names
+        self._groups = OrderedDict()
+
+    @staticmethod
+    def _in_parallel(fn, names):
+        """
+        Call fn(name) for each name, all at once, on worker_pool threads
+
+        :return: dict of name to fn's result, or None where it failed
+        """
+        calls = OrderedDict((name, ThreadCall(fn, (name,)))
+                            for name in names)
+        for call in calls.values():
+            worker_pool.submit(call)
+
+        results = {}
+        for name, call in calls.items():
+            call.wait()
+            try:
+                results[name] = call.result()
+            except Exception:
+                results[name] = None
+        return results
+
+    def _load_schemas(self):
+        versions = self._in_parallel(
+            lambda name: self._clients[name].command_json(
+                ["version"])['version'],
+            self.asoks.keys())
+
+        self._groups = OrderedDict()
+        for name in sorted(self.asoks):
+            if versions[name] is None:
+                sys.stderr.write("daemonperf: can't contact {0}, "
+                                 "skipping\n".format(name))
+                continue
+            key = (name.split('.')[0], versions[name])
+            if key not in self._watchers:
+                watcher = DaemonWatcher(self.asoks[name], self._statpats,
+                                        self._min_prio)
+                watcher._client = self._clients[name]
+                watcher._load_schema()
+                self._watchers[key] = watcher
+            self._groups.setdefault(key, []).append(name)
+        if not self._groups:
+            raise RuntimeError("no daemons to watch")
+
+        label_width = max(len(name) for names in self._groups.values()
+                          for name in names + ['total']) + 1
+        for watcher in self._watchers.values():
+            watcher._label_width = label_width
+
+    def _dump(self, names):
+        return self._in_parallel(
+            lambda name: self._clients[name].command_json(["perf", "dump"]),
+            names)
+
+    def _handle_sigwinch(self, signo, frame):
+        for watcher in self._watchers.values():
+            watcher.termsize.update()
+
+    def run(self, interval, count=None, ostr=sys.stdout):
+        """
+        Print output at regular intervals until interrupted.
+
+        :param ostr: Stream to which to send output
+        """
+        self._load_schemas()
+        for watcher in self._watchers.values():
+            watcher._colored = watcher.supports_color(ostr)
+
+        names = [name for group in self._groups.values() for name in group]
+        last_dumps = self._dump(names)
+
+        try:
+            signal(SIGWINCH, self._handle_sigwinch)
+            while True:
+                # time.sleep() is interrupted by SIGWINCH; avoid that
+                end = time.time() + interval
+                while time.time() < end:
+                    time.sleep(end - time.time())
+
+                dumps = self._dump(names)
+                for key, group in self._groups.items():
+                    watcher = self._watchers[key]
+                    watcher._print_headers(ostr)
+                    polled = [name for name in group
+                              if dumps[name] is not None and
+                              last_dumps[name] is not None]
+                    for name in polled:
+                        watcher._print_vals(ostr, dumps[name],
+                                            last_dumps[name], name)
+                    if len(polled) > 1:
+                        watcher._print_vals(
+                            ostr,
+                            _sum_dumps([dumps[name] for name in polled]),
+                            _sum_dumps([last_dumps[name] for name in polled]),
+                            'total')
+                ostr.write('\n')
+                ostr.flush()
+                last_dumps = dumps
+
+                if count is not None:
+                    count -= 1
+                    if count <= 0:
+                        break
+
+        except KeyboardInterrupt:
+            return
+
+    def list(self, ostr=sys.stdout):
+        """
+        Show all selected stats of each type of daemon
+        """
+        self._load_schemas()
+        for key, group in self._groups.items():
+            ostr.write("{0} ({1}):\n".format(', '.join(group), key[1]))
+            self._watchers[key].list(ostr)
@@ -7,6 +7,8 @@ import logging.handlers
 import os
 import rados
 import textwrap
+import threading
+import time
 import xml.etree.ElementTree
 import xml.sax.saxutils
 
@@ -14,7 +16,7 @@ import flask
 from ceph_argparse import \
     ArgumentError, CephPgid, CephOsdName, CephChoices, CephPrefix, \
     concise_sig, descsort, parse_funcsig, parse_json_funcsigs, \
-    validate, json_command
+    validate, json_command, SigCache, cached_json_funcsigs
 
 #
 # Globals and defaults
@@ -35,6 +37,11 @@ DEFAULT_TIMEOUT = 20
 # and retry in that case.
 DEFAULT_TRIES = 5
 
+# cluster connections per process (restapi_cluster_handles)
+DEFAULT_CLUSTER_HANDLES = 4
+# seconds to reuse read-only command responses for (restapi_cache_ttl)
+DEFAULT_CACHE_TTL = 1.0
+
 # 'app' must be global for decorators, etc.
 APPNAME = '__main__'
 app = flask.Flask(APPNAME)
@@ -70,6 +77,128 @@ def find_up_osd(app):
 METHOD_DICT = {'r': ['GET'], 'w': ['PUT', 'DELETE']}
 
 
+class ClusterPool(object):
+    '''
+    Up to `size` connected cluster handles, each used by one request at
+    a time, so that a threaded WSGI server can have several commands in
+    flight.  Handles are opened as needed; a request finding them all
+    busy waits for one.
+
+    librados handles don't survive fork(), so a process that finds it
+    isn't the one that opened the handles (a pre-forking WSGI server's
+    worker) starts a pool of its own.
+    '''
+    def __init__(self, clientname, conf, args, size, first=None):
+        self.clientname = clientname
+        self.conf = conf
+        self.args = args
+        self.size = max(1, size)
+        self._cond = threading.Condition()
+        self._pid = os.getpid()
+        self._free = [first] if first else []
+        self._opened = len(self._free)
+
+    def _open(self):
+        cluster = rados.Rados(name=self.clientname, conffile=self.conf)
+        cluster.conf_parse_argv(self.args)
+        cluster.connect()
+        return cluster
+
+    def get(self):
+        with self._cond:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._free = []
+                self._opened = 0
+            while not self._free and self._opened >= self.size:
+                self._cond.wait()
+            if self._free:
+                return self._free.pop()
+            self._opened += 1
+        try:
+            return self._open()
+        except Exception:
+            with self._cond:
+                self._opened -= 1
+                self._cond.notify()
+            raise
+
+    def put(self, cluster):
+        with self._cond:
+            if self._pid == os.getpid():
+                self._free.append(cluster)
+                self._cond.notify()
+
+
+class ResponseCache(object):
+    '''
+    Results of read-only commands, reused for identical requests made
+    within `ttl` seconds, so that many clients polling the same status
+    don't each send it to the cluster.
+    '''
+    # drop expired entries whenever the cache grows past this
+    MAX_ENTRIES = 1024
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, key):
+        '''
+        :return: (ret, outbuf, outs) cached under key, or None
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or time.time() - entry[0] > self.ttl:
+            return None
+        return entry[1]
+
+    def put(self, key, result):
+        now = time.time()
+        with self._lock:
+            if len(self._entries) >= self.MAX_ENTRIES:
+                for k, (stamp, _) in list(self._entries.items()):
+                    if now - stamp > self.ttl:
+                        del self._entries[k]
+            if len(self._entries) < self.MAX_ENTRIES:
+                self._entries[key] = (now, result)
+
+
+class ParamValidator(object):
+    '''
+    Validator for the query parameters of one endpoint, built once at
+    setup.  Requests whose parameter names can't fit the signature are
+    rejected from the precomputed names, without running validate().
+    '''
+    def __init__(self, paramsig):
+        self.paramsig = paramsig
+        self.names = frozenset(desc.name for desc in paramsig)
+        self.required = frozenset(desc.name for desc in paramsig
+                                  if desc.req)
+
+    def __call__(self, args):
+        unknown = set(args) - self.names
+        if unknown:
+            raise ArgumentError('unknown parameters: ' +
+                                ', '.join(sorted(unknown)))
+        missing = self.required - set(args)
+        if missing:
+            raise ArgumentError('missing required parameters: ' +
+                                ', '.join(sorted(missing)))
+        return validate(args, self.paramsig)
+
+
+def conf_get_number(cluster, option, default, conv):
+    '''
+    Config option converted by conv, or default if it isn't set
+    '''
+    try:
+        return conv(cluster.conf_get(option))
+    except Exception:
+        return default
+
+
 def api_setup(app, conf, cluster, clientname, clientid, args):
     '''
     This is done globally, and cluster connection kept open for
@@ -81,26 +210,38 @@ def api_setup(app, conf, cluster, clientname, clientid, args):
     dict.  Also save app.ceph_sigdict for help() handling.
     '''
     def get_command_descriptions(cluster, target=('mon', '')):
-        ret, outbuf, outs = json_command(cluster, target,
-                                         prefix='get_command_descriptions',
-                                         timeout=30)
-        if ret:
-            err = "Can't get command descriptions: {0}".format(outs)
-            app.logger.error(err)
-            raise EnvironmentError(ret, err)
-
+        def fetch():
+            ret, outbuf, outs = json_command(cluster, target,
+                                             prefix='get_command_descriptions',
+                                             timeout=30)
+            if ret:
+                err = "Can't get command descriptions: {0}".format(outs)
+                app.logger.error(err)
+                raise EnvironmentError(ret, err)
+            return outbuf
+
+        key = (cluster.get_fsid(), target[0], str(cluster.version()), 'rest')
         try:
-            sigdict = parse_json_funcsigs(outbuf, 'rest')
+            sigdict, cached = cached_json_funcsigs(app.ceph_sig_cache, key,
+                                                   fetch, 'rest')
+        except EnvironmentError:
+            raise
         except Exception as e:
             err = "Can't parse command descriptions: {}".format(e)
             app.logger.error(err)
             raise EnvironmentError(err)
+        if cached:
+            app.logger.debug("using cached command descriptions for %s",
+                             target[0])
+        app.ceph_sig_cache_keys.append(key)
         return sigdict
 
     app.ceph_cluster = cluster or 'ceph'
     app.ceph_urls = {}
     app.ceph_sigdict = {}
     app.ceph_baseurl = ''
+    app.ceph_sig_cache = SigCache()
+    app.ceph_sig_cache_keys = []
 
     conf = conf or ''
     cluster = cluster or 'ceph'
@@ -111,6 +252,15 @@ def api_setup(app, conf, cluster, clientname, clientid, args):
     app.ceph_cluster.conf_parse_argv(args)
     app.ceph_cluster.connect()
 
+    app.ceph_cluster_pool = ClusterPool(
+        clientname, conf, args,
+        conf_get_number(app.ceph_cluster, 'restapi_cluster_handles',
+                        DEFAULT_CLUSTER_HANDLES, int),
+        first=app.ceph_cluster)
+    app.ceph_response_cache = ResponseCache(
+        conf_get_number(app.ceph_cluster, 'restapi_cache_ttl',
+                        DEFAULT_CACHE_TTL, float))
+
     app.ceph_baseurl = app.ceph_cluster.conf_get('restapi_base_url') \
         or DEFAULT_BASEURL
     if app.ceph_baseurl.endswith('/'):
@@ -187,6 +337,7 @@ def api_setup(app, conf, cluster, clientname, clientid, args):
             if k in perm:
                 methods = METHOD_DICT[k]
         urldict = {'paramsig': params,
+                   'validator': ParamValidator(params),
                    'help': cmddict['help'],
                    'module': cmddict['module'],
                    'perm': perm,
@@ -321,11 +472,12 @@ def root_redir():
     return flask.redirect(app.ceph_baseurl)
 
 
-def make_response(fmt, output, statusmsg, errorcode):
+def make_response(fmt, output, statusmsg, errorcode, content_type=False):
     '''
     If formatted output, cobble up a response object that contains the
     output and status wrapped in enclosing objects; if nonformatted, just
     use output+status.  Return HTTP status errorcode in any event.
+    If content_type is set, label the response with the type of fmt.
     '''
     response = output
     if fmt:
@@ -362,7 +514,14 @@ def make_response(fmt, output, statusmsg, errorcode):
         if not 200 <= errorcode < 300:
             response = response + '\n' + statusmsg + '\n'
 
-    return flask.make_response(response, errorcode)
+    response = flask.make_response(response, errorcode)
+    if content_type:
+        if fmt:
+            contenttype = 'application/' + fmt.replace('-pretty', '')
+        else:
+            contenttype = 'text/plain'
+        response.headers['Content-Type'] = contenttype
+    return response
 
 
 def handler(catchall_path=None, fmt=None, target=None):
@@ -459,7 +618,7 @@ def handler(catchall_path=None, fmt=None, target=None):
 
             # is this a valid set of params?
             try:
-                argdict = validate(args, paramsig)
+                argdict = urldict['validator'](args)
                 found = urldict
                 break
             except Exception as e:
@@ -484,29 +643,47 @@ def handler(catchall_path=None, fmt=None, target=None):
     if not cmdtarget:
         cmdtarget = ('mon', '')
 
+    # read-only commands can be answered from a recent identical request
+    cache_key = None
+    if found['perm'] == 'r' and app.ceph_response_cache.ttl > 0 and \
+            not flask.request.data:
+        cache_key = (prefix, cmdtarget, json.dumps(argdict, sort_keys=True))
+        cached = app.ceph_response_cache.get(cache_key)
+        if cached is not None:
+            app.logger.debug('cached response for prefix %s argdict %s',
+                             prefix, argdict)
+            ret, outbuf, outs = cached
+            return make_response(fmt, outbuf, outs or 'OK', 200,
+                                 content_type=True)
+
     app.logger.debug('sending command prefix %s argdict %s', prefix, argdict)
 
-    for _ in range(DEFAULT_TRIES):
-        ret, outbuf, outs = json_command(app.ceph_cluster, prefix=prefix,
-                                         target=cmdtarget,
-                                         inbuf=flask.request.data,
-                                         argdict=argdict,
-                                         timeout=DEFAULT_TIMEOUT)
-        if ret != -errno.EINTR:
-            break
-    else:
-        return make_response(fmt, '',
-                             'Timedout: {0} ({1})'.format(outs, ret), 504)
+    cluster = app.ceph_cluster_pool.get()
+    try:
+        for _ in range(DEFAULT_TRIES):
+            ret, outbuf, outs = json_command(cluster, prefix=prefix,
+                                             target=cmdtarget,
+                                             inbuf=flask.request.data,
+                                             argdict=argdict,
+                                             timeout=DEFAULT_TIMEOUT)
+            if ret != -errno.EINTR:
+                break
+        else:
+            return make_response(fmt, '',
+                                 'Timedout: {0} ({1})'.format(outs, ret), 504)
+    finally:
+        app.ceph_cluster_pool.put(cluster)
     if ret:
+        if ret == -errno.EINVAL:
+            # our endpoints may have come from out-of-date cached command
+            # descriptions; make sure the next restart fetches them again
+            for key in app.ceph_sig_cache_keys:
+                app.ceph_sig_cache.invalidate(key)
         return make_response(fmt, '', 'Error: {0} ({1})'.format(outs, ret), 400)
 
-    response = make_response(fmt, outbuf, outs or 'OK', 200)
-    if fmt:
-        contenttype = 'application/' + fmt.replace('-pretty', '')
-    else:
-        contenttype = 'text/plain'
-    response.headers['Content-Type'] = contenttype
-    return response
+    if cache_key is not None:
+        app.ceph_response_cache.put(cache_key, (ret, outbuf, outs))
+    return make_response(fmt, outbuf, outs or 'OK', 200, content_type=True)
 
 
 #
@@ -4,6 +4,7 @@ Copyright (C) 2015 Red Hat, Inc.
 LGPL2.  See file COPYING.
 """
 
+from collections import deque
 from contextlib import contextmanager
 import errno
 import fcntl
@@ -17,6 +18,11 @@ import threading
 import time
 import uuid
 
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
 from ceph_argparse import json_command
 
 import cephfs
@@ -83,6 +89,59 @@ class ClusterError(Exception):
             self._result_code, self._result_str, self._action)
 
 
+class MDSMapWatcher(object):
+    """
+    Fetch the MDS map on behalf of any number of threads waiting for it to
+    change, e.g. the RankEvicters of concurrent evictions.
+
+    Callers asking for a map at the same time share one `fs dump`, and
+    fetches are at least POLL_PERIOD apart, so waiting threads see each
+    change within a fraction of a second without each polling the mons.
+    """
+    POLL_PERIOD = 0.5
+
+    def __init__(self, volume_client):
+        self._volume_client = volume_client
+        self._cond = threading.Condition()
+        self._mds_map = None
+        self._fetched_at = 0
+        self._fetching = False
+
+    def fetch(self, after=None):
+        """
+        Return an MDS map fetched from the mons after time `after`
+        (default: now), waiting for one if need be.
+        """
+        if after is None:
+            after = time.time()
+
+        with self._cond:
+            while True:
+                if self._fetched_at > after:
+                    return self._mds_map
+                if not self._fetching:
+                    # Our turn to fetch it for everyone waiting
+                    self._fetching = True
+                    break
+                self._cond.wait()
+
+        mds_map = None
+        try:
+            delay = self._fetched_at + self.POLL_PERIOD - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            mds_map = self._volume_client.get_mds_map()
+        finally:
+            with self._cond:
+                self._fetching = False
+                if mds_map is not None:
+                    self._mds_map = mds_map
+                    self._fetched_at = time.time()
+                self._cond.notify_all()
+
+        return mds_map
+
+
 class RankEvicter(threading.Thread):
     """
     Thread for evicting client(s) from a particular MDS daemon instance.
@@ -94,17 +153,16 @@ class RankEvicter(threading.Thread):
     class GidGone(Exception):
         pass
 
-    POLL_PERIOD = 5
-
-    def __init__(self, volume_client, client_spec, rank, gid, mds_map, ready_timeout):
+    def __init__(self, volume_client, client_specs, rank, gid, mds_map, ready_timeout):
         """
-        :param client_spec: list of strings, used as filter arguments to "session evict"
-                            pass ["id=123"] to evict a single client with session id 123.
+        :param client_specs: list of lists of strings, each used as filter arguments
+                             to one "session evict": pass [["id=123"]] to evict a single
+                             client with session id 123.
         """
         self.rank = rank
         self.gid = gid
         self._mds_map = mds_map
-        self._client_spec = client_spec
+        self._client_specs = client_specs
         self._volume_client = volume_client
         self._ready_timeout = ready_timeout
         self._ready_waited = 0
@@ -117,7 +175,7 @@ class RankEvicter(threading.Thread):
     def _ready_to_evict(self):
         if self._mds_map['up'].get("mds_{0}".format(self.rank), None) != self.gid:
             log.info("Evicting {0} from {1}/{2}: rank no longer associated with gid, done.".format(
-                self._client_spec, self.rank, self.gid
+                self._client_specs, self.rank, self.gid
             ))
             raise RankEvicter.GidGone()
 
@@ -134,10 +192,9 @@ class RankEvicter(threading.Thread):
             if self._ready_waited > self._ready_timeout:
                 raise ClusterTimeout()
 
-            time.sleep(self.POLL_PERIOD)
-            self._ready_waited += self.POLL_PERIOD
-
-            self._mds_map = self._volume_client.get_mds_map()
+            started = time.time()
+            self._mds_map = self._volume_client._mds_map_watcher.fetch()
+            self._ready_waited += time.time() - started
 
     def _evict(self):
         """
@@ -150,26 +207,29 @@ class RankEvicter(threading.Thread):
         except self.GidGone:
             return True
 
-        # Then send it an evict
-        ret = errno.ETIMEDOUT
-        while ret == errno.ETIMEDOUT:
+        # Then send it an evict for each spec.  The MDS ANDs the filters
+        # of one "session evict", so several specs can't share one command,
+        # but they do share the wait for the rank to be ready.
+        client_specs = list(self._client_specs)
+        while client_specs:
+            client_spec = client_specs[0]
             log.debug("mds_command: {0}, {1}".format(
-                "%s" % self.gid, ["session", "evict"] + self._client_spec
+                "%s" % self.gid, ["session", "evict"] + client_spec
             ))
             ret, outb, outs = self._volume_client.fs.mds_command(
                 "%s" % self.gid,
                 [json.dumps({
                                 "prefix": "session evict",
-                                "filters": self._client_spec
+                                "filters": client_spec
                 })], "")
             log.debug("mds_command: complete {0} {1}".format(ret, outs))
 
             # If we get a clean response, great, it's gone from that rank.
             if ret == 0:
-                return True
+                client_specs.pop(0)
             elif ret == errno.ETIMEDOUT:
                 # Oh no, the MDS went laggy (that's how libcephfs knows to emit this error)
-                self._mds_map = self._volume_client.get_mds_map()
+                self._mds_map = self._volume_client._mds_map_watcher.fetch()
                 try:
                     self._wait_for_ready()
                 except self.GidGone:
@@ -177,6 +237,8 @@ class RankEvicter(threading.Thread):
             else:
                 raise ClusterError("Sending evict to mds.{0}".format(self.gid), ret, outs)
 
+        return True
+
     def run(self):
         try:
             self._evict()
@@ -230,6 +292,25 @@ class CephFSVolumeClient(object):
     # Current version
     version = 2
 
+    # Threads used to remove (purge_volume) or copy (clone_volume_to_existing)
+    # a volume's tree
+    PURGE_WORKERS = 8
+    # Entries removed (purge_volume) or copied (clone_volume_to_existing)
+    # between checkpoints of their progress
+    PURGE_CHECKPOINT_INTERVAL = 1000
+    # Seconds between the checks, by the thread running a purge or copy,
+    # for whether a checkpoint is due
+    CHECKPOINT_POLL_INTERVAL = 1.0
+    # Bytes read and written at a time when cloning a file: one object of
+    # the default file layout.  Files larger than this have their chunks
+    # copied in parallel.
+    CLONE_CHUNK_SIZE = 4 * 1024 * 1024
+    # Bytes per read or write when streaming objects (get_object_chunks,
+    # put_object) and metadata files, and how many of those RADOS ops
+    # may be in flight at once
+    IO_CHUNK_SIZE = 4 * 1024 * 1024
+    IO_MAX_IN_FLIGHT = 8
+
     # Where shall we create our volumes?
     POOL_PREFIX = "fsvolume_"
     DEFAULT_VOL_PREFIX = "/volumes"
@@ -250,6 +331,9 @@ class CephFSVolumeClient(object):
         # UUID
         self._id = struct.unpack(">Q", uuid.uuid1().get_bytes()[0:8])[0]
 
+        # Shared by the RankEvicters of all our evictions
+        self._mds_map_watcher = MDSMapWatcher(self)
+
         # TODO: version the on-disk structures
 
     def recover(self):
@@ -383,15 +467,25 @@ class CephFSVolumeClient(object):
         This operation can throw an exception if the mon cluster is unresponsive, or
         any individual MDS daemon is unresponsive for longer than the timeout passed in.
         """
+        self.evict_many([auth_id], timeout=timeout, volume_path=volume_path)
 
-        client_spec = ["auth_name={0}".format(auth_id), ]
-        if volume_path:
-            client_spec.append("client_metadata.root={0}".
-                               format(self._get_path(volume_path)))
+    def evict_many(self, auth_ids, timeout=30, volume_path=None):
+        """
+        Like evict, for several authorization IDs at once: each MDS rank is
+        waited for, and sent its evictions, once for all of them.
+        """
+        client_specs = []
+        for auth_id in auth_ids:
+            client_spec = ["auth_name={0}".format(auth_id), ]
+            if volume_path:
+                client_spec.append("client_metadata.root={0}".
+                                   format(self._get_path(volume_path)))
+            client_specs.append(client_spec)
 
-        log.info("evict clients with {0}".format(', '.join(client_spec)))
+        log.info("evict clients with {0}".format(
+            '; '.join(', '.join(client_spec) for client_spec in client_specs)))
 
-        mds_map = get_mds_map()
+        mds_map = self._mds_map_watcher.fetch()
         up = {}
         for name, gid in mds_map['up'].items():
             # Quirk of the MDSMap JSON dump: keys in the up dict are like "mds_0"
@@ -403,7 +497,7 @@ class CephFSVolumeClient(object):
         # the latter doesn't give us per-mds output
         threads = []
         for rank, gid in up.items():
-            thread = RankEvicter(self, client_spec, rank, gid, mds_map,
+            thread = RankEvicter(self, client_specs, rank, gid, mds_map,
                                  timeout)
             thread.start()
             threads.append(thread)
@@ -415,8 +509,8 @@ class CephFSVolumeClient(object):
 
         for t in threads:
             if not t.success:
-                msg = ("Failed to evict client with {0} from mds {1}/{2}: {3}".
-                       format(', '.join(client_spec), t.rank, t.gid, t.exception)
+                msg = ("Failed to evict clients with {0} from mds {1}/{2}: {3}".
+                       format(', '.join(auth_ids), t.rank, t.gid, t.exception)
                       )
                 log.error(msg)
                 raise EvictionError(msg)
@@ -683,43 +777,252 @@ class CephFSVolumeClient(object):
         except cephfs.ObjectNotFound:
             pass
 
-    def purge_volume(self, volume_path, data_isolated=False):
+    def _wait_progress(self, wait, progress=None):
+        """
+        Call wait(), calling progress() (if given) from this thread every
+        CHECKPOINT_POLL_INTERVAL seconds until it returns.
+        """
+        if progress is None:
+            wait()
+            return
+
+        done = threading.Event()
+        errors = []
+
+        def waiter():
+            try:
+                wait()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                done.set()
+
+        t = threading.Thread(target=waiter)
+        t.daemon = True
+        t.start()
+        while not done.is_set():
+            done.wait(self.CHECKPOINT_POLL_INTERVAL)
+            if not done.is_set():
+                progress()
+        if errors:
+            raise errors[0]
+
+    def _run_parallel(self, items, fn, workers, progress=None):
+        """
+        Call fn(item) for each of items on up to `workers` threads at
+        once, all sharing our libcephfs mount.  Stops at, and raises, the
+        first exception.  progress(), if given, is called from this
+        thread while the items are worked on, as by _wait_progress.
+        """
+        items = list(items)
+        if workers <= 1 or len(items) <= 1:
+            for item in items:
+                fn(item)
+                if progress:
+                    progress()
+            return
+
+        pending = queue.Queue()
+        for item in items:
+            pending.put(item)
+        errors = []
+
+        def worker():
+            while not errors:
+                try:
+                    item = pending.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    fn(item)
+                except Exception as e:
+                    errors.append(e)
+
+        threads = [threading.Thread(target=worker)
+                   for _ in range(min(workers, len(items)))]
+        for t in threads:
+            t.start()
+
+        def join():
+            for t in threads:
+                t.join()
+        self._wait_progress(join, progress)
+        if errors:
+            raise errors[0]
+
+    def _walk_parallel(self, root_path, on_entry, on_dir=None, workers=1,
+                       progress=None):
+        """
+        Breadth-first walk of the tree under root_path, with up to
+        `workers` directories being listed at once.
+
+        on_entry(dir_path, d) is called for every entry that isn't a
+        directory, and on_dir(dir_path, d) (if given) for every
+        directory, before its contents are listed.  Stops at, and raises,
+        the first exception from either.  progress(), if given, is called
+        from this thread during the walk, as by _wait_progress.
+
+        :return: list of (depth, path) of root_path and all the
+                 directories under it, parents before children
+        """
+        dirs = [(0, root_path)]
+        lock = threading.Lock()
+        pending = queue.Queue()
+        pending.put((0, root_path))
+        errors = []
+
+        def list_dir(depth, dir_path):
+            dir_handle = self.fs.opendir(dir_path)
+            try:
+                d = self.fs.readdir(dir_handle)
+                while d:
+                    if d.d_name not in [".", ".."]:
+                        if d.is_dir():
+                            if on_dir:
+                                on_dir(dir_path, d)
+                            child = (depth + 1,
+                                     "{0}/{1}".format(dir_path, d.d_name))
+                            with lock:
+                                dirs.append(child)
+                            pending.put(child)
+                        else:
+                            on_entry(dir_path, d)
+                    d = self.fs.readdir(dir_handle)
+            finally:
+                self.fs.closedir(dir_handle)
+
+        def worker():
+            while True:
+                item = pending.get()
+                if item is None:
+                    pending.task_done()
+                    return
+                try:
+                    if not errors:
+                        list_dir(*item)
+                except Exception as e:
+                    errors.append(e)
+                finally:
+                    pending.task_done()
+
+        threads = [threading.Thread(target=worker)
+                   for _ in range(max(1, workers))]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        self._wait_progress(pending.join, progress)
+        for t in threads:
+            pending.put(None)
+        for t in threads:
+            t.join()
+
+        if errors:
+            raise errors[0]
+        return dirs
+
+    def purge_volume(self, volume_path, data_isolated=False, workers=None):
         """
         Finish clearing up a volume that was previously passed to delete_volume.  This
         function is idempotent.
+
+        The volume's tree is removed by `workers` (default PURGE_WORKERS)
+        threads at once.  Progress is checkpointed as the purge goes, so
+        that a purge that is interrupted and called again reports its
+        totals from the start.
         """
 
         trash = os.path.join(self.volume_prefix, "_deleting")
         trashed_volume = os.path.join(trash, volume_path.volume_id)
+        # Progress of an earlier, interrupted purge of this volume
+        checkpoint_path = os.path.join(trash, "{0}.purge{1}".format(
+            volume_path.volume_id, META_FILE_EXT))
 
         try:
             self.fs.stat(trashed_volume)
         except cephfs.ObjectNotFound:
             log.warning("Trying to purge volume '{0}' but it's already been purged".format(
                 trashed_volume))
+            try:
+                self.fs.unlink(checkpoint_path)
+            except cephfs.ObjectNotFound:
+                pass
             return
 
-        def rmtree(root_path):
-            log.debug("rmtree {0}".format(root_path))
-            dir_handle = self.fs.opendir(root_path)
-            d = self.fs.readdir(dir_handle)
-            while d:
-                if d.d_name not in [".", ".."]:
-                    # Do not use os.path.join because it is sensitive
-                    # to string encoding, we just pass through dnames
-                    # as byte arrays
-                    d_full = "{0}/{1}".format(root_path, d.d_name)
-                    if d.is_dir():
-                        rmtree(d_full)
-                    else:
-                        self.fs.unlink(d_full)
-
-                d = self.fs.readdir(dir_handle)
-            self.fs.closedir(dir_handle)
-
-            self.fs.rmdir(root_path)
-
-        rmtree(trashed_volume)
+        progress = self._checkpoint_get(checkpoint_path)
+        if not progress:
+            try:
+                rbytes = int(self.fs.getxattr(trashed_volume,
+                                              'ceph.dir.rbytes'))
+            except (cephfs.Error, ValueError):
+                rbytes = 0
+            progress = {'entries': 0, 'bytes': rbytes, 'elapsed': 0.0}
+        else:
+            log.info("purge_volume: resuming purge of {0}, {1} entries "
+                     "already removed".format(trashed_volume,
+                                              progress['entries']))
+
+        lock = threading.Lock()
+        start = time.time()
+        # Entries removed so far, and when last checkpointed
+        removed = [0]
+        checkpointed = [0]
+
+        def checkpoint():
+            with lock:
+                data = dict(progress)
+                data['entries'] += removed[0]
+                data['elapsed'] += time.time() - start
+                checkpointed[0] = removed[0]
+            self._checkpoint_set(checkpoint_path, data)
+            return data
+
+        def maybe_checkpoint():
+            # Called from this thread only, so that checkpoints are
+            # never written concurrently
+            with lock:
+                due = removed[0] - checkpointed[0] >= \
+                    self.PURGE_CHECKPOINT_INTERVAL
+            if due:
+                try:
+                    data = checkpoint()
+                except cephfs.Error as e:
+                    log.warning("purge_volume: failed to checkpoint purge "
+                                "of {0}: {1}".format(trashed_volume, e))
+                else:
+                    log.debug("purge_volume: {0} entries removed from "
+                              "{1}".format(data['entries'], trashed_volume))
+
+        def unlink(dir_path, d):
+            # Do not use os.path.join because it is sensitive
+            # to string encoding, we just pass through dnames
+            # as byte arrays
+            self.fs.unlink("{0}/{1}".format(dir_path, d.d_name))
+            with lock:
+                removed[0] += 1
+
+        def rmdir(path):
+            self.fs.rmdir(path)
+            with lock:
+                removed[0] += 1
+
+        # Files are unlinked while the tree is walked; the directories,
+        # which must be empty, afterwards, deepest first.
+        dirs = self._walk_parallel(trashed_volume, unlink,
+                                   workers=workers or self.PURGE_WORKERS,
+                                   progress=maybe_checkpoint)
+        for depth in sorted(set(depth for depth, _ in dirs), reverse=True):
+            self._run_parallel(
+                [path for d, path in dirs if d == depth], rmdir,
+                workers=workers or self.PURGE_WORKERS,
+                progress=maybe_checkpoint)
+
+        data = checkpoint()
+        self.fs.unlink(checkpoint_path)
+        log.info("purge_volume: purged {0}: {1} entries in {2:.1f}s "
+                 "({3:.0f} entries/s), {4} bytes freed".format(
+                     trashed_volume, data['entries'], data['elapsed'],
+                     data['entries'] / max(data['elapsed'], 0.001),
+                     data['bytes']))
 
         if data_isolated:
             pool_name = "{0}{1}".format(self.POOL_PREFIX, volume_path.volume_id)
@@ -769,9 +1072,18 @@ class CephFSVolumeClient(object):
         Return a deserialized JSON object, or None
         """
         fd = self.fs.open(path, "r")
-        # TODO iterate instead of assuming file < 4MB
-        read_bytes = self.fs.read(fd, 0, 4096 * 1024)
-        self.fs.close(fd)
+        try:
+            chunks = []
+            offset = 0
+            while True:
+                chunk = self.fs.read(fd, offset, self.IO_CHUNK_SIZE)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                offset += len(chunk)
+        finally:
+            self.fs.close(fd)
+        read_bytes = b"".join(chunks)
         if read_bytes:
             return json.loads(read_bytes)
         else:
@@ -781,11 +1093,36 @@ class CephFSVolumeClient(object):
         serialized = json.dumps(data)
         fd = self.fs.open(path, "w")
         try:
-            self.fs.write(fd, serialized, 0)
+            for offset in range(0, len(serialized), self.IO_CHUNK_SIZE):
+                self.fs.write(fd, serialized[offset:offset + self.IO_CHUNK_SIZE],
+                              offset)
             self.fs.fsync(fd, 0)
         finally:
             self.fs.close(fd)
 
+    def _checkpoint_get(self, path):
+        """
+        Return the progress saved by _checkpoint_set, or None if there is
+        none or it can't be read, in which case the work starts over.
+        """
+        try:
+            return self._metadata_get(path)
+        except cephfs.ObjectNotFound:
+            return None
+        except (cephfs.Error, ValueError) as e:
+            log.warning("Ignoring unreadable checkpoint {0}: {1}".format(
+                path, e))
+            return None
+
+    def _checkpoint_set(self, path, data):
+        """
+        Save progress to path, replacing it atomically so that a crash
+        can't leave a partly written checkpoint behind.
+        """
+        tmp_path = path + ".tmp"
+        self._metadata_set(tmp_path, data)
+        self.fs.rename(tmp_path, path)
+
     def _lock(self, path):
         @contextmanager
         def fn():
@@ -815,6 +1152,23 @@ class CephFSVolumeClient(object):
 
         return fn()
 
+    @contextmanager
+    def _lock_many(self, paths):
+        """
+        Take the locks on several paths, in sorted order so that two
+        callers locking overlapping sets can't deadlock.
+        """
+        held = []
+        try:
+            for path in sorted(set(paths)):
+                lock = self._lock(path)
+                lock.__enter__()
+                held.append(lock)
+            yield
+        finally:
+            for lock in reversed(held):
+                lock.__exit__(None, None, None)
+
     def _auth_metadata_path(self, auth_id):
         return os.path.join(self.volume_prefix, "${0}{1}".format(
             auth_id, META_FILE_EXT))
@@ -1014,24 +1368,41 @@ class CephFSVolumeClient(object):
 
         return key
 
-    def _authorize_ceph(self, volume_path, auth_id, readonly):
+    def _get_layout(self, volume_path):
+        """
+        :return: (path, data pool name, pool namespace) of a volume
+        """
         path = self._get_path(volume_path)
-        log.debug("Authorizing Ceph id '{0}' for path '{1}'".format(
-            auth_id, path
-        ))
-
-        # First I need to work out what the data pool is for this share:
-        # read the layout
         pool_name = self._get_ancestor_xattr(path, "ceph.dir.layout.pool")
         namespace = self.fs.getxattr(path, "ceph.dir.layout.pool_namespace")
+        return path, pool_name, namespace
+
+    def _authorize_ceph(self, volume_path, auth_id, readonly):
+        return self._authorize_ceph_layouts(
+            auth_id, [self._get_layout(volume_path) + (readonly,)])
+
+    def _authorize_ceph_layouts(self, auth_id, grants):
+        """
+        Give a Ceph auth identity access to several volumes with one update
+        of its caps.
+
+        :param grants: list of (path, pool_name, namespace, readonly), see
+                       _get_layout
+        :return: the identity's key
+        """
+        log.debug("Authorizing Ceph id '{0}' for paths {1}".format(
+            auth_id, [grant[0] for grant in grants]
+        ))
 
         # Now construct auth capabilities that give the guest just enough
-        # permissions to access the share
+        # permissions to access the shares
         client_entity = "client.{0}".format(auth_id)
-        want_access_level = 'r' if readonly else 'rw'
-        want_mds_cap = 'allow {0} path={1}'.format(want_access_level, path)
-        want_osd_cap = 'allow {0} pool={1} namespace={2}'.format(
-            want_access_level, pool_name, namespace)
+
+        def caps_for(access_level, path, pool_name, namespace):
+            mds_cap = 'allow {0} path={1}'.format(access_level, path)
+            osd_cap = 'allow {0} pool={1} namespace={2}'.format(
+                access_level, pool_name, namespace)
+            return mds_cap, osd_cap
 
         try:
             existing = self._rados_command(
@@ -1042,26 +1413,26 @@ class CephFSVolumeClient(object):
             )
             # FIXME: rados raising Error instead of ObjectNotFound in auth get failure
         except rados.Error:
+            want_mds_caps = []
+            want_osd_caps = []
+            for path, pool_name, namespace, readonly in grants:
+                want_mds_cap, want_osd_cap = caps_for(
+                    'r' if readonly else 'rw', path, pool_name, namespace)
+                want_mds_caps.append(want_mds_cap)
+                want_osd_caps.append(want_osd_cap)
             caps = self._rados_command(
                 'auth get-or-create',
                 {
                     'entity': client_entity,
                     'caps': [
-                        'mds', want_mds_cap,
-                        'osd', want_osd_cap,
+                        'mds', ",".join(want_mds_caps),
+                        'osd', ",".join(want_osd_caps),
                         'mon', 'allow r']
                 })
         else:
             # entity exists, update it
             cap = existing[0]
 
-            # Construct auth caps that if present might conflict with the desired
-            # auth caps.
-            unwanted_access_level = 'r' if want_access_level is 'rw' else 'rw'
-            unwanted_mds_cap = 'allow {0} path={1}'.format(unwanted_access_level, path)
-            unwanted_osd_cap = 'allow {0} pool={1} namespace={2}'.format(
-                unwanted_access_level, pool_name, namespace)
-
             def cap_update(orig, want, unwanted):
                 # Updates the existing auth caps such that there is a single
                 # occurrence of wanted auth caps and no occurrence of
@@ -1077,8 +1448,20 @@ class CephFSVolumeClient(object):
 
                 return ",".join(cap_tokens)
 
-            osd_cap_str = cap_update(cap['caps'].get('osd', ""), want_osd_cap, unwanted_osd_cap)
-            mds_cap_str = cap_update(cap['caps'].get('mds', ""), want_mds_cap, unwanted_mds_cap)
+            osd_cap_str = cap['caps'].get('osd', "")
+            mds_cap_str = cap['caps'].get('mds', "")
+            for path, pool_name, namespace, readonly in grants:
+                want_access_level = 'r' if readonly else 'rw'
+                want_mds_cap, want_osd_cap = caps_for(
+                    want_access_level, path, pool_name, namespace)
+                # Construct auth caps that if present might conflict with the desired
+                # auth caps.
+                unwanted_access_level = 'r' if want_access_level == 'rw' else 'rw'
+                unwanted_mds_cap, unwanted_osd_cap = caps_for(
+                    unwanted_access_level, path, pool_name, namespace)
+
+                osd_cap_str = cap_update(osd_cap_str, want_osd_cap, unwanted_osd_cap)
+                mds_cap_str = cap_update(mds_cap_str, want_mds_cap, unwanted_mds_cap)
 
             caps = self._rados_command(
                 'auth caps',
@@ -1111,6 +1494,123 @@ class CephFSVolumeClient(object):
         assert caps[0]['entity'] == client_entity
         return caps[0]['key']
 
+    def authorize_many(self, grants, workers=None):
+        """
+        Like authorize, for many (volume, auth ID) pairs at once.
+
+        Each auth ID's and each volume's metadata is read and written once
+        per batch rather than once per grant, and each auth ID's caps are
+        updated with one set of mon commands covering all of its volumes.
+        The mon commands for different auth IDs are sent from up to
+        `workers` (default PURGE_WORKERS) threads at once.
+
+        :param grants: list of (volume_path, auth_id, readonly, tenant_id)
+        :return: dict of auth_id to what authorize would have returned
+        """
+        start = time.time()
+
+        # auth_id -> tenant_id, and auth_id -> {volume_path_str: (volume_path, readonly)}
+        tenants = {}
+        auth_volumes = {}
+        # volume_path_str -> volume_path, and volume_path_str -> {auth_id: readonly}
+        volume_paths = {}
+        volume_auths = {}
+        for volume_path, auth_id, readonly, tenant_id in grants:
+            if tenants.setdefault(auth_id, tenant_id).__str__() != tenant_id.__str__():
+                raise CephFSVolumeClientError(
+                    "auth ID: {0} is given different tenants".format(auth_id))
+            volume_path_str = str(volume_path)
+            auth_volumes.setdefault(auth_id, {})[volume_path_str] = (volume_path, readonly)
+            volume_paths[volume_path_str] = volume_path
+            volume_auths.setdefault(volume_path_str, {})[auth_id] = readonly
+
+        auth_paths = [self._auth_metadata_path(auth_id) for auth_id in auth_volumes]
+        vol_meta_paths = [self._volume_metadata_path(volume_path)
+                          for volume_path in volume_paths.values()]
+
+        with self._lock_many(auth_paths):
+            auth_metas = {}
+            for auth_id, volumes in auth_volumes.items():
+                auth_meta = self._auth_metadata_get(auth_id)
+                tenant_id = tenants[auth_id]
+                if auth_meta is None:
+                    log.debug("Authorize: no existing meta for {0}".format(auth_id))
+                    auth_meta = {
+                        'dirty': True,
+                        'tenant_id': tenant_id.__str__() if tenant_id else None,
+                        'volumes': {}
+                    }
+                else:
+                    # Disallow tenants to share auth IDs
+                    if auth_meta['tenant_id'].__str__() != tenant_id.__str__():
+                        msg = "auth ID: {0} is already in use".format(auth_id)
+                        log.error(msg)
+                        raise CephFSVolumeClientError(msg)
+
+                    if auth_meta['dirty']:
+                        self._recover_auth_meta(auth_id, auth_meta)
+                    auth_meta['dirty'] = True
+
+                for volume_path_str, (volume_path, readonly) in volumes.items():
+                    auth_meta['volumes'][volume_path_str] = {
+                        'access_level': 'r' if readonly else 'rw',
+                        'dirty': True,
+                    }
+                self._auth_metadata_set(auth_id, auth_meta)
+                auth_metas[auth_id] = auth_meta
+
+            with self._lock_many(vol_meta_paths):
+                vol_metas = {}
+                layouts = {}
+                for volume_path_str, auths in volume_auths.items():
+                    volume_path = volume_paths[volume_path_str]
+                    vol_meta = self._volume_metadata_get(volume_path) or {'auths': {}}
+                    for auth_id, readonly in auths.items():
+                        vol_meta['auths'][auth_id] = {
+                            'access_level': 'r' if readonly else 'rw',
+                            'dirty': True,
+                        }
+                    self._volume_metadata_set(volume_path, vol_meta)
+                    vol_metas[volume_path_str] = vol_meta
+                    layouts[volume_path_str] = self._get_layout(volume_path)
+
+                keys = {}
+
+                def authorize_ceph(auth_id):
+                    op_start = time.time()
+                    keys[auth_id] = self._authorize_ceph_layouts(auth_id, [
+                        layouts[volume_path_str] + (readonly,)
+                        for volume_path_str, (_, readonly)
+                        in auth_volumes[auth_id].items()])
+                    log.debug("authorize_many: {0} authorized for {1} volumes "
+                              "in {2:.3f}s".format(
+                                  auth_id, len(auth_volumes[auth_id]),
+                                  time.time() - op_start))
+
+                self._run_parallel(auth_volumes.keys(), authorize_ceph,
+                                   workers or self.PURGE_WORKERS)
+
+                for volume_path_str, vol_meta in vol_metas.items():
+                    for auth_id in volume_auths[volume_path_str]:
+                        vol_meta['auths'][auth_id]['dirty'] = False
+                    self._volume_metadata_set(volume_paths[volume_path_str], vol_meta)
+
+            for auth_id, auth_meta in auth_metas.items():
+                auth_meta['dirty'] = False
+                for volume_path_str in auth_volumes[auth_id]:
+                    auth_meta['volumes'][volume_path_str]['dirty'] = False
+                self._auth_metadata_set(auth_id, auth_meta)
+
+        log.info("authorize_many: {0} grants to {1} auth IDs on {2} volumes "
+                 "in {3:.1f}s".format(len(grants), len(auth_volumes),
+                                      len(volume_paths), time.time() - start))
+
+        # As for authorize, callers that aren't multi-tenant aware don't
+        # get keys
+        return dict((auth_id, {
+            'auth_key': keys[auth_id] if tenants[auth_id] else None
+        }) for auth_id in auth_volumes)
+
     def deauthorize(self, volume_path, auth_id):
         with self._auth_lock(auth_id):
             # Existing meta, or None, to be updated
@@ -1178,23 +1678,145 @@ class CephFSVolumeClient(object):
             del vol_meta['auths'][auth_id]
             self._volume_metadata_set(volume_path, vol_meta)
 
+    def deauthorize_many(self, revocations, workers=None):
+        """
+        Like deauthorize, for many (volume, auth ID) pairs at once, with
+        the same coalescing of metadata updates and mon commands as
+        authorize_many.
+
+        :param revocations: list of (volume_path, auth_id)
+        """
+        start = time.time()
+
+        # auth_id -> {volume_path_str: volume_path}, and
+        # volume_path_str -> set of auth_ids
+        auth_volumes = {}
+        volume_auths = {}
+        for volume_path, auth_id in revocations:
+            auth_volumes.setdefault(auth_id, {})[str(volume_path)] = volume_path
+
+        auth_paths = [self._auth_metadata_path(auth_id) for auth_id in auth_volumes]
+
+        with self._lock_many(auth_paths):
+            auth_metas = {}
+            for auth_id, volumes in auth_volumes.items():
+                auth_meta = self._auth_metadata_get(auth_id)
+                if (auth_meta is None) or (not auth_meta['volumes']):
+                    log.warn("deauthorized called for already-removed auth"
+                             "ID '{auth_id}'".format(auth_id=auth_id))
+                    # Clean up the auth meta file of an auth ID
+                    self.fs.unlink(self._auth_metadata_path(auth_id))
+                    continue
+
+                for volume_path_str in list(volumes):
+                    if volume_path_str not in auth_meta['volumes']:
+                        log.warn("deauthorized called for already-removed auth"
+                                 "ID '{auth_id}' for volume ID '{volume}'".format(
+                            auth_id=auth_id, volume=volumes[volume_path_str].volume_id
+                        ))
+                        del volumes[volume_path_str]
+                if not volumes:
+                    continue
+
+                if auth_meta['dirty']:
+                    self._recover_auth_meta(auth_id, auth_meta)
+
+                auth_meta['dirty'] = True
+                for volume_path_str in volumes:
+                    auth_meta['volumes'][volume_path_str]['dirty'] = True
+                    volume_auths.setdefault(volume_path_str, set()).add(auth_id)
+                self._auth_metadata_set(auth_id, auth_meta)
+                auth_metas[auth_id] = auth_meta
+
+            volume_paths = {}
+            for auth_id in auth_metas:
+                volume_paths.update(auth_volumes[auth_id])
+            vol_meta_paths = [self._volume_metadata_path(volume_path)
+                              for volume_path in volume_paths.values()]
+
+            with self._lock_many(vol_meta_paths):
+                vol_metas = {}
+                layouts = {}
+                # auth_id -> layouts of the volumes it's to lose access to
+                revoke = {}
+                for volume_path_str, auths in volume_auths.items():
+                    volume_path = volume_paths[volume_path_str]
+                    vol_meta = self._volume_metadata_get(volume_path)
+                    for auth_id in auths:
+                        if (vol_meta is None) or (auth_id not in vol_meta['auths']):
+                            log.warn("deauthorized called for already-removed auth"
+                                     "ID '{auth_id}' for volume ID '{volume}'".format(
+                                auth_id=auth_id, volume=volume_path.volume_id
+                            ))
+                            continue
+                        vol_meta['auths'][auth_id]['dirty'] = True
+                        if volume_path_str not in layouts:
+                            layouts[volume_path_str] = self._get_layout(volume_path)
+                        revoke.setdefault(auth_id, []).append(layouts[volume_path_str])
+                    if vol_meta is not None:
+                        self._volume_metadata_set(volume_path, vol_meta)
+                        vol_metas[volume_path_str] = vol_meta
+
+                def deauthorize_ceph(auth_id):
+                    op_start = time.time()
+                    self._deauthorize_layouts(auth_id, revoke[auth_id])
+                    log.debug("deauthorize_many: {0} deauthorized from {1} "
+                              "volumes in {2:.3f}s".format(
+                                  auth_id, len(revoke[auth_id]),
+                                  time.time() - op_start))
+
+                self._run_parallel(revoke.keys(), deauthorize_ceph,
+                                   workers or self.PURGE_WORKERS)
+
+                # Remove the auth_ids from the metadata *after* removing them
+                # from ceph, as deauthorize does.
+                for volume_path_str, vol_meta in vol_metas.items():
+                    for auth_id in volume_auths[volume_path_str]:
+                        vol_meta['auths'].pop(auth_id, None)
+                    self._volume_metadata_set(volume_paths[volume_path_str], vol_meta)
+
+            for auth_id, auth_meta in auth_metas.items():
+                for volume_path_str in auth_volumes[auth_id]:
+                    del auth_meta['volumes'][volume_path_str]
+
+                # Clean up auth meta file
+                if not auth_meta['volumes']:
+                    self.fs.unlink(self._auth_metadata_path(auth_id))
+                    continue
+
+                auth_meta['dirty'] = False
+                self._auth_metadata_set(auth_id, auth_meta)
+
+        log.info("deauthorize_many: {0} revocations from {1} auth IDs in "
+                 "{2:.1f}s".format(len(revocations), len(auth_volumes),
+                                   time.time() - start))
+
     def _deauthorize(self, volume_path, auth_id):
         """
         The volume must still exist.
         """
+        self._deauthorize_layouts(auth_id, [self._get_layout(volume_path)])
+
+    def _deauthorize_layouts(self, auth_id, layouts):
+        """
+        Remove a Ceph auth identity's access to several volumes with one
+        update of its caps, deleting it if it has no access left.
+
+        :param layouts: list of (path, pool_name, namespace), see _get_layout
+        """
         client_entity = "client.{0}".format(auth_id)
-        path = self._get_path(volume_path)
-        pool_name = self._get_ancestor_xattr(path, "ceph.dir.layout.pool")
-        namespace = self.fs.getxattr(path, "ceph.dir.layout.pool_namespace")
 
         # The auth_id might have read-only or read-write mount access for the
-        # volume path.
+        # volume paths.
         access_levels = ('r', 'rw')
-        want_mds_caps = {'allow {0} path={1}'.format(access_level, path)
-                         for access_level in access_levels}
-        want_osd_caps = {'allow {0} pool={1} namespace={2}'.format(
-                         access_level, pool_name, namespace)
-                         for access_level in access_levels}
+        want_mds_caps = set()
+        want_osd_caps = set()
+        for path, pool_name, namespace in layouts:
+            for access_level in access_levels:
+                want_mds_caps.add('allow {0} path={1}'.format(
+                    access_level, path))
+                want_osd_caps.add('allow {0} pool={1} namespace={2}'.format(
+                    access_level, pool_name, namespace))
 
         try:
             existing = self._rados_command(
@@ -1335,61 +1957,354 @@ class CephFSVolumeClient(object):
 
         return self._snapshot_destroy(self._get_group_path(group_id), snapshot_name)
 
-    def _cp_r(self, src, dst):
-        # TODO
-        raise NotImplementedError()
+    def _cp_r(self, src, dst, checkpoint_path=None, workers=None):
+        """
+        Copy the tree under src into the existing directory dst, with
+        `workers` (default PURGE_WORKERS) threads at once.
+
+        Modes, ownership and times of files and directories, symlinks
+        and the quotas of directories under src are copied too.  dst's own
+        quota is left alone: it is the size the destination was created
+        with.
+
+        A file is skipped if dst already has it, with the same size and
+        mtime (which is set last, after its data), so a copy that was
+        interrupted can be called again to carry on where it stopped.
+        Progress is checkpointed to checkpoint_path, if given, and
+        removed on completion.
+        """
+        workers = workers or self.PURGE_WORKERS
+        chunk_size = self.CLONE_CHUNK_SIZE
+
+        progress = None
+        if checkpoint_path:
+            progress = self._checkpoint_get(checkpoint_path)
+        if progress and progress['src'] == src:
+            log.info("_cp_r: resuming copy of {0} to {1}, {2} entries "
+                     "already copied".format(src, dst, progress['entries']))
+        else:
+            progress = {'src': src, 'entries': 0, 'bytes': 0,
+                        'elapsed': 0.0}
+
+        lock = threading.Lock()
+        start = time.time()
+        copied = {'entries': 0, 'bytes': 0, 'skipped': 0}
+        # Entries copied when last checkpointed
+        checkpointed = [0]
+        # (src path, dst path, stat) of files larger than one chunk, copied
+        # once the walk is done so that their chunks can be spread over
+        # all the workers
+        large_files = []
+
+        def checkpoint():
+            with lock:
+                data = dict(progress)
+                data['entries'] += copied['entries']
+                data['bytes'] += copied['bytes']
+                data['elapsed'] += time.time() - start
+                checkpointed[0] = copied['entries']
+            if checkpoint_path:
+                self._checkpoint_set(checkpoint_path, data)
+            return data
+
+        def maybe_checkpoint():
+            # Called from this thread only, so that checkpoints are
+            # never written concurrently
+            with lock:
+                due = copied['entries'] - checkpointed[0] >= \
+                    self.PURGE_CHECKPOINT_INTERVAL
+            if due:
+                try:
+                    data = checkpoint()
+                except cephfs.Error as e:
+                    log.warning("_cp_r: failed to checkpoint copy to "
+                                "{0}: {1}".format(dst, e))
+                else:
+                    log.debug("_cp_r: {0} entries copied to {1}".format(
+                        data['entries'], dst))
+
+        def count(entries, nbytes):
+            with lock:
+                copied['entries'] += entries
+                copied['bytes'] += nbytes
+
+        def dst_path(path):
+            # Like the walk, pass through dnames as byte arrays rather
+            # than using os.path
+            return dst + path[len(src):]
+
+        def set_attrs(path, st):
+            self.fs.chown(path, st.st_uid, st.st_gid)
+            self.fs.chmod(path, st.st_mode & 0o7777)
+            self.fs.utime(path, (st.st_atime_sec, st.st_mtime_sec))
+
+        # Each worker thread reads and writes through one buffer of its
+        # own, rather than a new bytes object per chunk
+        bufs = threading.local()
+
+        def copy_range(src_fd, dst_fd, offset, length):
+            buf = getattr(bufs, 'buf', None)
+            if buf is None:
+                buf = bufs.buf = memoryview(bytearray(chunk_size))
+            end = offset + length
+            while offset < end:
+                n = self.fs.read_into(src_fd, offset,
+                                      buf[:min(chunk_size, end - offset)])
+                if not n:
+                    break
+                self.fs.write(dst_fd, buf[:n], offset)
+                offset += n
+
+        def on_dir(dir_path, d):
+            try:
+                self.fs.mkdir(dst_path("{0}/{1}".format(dir_path, d.d_name)),
+                              0o700)
+            except cephfs.ObjectExists:
+                pass
+
+        def on_entry(dir_path, d):
+            path = "{0}/{1}".format(dir_path, d.d_name)
+            if d.is_symbol_file():
+                try:
+                    self.fs.symlink(self.fs.readlink(path, 4096),
+                                    dst_path(path))
+                except cephfs.ObjectExists:
+                    pass
+                count(1, 0)
+                return
+            if not d.is_file():
+                log.warning("_cp_r: skipping {0}, not a regular file, "
+                            "directory or symlink".format(path))
+                return
+
+            st = self.fs.stat(path)
+            try:
+                dst_st = self.fs.stat(dst_path(path))
+            except cephfs.ObjectNotFound:
+                pass
+            else:
+                if dst_st.st_size == st.st_size and \
+                        dst_st.st_mtime_sec == st.st_mtime_sec:
+                    with lock:
+                        copied['skipped'] += 1
+                    return
+
+            if st.st_size > chunk_size:
+                with lock:
+                    large_files.append((path, dst_path(path), st))
+                return
 
-    def clone_volume_to_existing(self, dest_volume_path, src_volume_path, src_snapshot_name):
+            src_fd = self.fs.open(path, os.O_RDONLY)
+            try:
+                dst_fd = self.fs.open(dst_path(path),
+                                      os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                                      0o600)
+                try:
+                    copy_range(src_fd, dst_fd, 0, st.st_size)
+                finally:
+                    self.fs.close(dst_fd)
+            finally:
+                self.fs.close(src_fd)
+            set_attrs(dst_path(path), st)
+            count(1, st.st_size)
+
+        dirs = self._walk_parallel(src, on_entry, on_dir=on_dir,
+                                   workers=workers, progress=maybe_checkpoint)
+
+        # Large files are copied `workers` at a time, so that only that
+        # many are open, and have their chunks queued, at once
+        for i in range(0, len(large_files), workers):
+            batch = large_files[i:i + workers]
+            fds = []
+            try:
+                chunks = []
+                for path, path_dst, st in batch:
+                    src_fd = self.fs.open(path, os.O_RDONLY)
+                    fds.append(src_fd)
+                    dst_fd = self.fs.open(
+                        path_dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                        0o600)
+                    fds.append(dst_fd)
+                    for offset in range(0, st.st_size, chunk_size):
+                        chunks.append((src_fd, dst_fd, offset, chunk_size))
+                self._run_parallel(chunks, lambda c: copy_range(*c),
+                                   workers, progress=maybe_checkpoint)
+            finally:
+                for fd in fds:
+                    self.fs.close(fd)
+            for path, path_dst, st in batch:
+                set_attrs(path_dst, st)
+                count(1, st.st_size)
+
+        # Directory times change as their contents are created, and a
+        # read-only mode would have stopped us from creating them, so
+        # directories get their attributes last, deepest first.
+        for depth in sorted(set(depth for depth, _ in dirs), reverse=True):
+            def finish_dir(path):
+                path_dst = dst_path(path)
+                if path != src:
+                    for quota in ['ceph.quota.max_bytes',
+                                  'ceph.quota.max_files']:
+                        try:
+                            value = self.fs.getxattr(path, quota)
+                        except cephfs.Error:
+                            continue
+                        if value and value != b"0":
+                            self.fs.setxattr(path_dst, quota, value, 0)
+                set_attrs(path_dst, self.fs.stat(path))
+            self._run_parallel(
+                [path for d, path in dirs if d == depth], finish_dir,
+                workers, progress=maybe_checkpoint)
+        count(len(dirs), 0)
+
+        data = checkpoint()
+        if checkpoint_path:
+            self.fs.unlink(checkpoint_path)
+        log.info("_cp_r: copied {0} to {1}: {2} entries, {3} bytes in "
+                 "{4:.1f}s ({5:.0f} entries/s, {6:.1f} MB/s), {7} files "
+                 "already present".format(
+                     src, dst, data['entries'], data['bytes'],
+                     data['elapsed'],
+                     data['entries'] / max(data['elapsed'], 0.001),
+                     data['bytes'] / max(data['elapsed'], 0.001) / 1e6,
+                     copied['skipped']))
+
+    def clone_volume_to_existing(self, dest_volume_path, src_volume_path,
+                                 src_snapshot_name, workers=None):
+        """
+        Copy the contents of a snapshot of one volume into another,
+        existing, volume.  If the copy is interrupted, calling this again
+        carries on from where it stopped.
+        """
         dest_fs_path = self._get_path(dest_volume_path)
         src_snapshot_path = self._snapshot_path(self._get_path(src_volume_path), src_snapshot_name)
+        checkpoint_path = os.path.join(self.volume_prefix, "_{0}:{1}.clone{2}".format(
+            dest_volume_path.group_id if dest_volume_path.group_id else "",
+            dest_volume_path.volume_id,
+            META_FILE_EXT
+        ))
+
+        log.info("clone_volume_to_existing: {0} to {1}".format(
+            src_snapshot_path, dest_fs_path))
+        self._cp_r(src_snapshot_path, dest_fs_path,
+                   checkpoint_path=checkpoint_path, workers=workers)
 
-        self._cp_r(src_snapshot_path, dest_fs_path)
+    @staticmethod
+    def _wait_for_aio(completion, object_name):
+        completion.wait_for_complete_and_cb()
+        ret = completion.get_return_value()
+        if ret < 0:
+            raise rados.OSError("error in I/O on object {0}".format(object_name),
+                                errno=-ret)
+        return ret
 
     def put_object(self, pool_name, object_name, data):
         """
-        Synchronously write data to an object.
+        Write data to an object, replacing its contents.
+
+        The data is written in IO_CHUNK_SIZE pieces, up to IO_MAX_IN_FLIGHT
+        of them at once, so it may be larger than osd_max_write_size.
 
         :param pool_name: name of the pool
         :type pool_name: str
         :param object_name: name of the object
         :type object_name: str
-        :param data: data to write
-        :type data: bytes
+        :param data: data to write: bytes, a file-like object to read()
+                     it from, or an iterable of bytes
         """
+        if isinstance(data, bytes):
+            chunks = (data[offset:offset + self.IO_CHUNK_SIZE]
+                      for offset in range(0, len(data), self.IO_CHUNK_SIZE))
+        elif hasattr(data, 'read'):
+            chunks = iter(lambda: data.read(self.IO_CHUNK_SIZE), b"")
+        else:
+            chunks = data
+
         ioctx = self.rados.open_ioctx(pool_name)
-        max_size = int(self.rados.conf_get('osd_max_write_size')) * 1024 * 1024
-        if len(data) > max_size:
-            msg = ("Data to be written to object '{0}' exceeds "
-                   "{1} bytes".format(object_name, max_size))
-            log.error(msg)
-            raise CephFSVolumeClientError(msg)
+        in_flight = deque()
         try:
-            ioctx.write_full(object_name, data)
+            # The OSD applies one client's ops on an object in the order
+            # they were sent, so the writes after the first, truncating,
+            # one needn't wait for it.
+            offset = 0
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                if len(in_flight) >= self.IO_MAX_IN_FLIGHT:
+                    self._wait_for_aio(in_flight.popleft(), object_name)
+                if offset == 0:
+                    in_flight.append(ioctx.aio_write_full(object_name, chunk))
+                else:
+                    in_flight.append(ioctx.aio_write(object_name, chunk, offset))
+                offset += len(chunk)
+            if offset == 0:
+                ioctx.write_full(object_name, b"")
+            while in_flight:
+                self._wait_for_aio(in_flight.popleft(), object_name)
         finally:
+            # Don't leave ops behind on a closed ioctx
+            for completion in in_flight:
+                completion.wait_for_complete_and_cb()
             ioctx.close()
 
-    def get_object(self, pool_name, object_name):
+    def get_object_chunks(self, pool_name, object_name):
         """
-        Synchronously read data from object.
+        Read an object, IO_CHUNK_SIZE bytes at a time, with up to
+        IO_MAX_IN_FLIGHT reads ahead of the caller.
 
         :param pool_name: name of the pool
         :type pool_name: str
         :param object_name: name of the object
         :type object_name: str
 
-        :returns: bytes - data read from object
+        :returns: generator of bytes, the object's contents in order
         """
         ioctx = self.rados.open_ioctx(pool_name)
-        max_size = int(self.rados.conf_get('osd_max_write_size')) * 1024 * 1024
+        in_flight = deque()
         try:
-            bytes_read = ioctx.read(object_name, max_size)
-            if ((len(bytes_read) == max_size) and
-                    (ioctx.read(object_name, 1, offset=max_size))):
-                log.warning("Size of object {0} exceeds '{1}' bytes "
-                            "read".format(object_name, max_size))
+            size, _ = ioctx.stat(object_name)
+            offsets = iter(range(0, size, self.IO_CHUNK_SIZE))
+
+            def read_next():
+                for offset in offsets:
+                    result = {}
+
+                    def oncomplete(completion, data):
+                        result['data'] = data
+
+                    completion = ioctx.aio_read(object_name, self.IO_CHUNK_SIZE,
+                                                offset, oncomplete)
+                    in_flight.append((completion, result))
+                    return
+
+            for _ in range(self.IO_MAX_IN_FLIGHT):
+                read_next()
+            while in_flight:
+                completion, result = in_flight.popleft()
+                length = self._wait_for_aio(completion, object_name)
+                read_next()
+                if length > 0:
+                    yield result['data']
+                if length < self.IO_CHUNK_SIZE:
+                    # The object shrank since we stat'd it
+                    break
         finally:
+            for completion, _ in in_flight:
+                completion.wait_for_complete_and_cb()
             ioctx.close()
-        return bytes_read
+
+    def get_object(self, pool_name, object_name):
+        """
+        Read data from object.
+
+        :param pool_name: name of the pool
+        :type pool_name: str
+        :param object_name: name of the object
+        :type object_name: str
+
+        :returns: bytes - data read from object
+        """
+        return b"".join(self.get_object_chunks(pool_name, object_name))
 
     def delete_object(self, pool_name, object_name):
         ioctx = self.rados.open_ioctx(pool_name)
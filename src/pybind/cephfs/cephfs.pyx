@@ -3,6 +3,8 @@ This module is a thin wrapper around libcephfs.
 """
 
 from cpython cimport PyObject, ref, exc
+from cpython.buffer cimport PyObject_GetBuffer, PyBuffer_Release, \
+    PyBUF_SIMPLE, PyBUF_WRITABLE
 from libc cimport errno
 from libc.stdint cimport *
 from libc.stdlib cimport malloc, realloc, free
@@ -14,6 +16,13 @@ from datetime import datetime
 import errno
 import os
 import sys
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 # Are we running Python 2.x
 if sys.version_info[0] < 3:
@@ -69,6 +78,11 @@ cdef extern from "time.h":
 cdef extern from "sys/types.h":
     ctypedef unsigned long mode_t
 
+cdef extern from "utime.h":
+    cdef struct utimbuf:
+        time_t actime
+        time_t modtime
+
 cdef extern from "cephfs/ceph_statx.h":
     cdef struct statx "ceph_statx":
         uint32_t    stx_mask
@@ -88,6 +102,8 @@ cdef extern from "cephfs/ceph_statx.h":
         timespec    stx_btime
         uint64_t    stx_version
 
+    cdef unsigned CEPH_STATX_BASIC_STATS
+
 cdef extern from "cephfs/libcephfs.h" nogil:
     cdef struct ceph_mount_info:
         pass
@@ -95,6 +111,9 @@ cdef extern from "cephfs/libcephfs.h" nogil:
     cdef struct ceph_dir_result:
         pass
 
+    cdef struct Inode:
+        pass
+
     ctypedef void* rados_t
 
     const char *ceph_version(int *major, int *minor, int *patch)
@@ -138,7 +157,12 @@ cdef extern from "cephfs/libcephfs.h" nogil:
     int ceph_opendir(ceph_mount_info *cmount, const char *name, ceph_dir_result **dirpp)
     int ceph_chdir(ceph_mount_info *cmount, const char *path)
     dirent * ceph_readdir(ceph_mount_info *cmount, ceph_dir_result *dirp)
+    int ceph_readdirplus_r(ceph_mount_info *cmount, ceph_dir_result *dirp, dirent *de,
+                           statx *stx, unsigned want, unsigned flags, Inode **out)
     int ceph_rmdir(ceph_mount_info *cmount, const char *path)
+    int ceph_chmod(ceph_mount_info *cmount, const char *path, mode_t mode)
+    int ceph_chown(ceph_mount_info *cmount, const char *path, int uid, int gid)
+    int ceph_utime(ceph_mount_info *cmount, const char *path, utimbuf *buf)
     const char* ceph_getcwd(ceph_mount_info *cmount)
     int ceph_sync_fs(ceph_mount_info *cmount)
     int ceph_fsync(ceph_mount_info *cmount, int fd, int syncdataonly)
@@ -263,13 +287,36 @@ class DirEntry(namedtuple('DirEntry',
     def is_file(self):
         return self.d_type == self.DT_REG
 
-StatResult = namedtuple('StatResult',
-                        ["st_dev", "st_ino", "st_mode", "st_nlink", "st_uid",
-                         "st_gid", "st_rdev", "st_size", "st_blksize",
-                         "st_blocks", "st_atime", "st_mtime", "st_ctime"])
+class StatResult(namedtuple('StatResult',
+                            ["st_dev", "st_ino", "st_mode", "st_nlink",
+                             "st_uid", "st_gid", "st_rdev", "st_size",
+                             "st_blksize", "st_blocks", "st_atime",
+                             "st_mtime", "st_ctime"])):
+    # st_atime, st_mtime and st_ctime are local datetimes; like
+    # os.stat_result, the times in seconds since the epoch are also
+    # available, as st_atime_sec, st_mtime_sec and st_ctime_sec
+    pass
 
 cdef class DirResult(object):
     cdef ceph_dir_result *handler
+    # error readdir_plus hit after reading some entries, raised next time
+    cdef int error
+
+
+cdef object stat_result(statx *stx):
+    st = StatResult(st_dev=stx.stx_dev, st_ino=stx.stx_ino,
+                    st_mode=stx.stx_mode, st_nlink=stx.stx_nlink,
+                    st_uid=stx.stx_uid, st_gid=stx.stx_gid,
+                    st_rdev=stx.stx_rdev, st_size=stx.stx_size,
+                    st_blksize=stx.stx_blksize,
+                    st_blocks=stx.stx_blocks,
+                    st_atime=datetime.fromtimestamp(stx.stx_atime.tv_sec),
+                    st_mtime=datetime.fromtimestamp(stx.stx_mtime.tv_sec),
+                    st_ctime=datetime.fromtimestamp(stx.stx_ctime.tv_sec))
+    st.st_atime_sec = stx.stx_atime.tv_sec
+    st.st_mtime_sec = stx.stx_mtime.tv_sec
+    st.st_ctime_sec = stx.stx_ctime.tv_sec
+    return st
 
 
 def cstr(val, name, encoding="utf-8", opt=False):
@@ -604,6 +651,173 @@ cdef class LibCephFS(object):
                         d_type=dirent.d_type,
                         d_name=dirent.d_name)
 
+    def readdir_plus(self, DirResult dir_handler, max_entries=1024):
+        """
+        Read the next entries of a directory, with their stats.
+
+        Up to max_entries entries are read in one go, without the GIL.
+
+        :param dir_handler: the directory, as returned by opendir
+        :param max_entries: the most entries to return
+        :returns: list of (DirEntry, StatResult), empty at the end of the
+                  directory; if reading fails after some entries were read,
+                  they are returned and the error is raised by the next call
+        """
+        self.require_state("mounted")
+        if max_entries < 1:
+            raise InvalidValue(errno.EINVAL, "max_entries must be positive")
+
+        cdef:
+            ceph_dir_result *_dir_handler = dir_handler.handler
+            int _max_entries = max_entries
+            dirent *dirents = NULL
+            statx *stxs = NULL
+            int count = 0
+            int ret = 0
+            int i
+
+        if dir_handler.error < 0:
+            ret = dir_handler.error
+            dir_handler.error = 0
+            raise make_ex(ret, "error in readdir_plus")
+
+        try:
+            dirents = <dirent *>realloc_chk(NULL, sizeof(dirent) * _max_entries)
+            stxs = <statx *>realloc_chk(NULL, sizeof(statx) * _max_entries)
+            with nogil:
+                while count < _max_entries:
+                    ret = ceph_readdirplus_r(self.cluster, _dir_handler,
+                                             &dirents[count], &stxs[count],
+                                             CEPH_STATX_BASIC_STATS, 0, NULL)
+                    if ret <= 0:
+                        break
+                    count += 1
+            if ret < 0:
+                if count == 0:
+                    raise make_ex(ret, "error in readdir_plus")
+                dir_handler.error = ret
+
+            return [(DirEntry(d_ino=dirents[i].d_ino,
+                              d_off=dirents[i].d_off,
+                              d_reclen=dirents[i].d_reclen,
+                              d_type=dirents[i].d_type,
+                              d_name=dirents[i].d_name),
+                     stat_result(&stxs[i]))
+                    for i in range(count)]
+        finally:
+            free(dirents)
+            free(stxs)
+
+    def _list_dir(self, path):
+        """
+        :returns: the entries of a directory other than . and .., with
+                  their stats, as two lists of (name, StatResult):
+                  directories and everything else
+        """
+        dirs = []
+        nondirs = []
+        dir_handler = self.opendir(path)
+        try:
+            entries = self.readdir_plus(dir_handler)
+            while entries:
+                for d, st in entries:
+                    if d.d_name in (b".", b".."):
+                        continue
+                    if d.is_dir():
+                        dirs.append((d.d_name, st))
+                    else:
+                        nondirs.append((d.d_name, st))
+                entries = self.readdir_plus(dir_handler)
+        finally:
+            self.closedir(dir_handler)
+        return dirs, nondirs
+
+    def walk(self, top, onerror=None, workers=1):
+        """
+        Walk the tree under top, like os.walk, generating a 3-tuple
+        (dirpath, dirs, files) for each directory.  dirs and files are
+        lists of (name, StatResult), so nothing needs to be stat'd
+        separately; symlinks are not followed and appear in files.
+
+        Removing entries from dirs stops the walk from descending into
+        them.  Errors listing a directory are passed to onerror, if
+        given, and otherwise ignored.
+
+        With workers > 1, that many threads list directories at once,
+        and directories are generated as their listings complete: a
+        directory comes before its subdirectories, but the order is
+        otherwise arbitrary.
+
+        :param top: path of the directory to walk
+        :param onerror: function to call with each :class:`Error`
+        :param workers: how many directories to list at once
+        """
+        self.require_state("mounted")
+        top = cstr(top, 'top')
+
+        def join(path, name):
+            if path.endswith(b'/'):
+                return path + name
+            return path + b'/' + name
+
+        if workers <= 1:
+            stack = [top]
+            while stack:
+                path = stack.pop()
+                try:
+                    dirs, nondirs = self._list_dir(path)
+                except Error as e:
+                    if onerror is not None:
+                        onerror(e)
+                    continue
+                yield path, dirs, nondirs
+                stack.extend(join(path, name) for name, _ in reversed(dirs))
+            return
+
+        pending = queue.Queue()
+        results = queue.Queue()
+        stopping = []
+
+        def worker():
+            while True:
+                path = pending.get()
+                if path is None:
+                    return
+                if stopping:
+                    continue
+                try:
+                    results.put((path, self._list_dir(path), None))
+                except Exception as e:
+                    results.put((path, None, e))
+
+        threads = [threading.Thread(target=worker) for _ in range(workers)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        try:
+            pending.put(top)
+            outstanding = 1
+            while outstanding:
+                path, listing, e = results.get()
+                outstanding -= 1
+                if e is not None:
+                    if not isinstance(e, Error):
+                        raise e
+                    if onerror is not None:
+                        onerror(e)
+                    continue
+                dirs, nondirs = listing
+                yield path, dirs, nondirs
+                for name, _ in dirs:
+                    pending.put(join(path, name))
+                    outstanding += 1
+        finally:
+            stopping.append(True)
+            for t in threads:
+                pending.put(None)
+            for t in threads:
+                t.join()
+
     def closedir(self, DirResult dir_handler):
         self.require_state("mounted")
         cdef:
@@ -741,24 +955,61 @@ cdef class LibCephFS(object):
             # itself and set ret_s to NULL, hence XDECREF).
             ref.Py_XDECREF(ret_s)
 
+    def read_into(self, fd, offset, buf):
+        """
+        Read from a file into a buffer supplied by the caller, rather than
+        into a newly allocated bytes object as read() does.
+
+        :param buf: where to read up to len(buf) bytes to: a writable,
+                    contiguous object supporting the buffer protocol,
+                    e.g. bytearray, memoryview or mmap
+        :return: the number of bytes read
+        """
+        self.require_state("mounted")
+        if not isinstance(offset, int):
+            raise TypeError('offset must be an int')
+        if not isinstance(fd, int):
+            raise TypeError('fd must be an int')
+        cdef:
+            int _fd = fd
+            int64_t _offset = offset
+            Py_buffer _buf
+
+        PyObject_GetBuffer(buf, &_buf, PyBUF_WRITABLE)
+        try:
+            with nogil:
+                ret = ceph_read(self.cluster, _fd, <char *>_buf.buf, _buf.len,
+                                _offset)
+        finally:
+            PyBuffer_Release(&_buf)
+        if ret < 0:
+            raise make_ex(ret, "error in read")
+        return ret
+
     def write(self, fd, buf, offset):
+        """
+        Write to a file.
+
+        :param buf: bytes, or any object supporting the buffer protocol
+        """
         self.require_state("mounted")
         if not isinstance(fd, int):
             raise TypeError('fd must be an int')
-        if not isinstance(buf, bytes):
-            raise TypeError('buf must be a bytes')
         if not isinstance(offset, int):
             raise TypeError('offset must be an int')
 
         cdef:
             int _fd = fd
-            char *_data = buf
+            Py_buffer _data
             int64_t _offset = offset
 
-            size_t length = len(buf)
-
-        with nogil:
-            ret = ceph_write(self.cluster, _fd, _data, length, _offset)
+        PyObject_GetBuffer(buf, &_data, PyBUF_SIMPLE)
+        try:
+            with nogil:
+                ret = ceph_write(self.cluster, _fd, <char *>_data.buf,
+                                 _data.len, _offset)
+        finally:
+            PyBuffer_Release(&_data)
         if ret < 0:
             raise make_ex(ret, "error in write")
         return ret
@@ -839,19 +1090,10 @@ cdef class LibCephFS(object):
             statx stx
 
         with nogil:
-            # FIXME: replace magic number with CEPH_STATX_BASIC_STATS
-            ret = ceph_statx(self.cluster, _path, &stx, 0x7ffu, 0)
+            ret = ceph_statx(self.cluster, _path, &stx, CEPH_STATX_BASIC_STATS, 0)
         if ret < 0:
             raise make_ex(ret, "error in stat: %s" % path)
-        return StatResult(st_dev=stx.stx_dev, st_ino=stx.stx_ino,
-                          st_mode=stx.stx_mode, st_nlink=stx.stx_nlink,
-                          st_uid=stx.stx_uid, st_gid=stx.stx_gid,
-                          st_rdev=stx.stx_rdev, st_size=stx.stx_size,
-                          st_blksize=stx.stx_blksize,
-                          st_blocks=stx.stx_blocks,
-                          st_atime=datetime.fromtimestamp(stx.stx_atime.tv_sec),
-                          st_mtime=datetime.fromtimestamp(stx.stx_mtime.tv_sec),
-                          st_ctime=datetime.fromtimestamp(stx.stx_ctime.tv_sec))
+        return stat_result(&stx)
 
     def fstat(self, fd):
         self.require_state("mounted")
@@ -863,19 +1105,61 @@ cdef class LibCephFS(object):
             statx stx
 
         with nogil:
-            # FIXME: replace magic number with CEPH_STATX_BASIC_STATS
-            ret = ceph_fstatx(self.cluster, _fd, &stx, 0x7ffu, 0)
+            ret = ceph_fstatx(self.cluster, _fd, &stx, CEPH_STATX_BASIC_STATS, 0)
         if ret < 0:
             raise make_ex(ret, "error in fsat")
-        return StatResult(st_dev=stx.stx_dev, st_ino=stx.stx_ino,
-                          st_mode=stx.stx_mode, st_nlink=stx.stx_nlink,
-                          st_uid=stx.stx_uid, st_gid=stx.stx_gid,
-                          st_rdev=stx.stx_rdev, st_size=stx.stx_size,
-                          st_blksize=stx.stx_blksize,
-                          st_blocks=stx.stx_blocks,
-                          st_atime=datetime.fromtimestamp(stx.stx_atime.tv_sec),
-                          st_mtime=datetime.fromtimestamp(stx.stx_mtime.tv_sec),
-                          st_ctime=datetime.fromtimestamp(stx.stx_ctime.tv_sec))
+        return stat_result(&stx)
+
+    def chmod(self, path, mode):
+        self.require_state("mounted")
+        path = cstr(path, 'path')
+        if not isinstance(mode, int):
+            raise TypeError('mode must be an int')
+        cdef:
+            char* _path = path
+            mode_t _mode = mode
+        with nogil:
+            ret = ceph_chmod(self.cluster, _path, _mode)
+        if ret < 0:
+            raise make_ex(ret, "error in chmod: %s" % path)
+
+    def chown(self, path, uid, gid):
+        self.require_state("mounted")
+        path = cstr(path, 'path')
+        if not isinstance(uid, int):
+            raise TypeError('uid must be an int')
+        if not isinstance(gid, int):
+            raise TypeError('gid must be an int')
+        cdef:
+            char* _path = path
+            int _uid = uid
+            int _gid = gid
+        with nogil:
+            ret = ceph_chown(self.cluster, _path, _uid, _gid)
+        if ret < 0:
+            raise make_ex(ret, "error in chown: %s" % path)
+
+    def utime(self, path, times=None):
+        """
+        Set the access and modification times of path.
+
+        :param times: (atime, mtime) tuple of seconds since the epoch, or
+                      None to set both to the current time
+        """
+        self.require_state("mounted")
+        path = cstr(path, 'path')
+        if times is None:
+            now = int(time.time())
+            times = (now, now)
+        cdef:
+            char* _path = path
+            utimbuf buf
+        buf.actime = int(times[0])
+        buf.modtime = int(times[1])
+        with nogil:
+            ret = ceph_utime(self.cluster, _path, &buf)
+        if ret < 0:
+            raise make_ex(ret, "error in utime: %s" % path)
 
     def symlink(self, existing, newname):
         self.require_state("mounted")
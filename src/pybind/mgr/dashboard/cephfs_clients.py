@@ -1,25 +1,161 @@
 
 import json
+import time
+from threading import Lock
 
 from mgr_module import CommandResult
 from remote_view_cache import RemoteViewCache
 
 
 class CephFSClients(RemoteViewCache):
+    """
+    Sessions of all the active ranks of one filesystem.
+
+    `session ls` is sent to every active rank at once and the replies
+    are merged.  The last good reply from each rank is kept, tagged with
+    the GID that served it, so that a rank that is slow or failing to
+    answer doesn't blank out the client list.  A rank's cached sessions
+    are dropped when the FSMap says a different daemon now holds it.
+    """
+
+    # How long to wait for all ranks to reply to `session ls`
+    RANK_TIMEOUT = 5
+
     def __init__(self, module_inst, fscid):
         super(CephFSClients, self).__init__(module_inst)
 
         self.fscid = fscid
 
+        # Map of rank to (gid, list of sessions)
+        self._rank_sessions = {}
+        self._rank_lock = Lock()
+
+    def _active_ranks(self):
+        """
+        :return: dict of rank to GID for the active ranks of this filesystem
+        """
+        fsmap = self._module.get("fs_map")
+        for fs in fsmap['filesystems']:
+            if fs['id'] == self.fscid:
+                mdsmap = fs['mdsmap']
+                break
+        else:
+            return None
+
+        ranks = {}
+        for rank in mdsmap['in']:
+            gid = mdsmap['up'].get("mds_{0}".format(rank), None)
+            if gid is None:
+                continue
+            info = mdsmap['info']['gid_{0}'.format(gid)]
+            if info['state'] == "up:active":
+                ranks[rank] = gid
+        return ranks
+
+    def notify_fs_map(self):
+        """
+        Drop cached sessions for ranks that have gone away or been taken
+        over by another daemon.
+        """
+        ranks = self._active_ranks() or {}
+        with self._rank_lock:
+            for rank, (gid, _) in list(self._rank_sessions.items()):
+                if ranks.get(rank, None) != gid:
+                    del self._rank_sessions[rank]
+
+    @staticmethod
+    def _decorate(client):
+        # Decorate the metadata with some fields that will be
+        # indepdendent of whether it's a kernel or userspace
+        # client, so that the javascript doesn't have to grok that.
+        metadata = client['client_metadata']
+        if "ceph_version" in metadata:
+            client['type'] = "userspace"
+            client['version'] = metadata['ceph_version']
+            client['hostname'] = metadata['hostname']
+        elif "kernel_version" in metadata:
+            client['type'] = "kernel"
+            client['version'] = metadata['kernel_version']
+            client['hostname'] = metadata['hostname']
+        else:
+            client['type'] = "unknown"
+            client['version'] = ""
+            client['hostname'] = ""
+
     def _get(self):
-        mds_spec = "{0}:0".format(self.fscid)
-        result = CommandResult("")
-        self._module.send_command(result, "mds", mds_spec,
-               json.dumps({
-                   "prefix": "session ls",
-                   }),
-               "")
-        r, outb, outs = result.wait()
-        # TODO handle nonzero returns, e.g. when rank isn't active
-        assert r == 0
-        return json.loads(outb)
+        ranks = self._active_ranks()
+        if ranks is None:
+            # No such filesystem
+            return None
+
+        # Fan out to all the active ranks before waiting on any of them
+        results = {}
+        for rank in sorted(ranks):
+            mds_spec = "{0}:{1}".format(self.fscid, rank)
+            result = CommandResult("")
+            self._module.send_command(result, "mds", mds_spec,
+                   json.dumps({
+                       "prefix": "session ls",
+                       }),
+                   "")
+            results[rank] = result
+
+        deadline = time.time() + self.RANK_TIMEOUT
+        for rank, result in results.items():
+            if not result.ev.wait(max(0, deadline - time.time())):
+                self.log.warning("Timed out waiting for session ls "
+                                 "from rank {0}".format(rank))
+                continue
+            r, outb, outs = result.wait()
+            if r != 0:
+                self.log.warning("session ls failed on rank {0}: {1} "
+                                 "({2})".format(rank, r, outs))
+                continue
+
+            sessions = json.loads(outb)
+            for client in sessions:
+                self._decorate(client)
+            with self._rank_lock:
+                self._rank_sessions[rank] = (ranks[rank], sessions)
+
+        # A client with sessions on several ranks appears once, listing
+        # all the ranks it is talking to.
+        clients = {}
+        with self._rank_lock:
+            for rank, (gid, sessions) in sorted(self._rank_sessions.items()):
+                if ranks.get(rank, None) != gid:
+                    continue
+                for session in sessions:
+                    client = clients.get(session['id'], None)
+                    if client is None:
+                        client = dict(session)
+                        client['ranks'] = []
+                        clients[session['id']] = client
+                    client['ranks'].append(rank)
+
+        return [clients[k] for k in sorted(clients)]
+
+    def get_page(self, offset=0, limit=None, filter_str=None):
+        """
+        Like `get`, but filter the sessions by a substring of their
+        hostname, client id or instance address and return only a slice
+        of them, so that large client lists don't have to be shipped
+        to the browser in one go.
+
+        :return: 3-tuple of status, total matching sessions, list of sessions
+        """
+        status, clients = self.get()
+        if clients is None:
+            return status, 0, None
+
+        if filter_str:
+            clients = [c for c in clients
+                       if filter_str in c['hostname'] or
+                       filter_str in str(c['id']) or
+                       filter_str in c.get('inst', '')]
+
+        total = len(clients)
+        if limit is None:
+            return status, total, clients[offset:]
+        else:
+            return status, total, clients[offset:offset + limit]
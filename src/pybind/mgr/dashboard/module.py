@@ -184,6 +184,11 @@ class Module(MgrModule):
                     self.log_buffer.appendleft(notify_val)
         elif notify_type == "pg_summary":
             self.update_pool_stats()
+        elif notify_type == "service_map":
+            self.rbd_iscsi.notify(notify_type)
+        elif notify_type == "fs_map":
+            for cephfs_clients in self.cephfs_clients.values():
+                cephfs_clients.notify_fs_map()
         else:
             pass
 
@@ -252,8 +257,14 @@ class Module(MgrModule):
             return 0
 
     def get_rate(self, daemon_type, daemon_name, stat):
-        data = self.get_counter(daemon_type, daemon_name, stat)[stat]
+        return self.rate(self.get_counter(daemon_type, daemon_name, stat)[stat])
 
+    @staticmethod
+    def rate(data):
+        """
+        :param data: list of (timestamp, value) of a counter
+        :return: the rate of change between its last two values
+        """
         if data and len(data) > 1:
             return (data[-1][1] - data[-2][1]) / float(data[-1][0] - data[-2][0])
         else:
@@ -565,14 +576,15 @@ class Module(MgrModule):
 
                 return global_instance().fs_status(fs_id)
 
-            def _clients(self, fs_id):
+            def _clients(self, fs_id, offset=0, limit=None, filter_str=None):
                 cephfs_clients = global_instance().cephfs_clients.get(fs_id, None)
                 if cephfs_clients is None:
                     cephfs_clients = CephFSClients(global_instance(), fs_id)
                     global_instance().cephfs_clients[fs_id] = cephfs_clients
 
                 try:
-                    status, clients = cephfs_clients.get()
+                    status, total, clients = cephfs_clients.get_page(
+                        offset, limit, filter_str)
                 except AttributeError:
                     raise cherrypy.HTTPError(404,
                         "No filesystem with id {0}".format(fs_id))
@@ -581,22 +593,8 @@ class Module(MgrModule):
                         "No filesystem with id {0}".format(fs_id))
                 #TODO do something sensible with status
 
-                # Decorate the metadata with some fields that will be
-                # indepdendent of whether it's a kernel or userspace
-                # client, so that the javascript doesn't have to grok that.
-                for client in clients:
-                    if "ceph_version" in client['client_metadata']:
-                        client['type'] = "userspace"
-                        client['version'] = client['client_metadata']['ceph_version']
-                        client['hostname'] = client['client_metadata']['hostname']
-                    elif "kernel_version" in client['client_metadata']:
-                        client['type'] = "kernel"
-                        client['version'] = client['client_metadata']['kernel_version']
-                        client['hostname'] = client['client_metadata']['hostname']
-                    else:
-                        client['type'] = "unknown"
-                        client['version'] = ""
-                        client['hostname'] = ""
+                # Let paging callers know how many sessions matched in all
+                cherrypy.response.headers['X-Total-Count'] = str(total)
 
                 return clients
 
@@ -638,14 +636,18 @@ class Module(MgrModule):
 
             @cherrypy.expose
             @cherrypy.tools.json_out()
-            def clients_data(self, fs_id):
+            def clients_data(self, fs_id, offset=0, limit=None, filter=None):
                 try:
                     fs_id = int(fs_id)
+                    offset = int(offset)
+                    if limit is not None:
+                        limit = int(limit)
                 except ValueError:
                     raise cherrypy.HTTPError(400,
-                        "Invalid filesystem id {0}".format(fs_id))
+                        "Invalid filesystem id {0} or page {1}/{2}".format(
+                            fs_id, offset, limit))
 
-                return self._clients(fs_id)
+                return self._clients(fs_id, offset, limit, filter)
 
             def _rbd_pool(self, pool_name):
                 rbd_ls = global_instance().rbd_ls.get(pool_name, None)
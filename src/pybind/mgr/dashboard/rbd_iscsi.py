@@ -1,70 +1,170 @@
-
 import rados
 import rbd
+from threading import Lock
 from remote_view_cache import RemoteViewCache
 
 SERVICE_TYPE = 'tcmu-runner'
 
+STAT_NAMES = ['rd', 'wr', 'rd_bytes', 'wr_bytes']
+
+
 class DaemonsAndImages(RemoteViewCache):
+    """
+    The set of tcmu-runner services (and their metadata) only changes when
+    the service map changes, so we keep it between refreshes and only
+    rebuild it after a 'service_map' notification.  Per-refresh work is
+    limited to each daemon's status and, for lock owners, a single batched
+    fetch of all the perf counters we need.
+    """
+
+    def __init__(self, module_inst):
+        super(DaemonsAndImages, self).__init__(module_inst)
+
+        # Map of service id to {'hostname', 'started', 'metadata',
+        # 'perf_key_prefix'}
+        self._services = {}
+        self._services_dirty = True
+        self._services_lock = Lock()
+
+    def invalidate_services(self):
+        """
+        Called when the service map changes: the next refresh will
+        re-read the list of tcmu-runner services.
+        """
+        with self._services_lock:
+            self._services_dirty = True
+
+    def _refresh_services(self):
+        # A daemon that restarted, e.g. after an upgrade, registers again
+        # with a new gid and start time, and its metadata must be re-read
+        service_map = self._module.get("service_map")
+        daemons = service_map['services'].get(
+            SERVICE_TYPE, {}).get('daemons', {})
+
+        services = {}
+        for server in self._module.list_servers():
+            for service in server['services']:
+                if service['type'] != SERVICE_TYPE:
+                    continue
+
+                service_id = service['id']
+                daemon = daemons.get(service_id)
+                started = None
+                if isinstance(daemon, dict):
+                    started = (daemon.get('gid'), daemon.get('start_stamp'))
+                known = self._services.get(service_id)
+                if known is not None and started is not None and \
+                        known['hostname'] == server['hostname'] and \
+                        known['started'] == started:
+                    services[service_id] = known
+                    continue
+
+                metadata = self._module.get_metadata(SERVICE_TYPE, service_id)
+                if metadata is None:
+                    continue
+                services[service_id] = {
+                    'hostname': server['hostname'],
+                    'started': started,
+                    'metadata': metadata,
+                    'perf_key_prefix': "librbd-{id}-{pool}-{name}.".format(
+                        id=metadata.get('image_id', ''),
+                        pool=metadata['pool_name'],
+                        name=metadata['image_name'])
+                }
+
+        self.log.debug("Refreshed {0} {1} services".format(
+            len(services), SERVICE_TYPE))
+        self._services = services
+
+    def _get_services(self):
+        # The flag is cleared before refreshing, so that an invalidation
+        # during the refresh isn't lost, and set again if the refresh fails
+        with self._services_lock:
+            dirty = self._services_dirty
+            self._services_dirty = False
+        if dirty:
+            try:
+                self._refresh_services()
+            except Exception:
+                self.invalidate_services()
+                raise
+        return self._services
+
     def _get(self):
         daemons = {}
         images = {}
-        for server in self._module.list_servers():
-            for service in server['services']:
-                if service['type'] == SERVICE_TYPE:
-                    metadata = self._module.get_metadata(SERVICE_TYPE,
-                                                         service['id'])
-                    status = self._module.get_daemon_status(SERVICE_TYPE,
-                                                            service['id'])
-
-                    daemon = daemons.get(server['hostname'], None)
-                    if daemon is None:
-                        daemon = {
-                            'server_hostname': server['hostname'],
-                            'version': metadata['ceph_version'],
-                            'optimized_paths': 0,
-                            'non_optimized_paths': 0
-                        }
-                        daemons[server['hostname']] = daemon
-
-                    service_id = service['id']
-                    device_id = service_id.split(':')[-1]
-                    image = images.get(device_id)
-                    if image is None:
-                        image = {
-                            'device_id': device_id,
-                            'pool_name': metadata['pool_name'],
-                            'name': metadata['image_name'],
-                            'id': metadata.get('image_id', None),
-                            'optimized_paths': [],
-                            'non_optimized_paths': []
-                        }
-                        images[device_id] = image
-                    if status.get('lock_owner', 'false') == 'true':
-                        daemon['optimized_paths'] += 1
-                        image['optimized_paths'].append(server['hostname'])
-
-                        perf_key_prefix = "librbd-{id}-{pool}-{name}.".format(
-                            id=metadata.get('image_id', ''),
-                            pool=metadata['pool_name'],
-                            name=metadata['image_name'])
-                        perf_key = "{}lock_acquired_time".format(perf_key_prefix)
-                        lock_acquired_time = (self._module.get_counter(
-                          'tcmu-runner', service_id, perf_key)[perf_key] or
-                            [[0,0]])[-1][1] / 1000000000
-                        if lock_acquired_time > image.get('optimized_since', None):
-                            image['optimized_since'] = lock_acquired_time
-                            image['stats'] = {}
-                            image['stats_history'] = {}
-                            for s in ['rd', 'wr', 'rd_bytes', 'wr_bytes']:
-                                perf_key = "{}{}".format(perf_key_prefix, s)
-                                image['stats'][s] = self._module.get_rate(
-                                    'tcmu-runner', service_id, perf_key)
-                                image['stats_history'][s] = self._module.get_counter(
-                                    'tcmu-runner', service_id, perf_key)[perf_key]
-                    else:
-                        daemon['non_optimized_paths'] += 1
-                        image['non_optimized_paths'].append(server['hostname'])
+
+        # Gather the status of every path first, so that counters are only
+        # fetched (once each) for the lock owners
+        lock_owners = []
+        for service_id, service in self._get_services().items():
+            hostname = service['hostname']
+            metadata = service['metadata']
+            status = self._module.get_daemon_status(SERVICE_TYPE, service_id)
+            if status is None:
+                # Went away since we last read the service map
+                self.invalidate_services()
+                continue
+
+            daemon = daemons.get(hostname, None)
+            if daemon is None:
+                daemon = {
+                    'server_hostname': hostname,
+                    'version': metadata['ceph_version'],
+                    'optimized_paths': 0,
+                    'non_optimized_paths': 0
+                }
+                daemons[hostname] = daemon
+
+            device_id = service_id.split(':')[-1]
+            image = images.get(device_id)
+            if image is None:
+                image = {
+                    'device_id': device_id,
+                    'pool_name': metadata['pool_name'],
+                    'name': metadata['image_name'],
+                    'id': metadata.get('image_id', None),
+                    'optimized_paths': [],
+                    'non_optimized_paths': []
+                }
+                images[device_id] = image
+
+            if status.get('lock_owner', 'false') == 'true':
+                daemon['optimized_paths'] += 1
+                image['optimized_paths'].append(hostname)
+                lock_owners.append((service_id, service, image))
+            else:
+                daemon['non_optimized_paths'] += 1
+                image['non_optimized_paths'].append(hostname)
+
+        # One fetch of every counter of every lock owner
+        requests = []
+        for service_id, service, _ in lock_owners:
+            perf_key_prefix = service['perf_key_prefix']
+            for s in ['lock_acquired_time'] + STAT_NAMES:
+                requests.append((service_id, perf_key_prefix + s))
+        all_counters = self._module.get_counters(SERVICE_TYPE, requests) \
+            if requests else {}
+
+        for service_id, service, image in lock_owners:
+            perf_key_prefix = service['perf_key_prefix']
+            lock_key = "{}lock_acquired_time".format(perf_key_prefix)
+            stat_keys = ["{}{}".format(perf_key_prefix, s) for s in STAT_NAMES]
+            counters = all_counters.get(service_id, {})
+
+            lock_acquired_time = (counters.get(lock_key) or
+                                  [[0, 0]])[-1][1] / 1000000000
+            if 'optimized_since' in image and \
+                    lock_acquired_time <= image['optimized_since']:
+                continue
+
+            image['optimized_since'] = lock_acquired_time
+            image['stats'] = {}
+            image['stats_history'] = {}
+            for s, perf_key in zip(STAT_NAMES, stat_keys):
+                data = counters.get(perf_key, [])
+                image['stats'][s] = self._module.rate(data)
+                image['stats_history'][s] = data
 
         return {
             'daemons': [daemons[k] for k in sorted(daemons, key=daemons.get)],
@@ -74,3 +174,7 @@ class DaemonsAndImages(RemoteViewCache):
 class Controller:
     def __init__(self, module_inst):
         self.content_data = DaemonsAndImages(module_inst)
+
+    def notify(self, notify_type):
+        if notify_type == "service_map":
+            self.content_data.invalidate_services()
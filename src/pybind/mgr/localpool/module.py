@@ -6,10 +6,35 @@ class Module(MgrModule):
     def __init__(self, *args, **kwargs):
         super(Module, self).__init__(*args, **kwargs)
         self.serve_event = threading.Event()
+        self.run = True
+
+        # Set by notify() so that the pool creation happens on the serve
+        # thread rather than blocking the notify thread
+        self.osd_map_event = threading.Event()
+
+        # The crush version and config we last created pools for
+        self.last_checked = None
 
     def notify(self, notify_type, notify_id):
         if notify_type == 'osd_map':
-            self.handle_osd_map()
+            self.osd_map_event.set()
+            self.serve_event.set()
+
+    def _send_commands(self, commands):
+        """
+        Send a batch of mon commands without waiting in between, then
+        wait for all of them.
+
+        :param commands: dict of key to command dict
+        :return: dict of key to (r, outb, outs)
+        """
+        results = {}
+        for key, command in commands.items():
+            result = CommandResult("")
+            self.send_command(result, "mon", "", json.dumps(command), "")
+            results[key] = result
+
+        return dict((key, result.wait()) for key, result in results.items())
 
     def handle_osd_map(self):
         """
@@ -22,6 +47,13 @@ class Module(MgrModule):
         min_size = self.get_config('min_size')
         prefix = self.get_config('prefix') or 'by-' + subtree_type + '-'
 
+        # Pools only need creating when the tree (or our config) changed
+        checked = (self.get_osdmap().get_crush_version(), subtree_type,
+                   failure_domain, pg_num, num_rep, min_size, prefix)
+        if checked == self.last_checked:
+            self.log.debug('crush version unchanged, skipping')
+            return
+
         osdmap = self.get("osd_map")
         lpools = []
         for pool in osdmap['pools']:
@@ -29,64 +61,83 @@ class Module(MgrModule):
                 lpools.append(pool['pool_name'])
 
         self.log.debug('localized pools = %s', lpools)
-        subtrees = []
+        roots = {}
         tree = self.get('osd_map_tree')
         for node in tree['nodes']:
             if node['type'] == subtree_type:
-                subtrees.append(node['name'])
                 pool_name = prefix + node['name']
                 if pool_name not in lpools:
                     self.log.info('Creating localized pool %s', pool_name)
-                    #
-                    result = CommandResult("")
-                    self.send_command(result, "mon", "", json.dumps({
-                        "prefix": "osd crush rule create-replicated",
-                        "format": "json",
-                        "name": pool_name,
-                        "root": node['name'],
-                        "type": failure_domain,
-                    }), "")
-                    r, outb, outs = result.wait()
-
-                    result = CommandResult("")
-                    self.send_command(result, "mon", "", json.dumps({
-                        "prefix": "osd pool create",
-                        "format": "json",
-                        "pool": pool_name,
-                        'rule': pool_name,
-                        'erasure_code_profile': pool_name,
-                        "pool_type": 'replicated',
-                        'pg_num': str(pg_num),
-                    }), "")
-                    r, outb, outs = result.wait()
-
-                    result = CommandResult("")
-                    self.send_command(result, "mon", "", json.dumps({
-                        "prefix": "osd pool set",
-                        "format": "json",
-                        "pool": pool_name,
-                        'var': 'size',
-                        "val": str(num_rep),
-                    }), "")
-                    r, outb, outs = result.wait()
-
-                    if min_size:
-                        result = CommandResult("")
-                        self.send_command(result, "mon", "", json.dumps({
-                            "prefix": "osd pool set",
-                            "format": "json",
-                            "pool": pool_name,
-                            'var': 'min_size',
-                            "val": str(min_size),
-                        }), "")
-                        r, outb, outs = result.wait()
+                    roots[pool_name] = node['name']
+
+        # Each pool needs its rule, then the pool, then its sizes: run
+        # each step for all the missing pools at once, dropping any pool
+        # whose previous step failed.
+        stages = [
+            lambda pool_name: {
+                "prefix": "osd crush rule create-replicated",
+                "format": "json",
+                "name": pool_name,
+                "root": roots[pool_name],
+                "type": failure_domain,
+            },
+            lambda pool_name: {
+                "prefix": "osd pool create",
+                "format": "json",
+                "pool": pool_name,
+                'rule': pool_name,
+                'erasure_code_profile': pool_name,
+                "pool_type": 'replicated',
+                'pg_num': str(pg_num),
+            },
+            lambda pool_name: {
+                "prefix": "osd pool set",
+                "format": "json",
+                "pool": pool_name,
+                'var': 'size',
+                "val": str(num_rep),
+            },
+        ]
+        if min_size:
+            stages.append(lambda pool_name: {
+                "prefix": "osd pool set",
+                "format": "json",
+                "pool": pool_name,
+                'var': 'min_size',
+                "val": str(min_size),
+            })
+
+        pending = list(roots)
+        failed = False
+        for stage in stages:
+            if not pending:
+                break
+            results = self._send_commands(
+                dict((pool_name, stage(pool_name)) for pool_name in pending))
+            pending = []
+            for pool_name, (r, outb, outs) in results.items():
+                if r != 0:
+                    self.log.error('Failed to create localized pool %s: '
+                                   '%s (%d)', pool_name, outs, r)
+                    failed = True
+                else:
+                    pending.append(pool_name)
+
+        # Retry failed pools on the next osd_map even if crush didn't change
+        if not failed:
+            self.last_checked = checked
 
         # TODO remove pools for hosts that don't exist?
 
     def serve(self):
         self.handle_osd_map()
-        self.serve_event.wait()
-        self.serve_event.clear()
+        while self.run:
+            self.serve_event.wait()
+            self.serve_event.clear()
+            if self.osd_map_event.is_set():
+                self.osd_map_event.clear()
+                self.handle_osd_map()
 
     def shutdown(self):
+        self.run = False
         self.serve_event.set()
@@ -4,9 +4,11 @@ import ceph_module  # noqa
 #import ceph_osdmap_incremental  #noqa
 #import ceph_crushmap  #noqa
 
+import functools
 import json
 import logging
 import threading
+import time
 from collections import defaultdict
 
 
@@ -74,6 +76,47 @@ class CommandResult(object):
         return self.r, self.outb, self.outs
 
 
+class ModuleStats(object):
+    """
+    Call counts and latency histograms for the entry points of a module
+    (``serve``, ``notify``, ``handle_command``) and for its calls into
+    ceph-mgr (``get``, ``get_counter``, ``get_counters``).
+
+    The statistics are kept by ceph-mgr, so that those of every module
+    can be read from any of them, through ``get("module_stats")``.
+    """
+
+    def __init__(self, module):
+        self._module = module
+
+    def record(self, name, duration):
+        self._module._ceph_record_call(name, duration)
+
+    def timed(self, name, func):
+        """
+        Wrap `func` so that each call to it is recorded under `name`
+        """
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            t0 = time.time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(name, time.time() - t0)
+        return wrapper
+
+    def dump(self):
+        """
+        :return: dict with the histogram bucket bounds under ``buckets``
+            and this module's statistics under ``calls``
+        """
+        stats = self._module._ceph_get("module_stats")
+        return {
+            'buckets': stats['buckets'],
+            'calls': stats['modules'].get(self._module.module_name, {})
+        }
+
+
 class OSDMap(ceph_module.BasePyOSDMap):
     def get_epoch(self):
         return self._get_epoch()
@@ -225,6 +268,26 @@ class MgrModule(ceph_module.BaseMgrModule):
 
         self._perf_schema_cache = None
 
+        # Time our entry points.  ceph-mgr looks these up by name on the
+        # instance, so wrapping them here also catches subclass overrides.
+        self._module_stats = ModuleStats(self)
+        for name in ('serve', 'notify', 'handle_command'):
+            setattr(self, name, self._module_stats.timed(
+                name, getattr(self, name)))
+
+        # Every module answers 'mgr module stats <name>' for itself
+        self._stats_prefix = "mgr module stats {0}".format(module_name)
+        self.COMMANDS = self.COMMANDS + [
+            {
+                "cmd": self._stats_prefix,
+                "desc": "Show call counts and latencies of the {0} "
+                        "module".format(module_name),
+                "perm": "r"
+            },
+        ]
+        self._handle_command = self.handle_command
+        self.handle_command = self._handle_stats_command
+
     def __del__(self):
         unconfigure_logger(self, self.module_name)
 
@@ -286,13 +349,18 @@ class MgrModule(ceph_module.BaseMgrModule):
 
         :param str data_name: Valid things to fetch are osd_crush_map_text, 
                 osd_map, osd_map_tree, osd_map_crush, config, mon_map, fs_map,
-                osd_metadata, pg_summary, df, osd_stats, health, mon_status.
+                osd_metadata, pg_summary, df, osd_stats, health, mon_status,
+                module_stats.
 
         Note:
             All these structures have their own JSON representations: experiment
             or look at the C++ ``dump()`` methods to learn about them.
         """
-        return self._ceph_get(data_name)
+        t0 = time.time()
+        try:
+            return self._ceph_get(data_name)
+        finally:
+            self._module_stats.record('get', time.time() - t0)
 
     def get_server(self, hostname):
         """
@@ -330,7 +398,27 @@ class MgrModule(ceph_module.BaseMgrModule):
         :return: A list of two-tuples of (timestamp, value) is returned.  This may be
             empty if no data is available.
         """
-        return self._ceph_get_counter(svc_type, svc_name, path)
+        t0 = time.time()
+        try:
+            return self._ceph_get_counter(svc_type, svc_name, path)
+        finally:
+            self._module_stats.record('get_counter', time.time() - t0)
+
+    def get_counters(self, svc_type, requests):
+        """
+        Like ``get_counter``, but fetch several counters, possibly of
+        several services of one type, at once.
+
+        :param str svc_type:
+        :param list requests: list of (svc_name, path) pairs
+        :return: dict of svc_name to dict of path to a list of
+            (timestamp, value), which may be empty if no data is available.
+        """
+        t0 = time.time()
+        try:
+            return self._ceph_get_counters(svc_type, list(requests))
+        finally:
+            self._module_stats.record('get_counters', time.time() - t0)
 
     def list_servers(self):
         """
@@ -428,6 +516,24 @@ class MgrModule(ceph_module.BaseMgrModule):
         # any ``COMMANDS``
         raise NotImplementedError()
 
+    def _handle_stats_command(self, cmd):
+        if cmd['prefix'] == self._stats_prefix:
+            return 0, json.dumps(self.get_module_stats(), indent=2), ""
+        return self._handle_command(cmd)
+
+    def get_module_stats(self):
+        """
+        Call counts and latencies of this module's ``serve``, ``notify``
+        and ``handle_command`` methods and of its ``get`` and
+        ``get_counter`` calls into ceph-mgr.
+
+        :return: dict with the histogram bucket bounds (in seconds) under
+            ``buckets`` and, under ``calls``, a dict of call name to
+            ``count``, ``total_seconds``, ``max_seconds`` and
+            ``histogram``
+        """
+        return self._module_stats.dump()
+
     def get_mgr_id(self):
         """
         Retrieve the mgr id.
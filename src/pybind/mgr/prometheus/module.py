@@ -60,6 +60,8 @@ POOL_METADATA = ('pool_id', 'name')
 
 DISK_OCCUPATION = ('instance', 'device', 'ceph_daemon')
 
+MODULE_CALL = ('module', 'call')
+
 
 class Metric(object):
     def __init__(self, mtype, name, desc, labels=None):
@@ -193,6 +195,18 @@ class Module(MgrModule):
             'POOL Metadata',
             POOL_METADATA
         )
+        metrics['mgr_module_calls'] = Metric(
+            'counter',
+            'mgr_module_calls',
+            'Calls to mgr module entry points and into ceph-mgr',
+            MODULE_CALL
+        )
+        metrics['mgr_module_call_seconds'] = Metric(
+            'counter',
+            'mgr_module_call_seconds',
+            'Time spent in mgr module entry points and calls into ceph-mgr',
+            MODULE_CALL
+        )
         for state in OSD_STATUS:
             path = 'osd_{}'.format(state)
             self.log.debug("init: creating {}".format(path))
@@ -322,12 +336,24 @@ class Module(MgrModule):
             name = pool['pool_name']
             self.metrics['pool_metadata'].set(0, (id_, name))
 
+    def get_module_call_stats(self):
+        # ceph-mgr keeps the statistics of every module
+        stats = self.get("module_stats")
+        for module_name, calls in stats['modules'].items():
+            for call, call_stats in calls.items():
+                labels = (module_name, call)
+                self.metrics['mgr_module_calls'].set(
+                    call_stats['count'], labels)
+                self.metrics['mgr_module_call_seconds'].set(
+                    call_stats['total_seconds'], labels)
+
     def collect(self):
         self.get_health()
         self.get_df()
         self.get_quorum_status()
         self.get_metadata_and_osd_status()
         self.get_pg_status()
+        self.get_module_call_stats()
 
         for daemon, counters in self.get_all_perf_counters().iteritems():
             for path, counter_info in counters.items():
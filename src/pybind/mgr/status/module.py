@@ -8,6 +8,8 @@ from prettytable import PrettyTable
 import prettytable
 import fnmatch
 import errno
+import threading
+import time
 
 from mgr_module import MgrModule
 
@@ -39,6 +41,26 @@ class Module(MgrModule):
         GRAY
     ) = range(8)
 
+    # How long fetched counters and metadata may be reused by later
+    # commands, so that repeatedly running a status command (e.g. under
+    # `watch`) doesn't copy every counter out of ceph-mgr each time.
+    CACHE_TTL = 1.0
+
+    OSD_STATUS_COUNTERS = ["osd.op_w", "osd.op_rw", "osd.op_in_bytes",
+                           "osd.op_r", "osd.op_out_bytes"]
+
+    MDS_STATUS_COUNTERS = ["mds_mem.dn", "mds_mem.ino",
+                           "mds_sessions.session_count",
+                           "mds_server.handle_client_request",
+                           "mds_log.replay"]
+
+    def __init__(self, *args, **kwargs):
+        super(Module, self).__init__(*args, **kwargs)
+
+        # Map of key to (fetch time, value)
+        self._cache = {}
+        self._cache_lock = threading.Lock()
+
     RESET_SEQ = "\033[0m"
     COLOR_SEQ = "\033[1;%dm"
     COLOR_DARK_SEQ = "\033[0;%dm"
@@ -96,23 +118,71 @@ class Module(MgrModule):
     def format_bytes(self, n, width, colored=True):
         return self.format_units(n, width, colored, decimal=False)
         
-    def get_latest(self, daemon_type, daemon_name, stat):
-        data = self.get_counter(daemon_type, daemon_name, stat)[stat]
-        #self.log.error("get_latest {0} data={1}".format(stat, data))
+    def _cached(self, key, fetch):
+        """
+        Return the value cached under `key` if it is younger than
+        CACHE_TTL, otherwise call `fetch` and cache its result.
+        """
+        now = time.time()
+        with self._cache_lock:
+            entry = self._cache.get(key, None)
+            if entry is not None and now - entry[0] < self.CACHE_TTL:
+                return entry[1]
+
+        value = fetch()
+        with self._cache_lock:
+            self._cache[key] = (now, value)
+        return value
+
+    def _expire_cache(self):
+        now = time.time()
+        with self._cache_lock:
+            for key, (when, _) in list(self._cache.items()):
+                if now - when >= self.CACHE_TTL:
+                    del self._cache[key]
+
+    def _get_counters(self, daemon_type, daemon_names, paths):
+        """
+        Fetch the history of several counters on several daemons with one
+        call into ceph-mgr, reusing the result for CACHE_TTL seconds.
+
+        :return: dict of daemon name to dict of path to counter history
+        """
+        daemon_names = tuple(sorted(daemon_names))
+        paths = tuple(paths)
+        return self._cached(
+            ('counters', daemon_type, daemon_names, paths),
+            lambda: self.get_counters(
+                daemon_type,
+                [(name, path) for name in daemon_names for path in paths]))
+
+    def get_metadata_cached(self, daemon_type, daemon_name):
+        return self._cached(
+            ('metadata', daemon_type, daemon_name),
+            lambda: self.get_metadata(daemon_type, daemon_name)) or {}
+
+    @staticmethod
+    def latest(data):
         if data:
             return data[-1][1]
         else:
             return 0
 
-    def get_rate(self, daemon_type, daemon_name, stat):
-        data = self.get_counter(daemon_type, daemon_name, stat)[stat]
-
-        #self.log.error("get_latest {0} data={1}".format(stat, data))
+    @staticmethod
+    def rate(data):
         if data and len(data) > 1:
             return (data[-1][1] - data[-2][1]) / float(data[-1][0] - data[-2][0])
         else:
             return 0
 
+    def get_latest(self, daemon_type, daemon_name, stat):
+        return self.latest(self._get_counters(
+            daemon_type, [daemon_name], [stat])[daemon_name][stat])
+
+    def get_rate(self, daemon_type, daemon_name, stat):
+        return self.rate(self._get_counters(
+            daemon_type, [daemon_name], [stat])[daemon_name][stat])
+
     def handle_fs_status(self, cmd):
         output = ""
 
@@ -132,6 +202,11 @@ class Module(MgrModule):
 
             mdsmap = filesystem['mdsmap']
 
+            # Fetch the counters of all this filesystem's daemons up front
+            mds_counters = self._get_counters(
+                "mds", [info['name'] for info in mdsmap['info'].values()],
+                self.MDS_STATUS_COUNTERS)
+
             client_count = 0
 
             for rank in mdsmap["in"]:
@@ -139,17 +214,18 @@ class Module(MgrModule):
                 if up:
                     gid = mdsmap['up']["mds_{0}".format(rank)]
                     info = mdsmap['info']['gid_{0}'.format(gid)]
-                    dns = self.get_latest("mds", info['name'], "mds_mem.dn")
-                    inos = self.get_latest("mds", info['name'], "mds_mem.ino")
+                    counters = mds_counters[info['name']]
+                    dns = self.latest(counters["mds_mem.dn"])
+                    inos = self.latest(counters["mds_mem.ino"])
 
                     if rank == 0:
-                        client_count = self.get_latest("mds", info['name'],
-                                                       "mds_sessions.session_count")
+                        client_count = self.latest(
+                            counters["mds_sessions.session_count"])
                     elif client_count == 0:
                         # In case rank 0 was down, look at another rank's
                         # sessionmap to get an indication of clients.
-                        client_count = self.get_latest("mds", info['name'],
-                                                       "mds_sessions.session_count")
+                        client_count = self.latest(
+                            counters["mds_sessions.session_count"])
 
                     laggy = "laggy_since" in info
 
@@ -168,11 +244,11 @@ class Module(MgrModule):
 
                     if state == "active":
                         activity = "Reqs: " + self.format_dimless(
-                            self.get_rate("mds", info['name'], "mds_server.handle_client_request"),
+                            self.rate(counters["mds_server.handle_client_request"]),
                             5
                         ) + "/s"
 
-                    metadata = self.get_metadata('mds', info['name'])
+                    metadata = self.get_metadata_cached('mds', info['name'])
                     mds_versions[metadata.get('ceph_version', "unknown")].append(info['name'])
                     rank_table.add_row([
                         self.bold(rank.__str__()), c_state, info['name'],
@@ -191,11 +267,12 @@ class Module(MgrModule):
                 if daemon_info['state'] != "up:standby-replay":
                     continue
 
-                inos = self.get_latest("mds", daemon_info['name'], "mds_mem.ino")
-                dns = self.get_latest("mds", daemon_info['name'], "mds_mem.dn")
+                counters = mds_counters[daemon_info['name']]
+                inos = self.latest(counters["mds_mem.ino"])
+                dns = self.latest(counters["mds_mem.dn"])
 
                 activity = "Evts: " + self.format_dimless(
-                    self.get_rate("mds", daemon_info['name'], "mds_log.replay"),
+                    self.rate(counters["mds_log.replay"]),
                     5
                 ) + "/s"
 
@@ -231,7 +308,7 @@ class Module(MgrModule):
 
         standby_table = PrettyTable(["Standby MDS"])
         for standby in fsmap['standbys']:
-            metadata = self.get_metadata('mds', standby['name'])
+            metadata = self.get_metadata_cached('mds', standby['name'])
             mds_versions[metadata.get('ceph_version', "unknown")].append(standby['name'])
 
             standby_table.add_row([standby['name']])
@@ -274,30 +351,38 @@ class Module(MgrModule):
         # Build dict of OSD ID to stats
         osd_stats = dict([(o['osd'], o) for o in self.get("osd_stats")['osd_stats']])
 
-        for osd in osdmap['osds']:
+        # Metadata of all OSDs in one call, rather than one per OSD
+        osd_metadata = self._cached(('osd_metadata',),
+                                    lambda: self.get("osd_metadata"))
+
+        osds = [osd for osd in osdmap['osds']
+                if not bucket_filter or osd['osd'] in filter_osds]
+        osd_counters = self._get_counters(
+            "osd", [str(osd['osd']) for osd in osds], self.OSD_STATUS_COUNTERS)
+
+        for osd in osds:
             osd_id = osd['osd']
-            if bucket_filter and osd_id not in filter_osds:
-                continue
+            counters = osd_counters[str(osd_id)]
 
             hostname = ""
             kb_used = 0
             kb_avail = 0
 
             if osd_id in osd_stats:
-                metadata = self.get_metadata('osd', "%s" % osd_id)
+                metadata = osd_metadata.get(str(osd_id), {})
                 stats = osd_stats[osd_id]
-                hostname = metadata['hostname']
+                hostname = metadata.get('hostname', "")
                 kb_used = stats['kb_used'] * 1024
                 kb_avail = stats['kb_avail'] * 1024
 
             osd_table.add_row([osd_id, hostname,
                                self.format_bytes(kb_used, 5),
                                self.format_bytes(kb_avail, 5),
-                               self.format_dimless(self.get_rate("osd", osd_id.__str__(), "osd.op_w") +
-                               self.get_rate("osd", osd_id.__str__(), "osd.op_rw"), 5),
-                               self.format_bytes(self.get_rate("osd", osd_id.__str__(), "osd.op_in_bytes"), 5),
-                               self.format_dimless(self.get_rate("osd", osd_id.__str__(), "osd.op_r"), 5),
-                               self.format_bytes(self.get_rate("osd", osd_id.__str__(), "osd.op_out_bytes"), 5),
+                               self.format_dimless(self.rate(counters["osd.op_w"]) +
+                               self.rate(counters["osd.op_rw"]), 5),
+                               self.format_bytes(self.rate(counters["osd.op_in_bytes"]), 5),
+                               self.format_dimless(self.rate(counters["osd.op_r"]), 5),
+                               self.format_bytes(self.rate(counters["osd.op_out_bytes"]), 5),
                                ','.join(osd['state']),
                                ])
 
@@ -306,6 +391,8 @@ class Module(MgrModule):
     def handle_command(self, cmd):
         self.log.error("handle_command")
 
+        self._expire_cache()
+
         if cmd['prefix'] == "fs status":
             return self.handle_fs_status(cmd)
         elif cmd['prefix'] == "osd status":
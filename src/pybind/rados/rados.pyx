@@ -14,16 +14,20 @@ method.
 # Copyright 2016 Mehdi Abaakouk <sileht@redhat.com>
 
 from cpython cimport PyObject, ref
+from cpython.buffer cimport PyObject_GetBuffer, PyBuffer_Release, \
+    PyBUF_SIMPLE, PyBUF_WRITABLE
 from cpython.pycapsule cimport *
 from libc cimport errno
 from libc.stdint cimport *
 from libc.stdlib cimport malloc, realloc, free
+from libc.string cimport memcmp
 
+import cython
 import sys
 import threading
 import time
 
-from collections import Callable
+from collections import Callable, deque
 from datetime import datetime
 from functools import partial, wraps
 from itertools import chain
@@ -91,6 +95,7 @@ cdef extern from "rados/librados.h" nogil:
     ctypedef void* rados_xattrs_iter_t
     ctypedef void* rados_omap_iter_t
     ctypedef void* rados_list_ctx_t
+    ctypedef void* rados_object_list_cursor
     ctypedef uint64_t rados_snap_t
     ctypedef void *rados_write_op_t
     ctypedef void *rados_read_op_t
@@ -222,6 +227,32 @@ cdef extern from "rados/librados.h" nogil:
     int rados_nobjects_list_open(rados_ioctx_t io, rados_list_ctx_t *ctx)
     int rados_nobjects_list_next(rados_list_ctx_t ctx, const char **entry, const char **key, const char **nspace)
     void rados_nobjects_list_close(rados_list_ctx_t ctx)
+    uint32_t rados_nobjects_list_get_pg_hash_position(rados_list_ctx_t ctx)
+    uint32_t rados_nobjects_list_seek(rados_list_ctx_t ctx, uint32_t pos)
+
+    ctypedef struct rados_object_list_item:
+        size_t oid_length
+        char *oid
+        size_t nspace_length
+        char *nspace
+        size_t locator_length
+        char *locator
+
+    rados_object_list_cursor rados_object_list_begin(rados_ioctx_t io)
+    rados_object_list_cursor rados_object_list_end(rados_ioctx_t io)
+    int rados_object_list_is_end(rados_ioctx_t io, rados_object_list_cursor cur)
+    void rados_object_list_cursor_free(rados_ioctx_t io, rados_object_list_cursor cur)
+    int rados_object_list_cursor_cmp(rados_ioctx_t io, rados_object_list_cursor lhs,
+                                     rados_object_list_cursor rhs)
+    int rados_object_list(rados_ioctx_t io, const rados_object_list_cursor start,
+                          const rados_object_list_cursor finish, const size_t result_size,
+                          const char *filter_buf, const size_t filter_buf_len,
+                          rados_object_list_item *results, rados_object_list_cursor *next)
+    void rados_object_list_free(const size_t result_size, rados_object_list_item *results)
+    void rados_object_list_slice(rados_ioctx_t io, const rados_object_list_cursor start,
+                                 const rados_object_list_cursor finish, const size_t n,
+                                 const size_t m, rados_object_list_cursor *split_start,
+                                 rados_object_list_cursor *split_finish)
 
     int rados_ioctx_snap_rollback(rados_ioctx_t io, const char * oid, const char * snapname)
     int rados_ioctx_snap_create(rados_ioctx_t io, const char * snapname)
@@ -1613,11 +1644,166 @@ cdef class ObjectIterator(object):
         nspace = decode_cstr(nspace_) if nspace_ != NULL else None
         return Object(self.ioctx, key, locator, nspace)
 
+    def get_pg_hash_position(self):
+        """
+        Get the hash position of the iterator, rounded to the current PG.
+
+        :returns: int - hash position
+        """
+        with nogil:
+            ret = rados_nobjects_list_get_pg_hash_position(self.ctx)
+        return ret
+
+    def seek(self, pos):
+        """
+        Move the iterator to a hash position, e.g. one previously returned
+        by :meth:`get_pg_hash_position`.
+
+        :param pos: hash position to move to
+        :type pos: int
+        :returns: int - the actual position moved to, rounded to a PG
+        """
+        cdef uint32_t _pos = pos
+        with nogil:
+            ret = rados_nobjects_list_seek(self.ctx, _pos)
+        return ret
+
     def __dealloc__(self):
         with nogil:
             rados_nobjects_list_close(self.ctx)
 
 
+# ioctx must outlive the cursors, which are freed with it
+@cython.no_gc_clear
+cdef class ObjectChunkIterator(object):
+    """
+    rados.Ioctx iterator over lists of (name, locator, nspace) tuples.
+
+    Each step lists up to ``chunk_size`` objects with one call to
+    librados, without the GIL, and without making an :class:`Object`
+    per entry.  The objects listed are those of the ioctx's namespace
+    (all namespaces if it is LIBRADOS_ALL_NSPACES), optionally further
+    restricted to names starting with ``prefix``.
+
+    The pool can be split into ``shards`` disjoint ranges of PGs: the
+    iterator for ``shard`` n only lists the n-th of them, so a scan can
+    be divided between independent processes.
+    """
+
+    cdef rados_object_list_cursor cursor
+    cdef rados_object_list_cursor finish
+    cdef rados_object_list_cursor _next
+    # ioctx's handle, which the cursors are freed with
+    cdef rados_ioctx_t io
+    cdef rados_object_list_item *items
+    cdef size_t chunk_size
+    cdef char *_prefix
+    cdef size_t prefix_len
+
+    cdef public Ioctx ioctx
+    cdef public object prefix
+
+    def __cinit__(self, Ioctx ioctx, chunk_size=1024, prefix=None,
+                  shard=0, shards=1):
+        cdef:
+            rados_object_list_cursor begin
+            rados_object_list_cursor end
+            size_t _shard
+            size_t _shards
+
+        if chunk_size < 1:
+            raise InvalidArgumentError("chunk_size must be positive")
+        if shards < 1 or not 0 <= shard < shards:
+            raise InvalidArgumentError("shard must be in [0, shards)")
+
+        self.ioctx = ioctx
+        self.io = ioctx.io
+        self.chunk_size = chunk_size
+        self.prefix = cstr(prefix, 'prefix', opt=True)
+        self._prefix = opt_str(self.prefix)
+        self.prefix_len = len(self.prefix) if self.prefix is not None else 0
+        _shard = shard
+        _shards = shards
+
+        with nogil:
+            begin = rados_object_list_begin(ioctx.io)
+            end = rados_object_list_end(ioctx.io)
+            # The sliced range and the results of each step are written
+            # into existing cursors
+            self.cursor = rados_object_list_begin(ioctx.io)
+            self.finish = rados_object_list_begin(ioctx.io)
+            self._next = rados_object_list_begin(ioctx.io)
+            rados_object_list_slice(ioctx.io, begin, end, _shard, _shards,
+                                    &self.cursor, &self.finish)
+            rados_object_list_cursor_free(ioctx.io, begin)
+            rados_object_list_cursor_free(ioctx.io, end)
+
+        self.items = <rados_object_list_item *>realloc_chk(
+            NULL, sizeof(rados_object_list_item) * self.chunk_size)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        """
+        Get the next chunk of objects in the pool
+
+        :raises: StopIteration
+        :returns: list of (name, locator, nspace) tuples; locator is None
+                  for objects without one
+        """
+        cdef:
+            rados_object_list_cursor tmp
+            rados_object_list_item *item
+            int ret
+            int i
+
+        while True:
+            with nogil:
+                if (rados_object_list_is_end(self.ioctx.io, self.cursor) or
+                        rados_object_list_cursor_cmp(self.ioctx.io, self.cursor,
+                                                     self.finish) >= 0):
+                    ret = -errno.ENOENT
+                else:
+                    ret = rados_object_list(self.ioctx.io, self.cursor, self.finish,
+                                            self.chunk_size, NULL, 0, self.items,
+                                            &self._next)
+            if ret == -errno.ENOENT:
+                raise StopIteration()
+            elif ret < 0:
+                raise make_ex(ret, "error iterating over the objects in ioctx '%s'"
+                              % self.ioctx.name)
+
+            tmp = self.cursor
+            self.cursor = self._next
+            self._next = tmp
+
+            try:
+                chunk = []
+                for i in range(ret):
+                    item = &self.items[i]
+                    if self.prefix_len and (
+                            item.oid_length < self.prefix_len or
+                            memcmp(item.oid, self._prefix, self.prefix_len) != 0):
+                        continue
+                    chunk.append((
+                        decode_cstr(item.oid[:item.oid_length]),
+                        decode_cstr(item.locator[:item.locator_length])
+                        if item.locator_length else None,
+                        decode_cstr(item.nspace[:item.nspace_length])))
+            finally:
+                rados_object_list_free(ret, self.items)
+
+            if chunk:
+                return chunk
+
+    def __dealloc__(self):
+        free(self.items)
+        rados_object_list_cursor_free(self.io, self.cursor)
+        rados_object_list_cursor_free(self.io, self.finish)
+        rados_object_list_cursor_free(self.io, self._next)
+
+
 cdef class XattrIterator(object):
     """Extended attribute iterator"""
 
@@ -2624,7 +2810,7 @@ cdef class Ioctx(object):
             self.state = "closed"
 
 
-    @requires(('key', str_type), ('data', bytes))
+    @requires(('key', str_type))
     def write(self, key, data, offset=0):
         """
         Write data to an object synchronously
@@ -2632,7 +2818,7 @@ cdef class Ioctx(object):
         :param key: name of the object
         :type key: str
         :param data: data to write
-        :type data: bytes
+        :type data: bytes, or any object supporting the buffer protocol
         :param offset: byte offset in the object to begin writing at
         :type offset: int
 
@@ -2645,12 +2831,16 @@ cdef class Ioctx(object):
         key = cstr(key, 'key')
         cdef:
             char *_key = key
-            char *_data = data
-            size_t length = len(data)
+            Py_buffer _data
             uint64_t _offset = offset
 
-        with nogil:
-            ret = rados_write(self.io, _key, _data, length, _offset)
+        PyObject_GetBuffer(data, &_data, PyBUF_SIMPLE)
+        try:
+            with nogil:
+                ret = rados_write(self.io, _key, <char *>_data.buf, _data.len,
+                                  _offset)
+        finally:
+            PyBuffer_Release(&_data)
         if ret == 0:
             return ret
         elif ret < 0:
@@ -2660,7 +2850,7 @@ cdef class Ioctx(object):
             raise LogicError("Ioctx.write(%s): rados_write \
 returned %d, but should return zero on success." % (self.name, ret))
 
-    @requires(('key', str_type), ('data', bytes))
+    @requires(('key', str_type))
     def write_full(self, key, data):
         """
         Write an entire object synchronously.
@@ -2671,7 +2861,7 @@ returned %d, but should return zero on success." % (self.name, ret))
         :param key: name of the object
         :type key: str
         :param data: data to write
-        :type data: bytes
+        :type data: bytes, or any object supporting the buffer protocol
 
         :raises: :class:`TypeError`
         :raises: :class:`Error`
@@ -2681,11 +2871,15 @@ returned %d, but should return zero on success." % (self.name, ret))
         key = cstr(key, 'key')
         cdef:
             char *_key = key
-            char *_data = data
-            size_t length = len(data)
+            Py_buffer _data
 
-        with nogil:
-            ret = rados_write_full(self.io, _key, _data, length)
+        PyObject_GetBuffer(data, &_data, PyBUF_SIMPLE)
+        try:
+            with nogil:
+                ret = rados_write_full(self.io, _key, <char *>_data.buf,
+                                       _data.len)
+        finally:
+            PyBuffer_Release(&_data)
         if ret == 0:
             return ret
         elif ret < 0:
@@ -2695,7 +2889,7 @@ returned %d, but should return zero on success." % (self.name, ret))
             raise LogicError("Ioctx.write_full(%s): rados_write_full \
 returned %d, but should return zero on success." % (self.name, ret))
 
-    @requires(('key', str_type), ('data', bytes))
+    @requires(('key', str_type))
     def append(self, key, data):
         """
         Append data to an object synchronously
@@ -2703,7 +2897,7 @@ returned %d, but should return zero on success." % (self.name, ret))
         :param key: name of the object
         :type key: str
         :param data: data to write
-        :type data: bytes
+        :type data: bytes, or any object supporting the buffer protocol
 
         :raises: :class:`TypeError`
         :raises: :class:`LogicError`
@@ -2713,11 +2907,14 @@ returned %d, but should return zero on success." % (self.name, ret))
         key = cstr(key, 'key')
         cdef:
             char *_key = key
-            char *_data = data
-            size_t length = len(data)
+            Py_buffer _data
 
-        with nogil:
-            ret = rados_append(self.io, _key, _data, length)
+        PyObject_GetBuffer(data, &_data, PyBUF_SIMPLE)
+        try:
+            with nogil:
+                ret = rados_append(self.io, _key, <char *>_data.buf, _data.len)
+        finally:
+            PyBuffer_Release(&_data)
         if ret == 0:
             return ret
         elif ret < 0:
@@ -2771,6 +2968,45 @@ returned %d, but should return zero on success." % (self.name, ret))
             # itself and set ret_s to NULL, hence XDECREF).
             ref.Py_XDECREF(ret_s)
 
+    @requires(('key', str_type), ('offset', int))
+    def read_into(self, key, buf, offset=0):
+        """
+        Read data from an object synchronously into a buffer supplied by
+        the caller, rather than into a newly allocated bytes object as
+        :meth:`read` does.
+
+        Up to len(buf) bytes are read.
+
+        :param key: name of the object
+        :type key: str
+        :param buf: where to read the data to
+        :type buf: a writable, contiguous object supporting the buffer
+                   protocol, e.g. bytearray, memoryview or mmap
+        :param offset: byte offset in the object to begin reading at
+        :type offset: int
+
+        :raises: :class:`TypeError`
+        :raises: :class:`Error`
+        :returns: int - number of bytes read
+        """
+        self.require_ioctx_open()
+        key = cstr(key, 'key')
+        cdef:
+            char *_key = key
+            Py_buffer _buf
+            uint64_t _offset = offset
+
+        PyObject_GetBuffer(buf, &_buf, PyBUF_WRITABLE)
+        try:
+            with nogil:
+                ret = rados_read(self.io, _key, <char *>_buf.buf, _buf.len,
+                                 _offset)
+        finally:
+            PyBuffer_Release(&_buf)
+        if ret < 0:
+            raise make_ex(ret, "Ioctx.read_into(%s): failed to read %s" % (self.name, key))
+        return ret
+
     @requires(('key', str_type), ('cls', str_type), ('method', str_type), ('data', bytes))
     def execute(self, key, cls, method, data, length=8192):
         """
@@ -3083,6 +3319,28 @@ returned %d, but should return zero on success." % (self.name, ret))
         self.require_ioctx_open()
         return ObjectIterator(self)
 
+    def list_objects_chunked(self, chunk_size=1024, prefix=None, shard=0, shards=1):
+        """
+        Get ObjectChunkIterator on rados.Ioctx object, which yields lists of
+        up to chunk_size (name, locator, nspace) tuples.
+
+        To divide a scan of the pool between several processes, give each
+        the same number of shards and a different shard in [0, shards).
+
+        :param chunk_size: how many objects to list with each call to librados
+        :type chunk_size: int
+        :param prefix: only list objects whose names start with this
+        :type prefix: str
+        :param shard: which range of PGs to list
+        :type shard: int
+        :param shards: how many ranges to divide the pool's PGs into
+        :type shards: int
+
+        :returns: ObjectChunkIterator
+        """
+        self.require_ioctx_open()
+        return ObjectChunkIterator(self, chunk_size, prefix, shard, shards)
+
     def list_snaps(self):
         """
         Get SnapIterator on rados.Ioctx object.
@@ -3792,6 +4050,187 @@ returned %d, but should return zero on success." % (self.name, ret))
             free(c_vals)
 
 
+class AsyncIoctx(object):
+    """
+    asyncio interface to an :class:`Ioctx`.
+
+    Each method starts an asynchronous operation and returns an
+    asyncio future, to be awaited, which is resolved on the event loop
+    (via ``call_soon_threadsafe``) when librados completes it.  At most
+    ``max_in_flight`` operations are sent to librados at once; the rest
+    wait, in order, on the event loop.
+
+    All methods must be called from the event loop's thread.  Requires
+    Python 3.
+    """
+
+    def __init__(self, ioctx, loop=None, max_in_flight=128):
+        """
+        :param ioctx: an open Ioctx
+        :type ioctx: :class:`Ioctx`
+        :param loop: event loop to resolve futures on (default: the
+                     current event loop)
+        :param max_in_flight: how many operations to have outstanding in
+                              librados at once
+        :type max_in_flight: int
+        """
+        import asyncio
+        self.ioctx = ioctx
+        self.loop = loop if loop is not None else asyncio.get_event_loop()
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self._waiting = deque()
+
+    def _submit(self, start):
+        """
+        :param start: function that takes a ``done(result, exc)`` callback
+                      and starts an aio operation that calls it, from a
+                      librados thread, when it completes
+        :returns: future of the operation's result
+        """
+        future = self.loop.create_future()
+        if self.in_flight < self.max_in_flight:
+            self._start(start, future)
+        else:
+            self._waiting.append((start, future))
+        return future
+
+    def _start(self, start, future):
+        if future.cancelled():
+            return
+
+        def done(result, exc):
+            self.loop.call_soon_threadsafe(self._done, future, result, exc)
+
+        self.in_flight += 1
+        try:
+            start(done)
+        except Exception as e:
+            self._done(future, None, e)
+
+    def _done(self, future, result, exc):
+        self.in_flight -= 1
+        if not future.cancelled():
+            if exc is not None:
+                future.set_exception(exc)
+            else:
+                future.set_result(result)
+        while self._waiting and self.in_flight < self.max_in_flight:
+            self._start(*self._waiting.popleft())
+
+    def read(self, key, length=8192, offset=0):
+        """
+        Read data from an object.
+
+        :returns: future of bytes - data read from object
+        """
+        def start(done):
+            def oncomplete(completion, data):
+                ret = completion.get_return_value()
+                if ret < 0:
+                    done(None, make_ex(ret, "AsyncIoctx.read(%s): failed to read %s"
+                                       % (self.ioctx.name, key)))
+                elif ret == 0:
+                    done(b'', None)
+                else:
+                    done(data, None)
+            self.ioctx.aio_read(key, length, offset, oncomplete)
+        return self._submit(start)
+
+    def _write_done(self, done, what, key):
+        def oncomplete(completion):
+            ret = completion.get_return_value()
+            if ret < 0:
+                done(None, make_ex(ret, "AsyncIoctx.%s(%s): failed on %s"
+                                   % (what, self.ioctx.name, key)))
+            else:
+                done(ret, None)
+        return oncomplete
+
+    def write(self, key, data, offset=0):
+        """
+        Write data to an object.
+
+        :returns: future of int - 0 on success
+        """
+        def start(done):
+            self.ioctx.aio_write(key, data, offset,
+                                 oncomplete=self._write_done(done, 'write', key))
+        return self._submit(start)
+
+    def write_full(self, key, data):
+        """
+        Write an entire object, replacing its contents.
+
+        :returns: future of int - 0 on success
+        """
+        def start(done):
+            self.ioctx.aio_write_full(
+                key, data, oncomplete=self._write_done(done, 'write_full', key))
+        return self._submit(start)
+
+    def remove(self, key):
+        """
+        Remove an object.
+
+        :returns: future of int - 0 on success
+        """
+        def start(done):
+            self.ioctx.aio_remove(
+                key, oncomplete=self._write_done(done, 'remove', key))
+        return self._submit(start)
+
+    def stat(self, key):
+        """
+        Get object stats (size/mtime).
+
+        :returns: future of (size, timestamp)
+        """
+        def start(done):
+            def oncomplete(completion, size, mtime):
+                ret = completion.get_return_value()
+                if ret < 0:
+                    done(None, make_ex(ret, "AsyncIoctx.stat(%s): failed to stat %s"
+                                       % (self.ioctx.name, key)))
+                else:
+                    done((size, mtime), None)
+            self.ioctx.aio_stat(key, oncomplete)
+        return self._submit(start)
+
+    def operate_read_op(self, read_op, oid, flag=LIBRADOS_OPERATION_NOFLAG):
+        """
+        Run a read operation.  The results are found through the read_op
+        (e.g. the iterator get_omap_vals returned) once the future is
+        resolved.
+
+        :returns: future of int - the operation's return value
+        """
+        def start(done):
+            self.ioctx.operate_aio_read_op(
+                read_op, oid, oncomplete=self._write_done(done, 'operate_read_op', oid),
+                flag=flag)
+        return self._submit(start)
+
+    def execute(self, key, cls, method, data, length=8192):
+        """
+        Execute an OSD class method on an object.
+
+        :returns: future of (ret, bytes) - the method's return value and
+                  output
+        """
+        def start(done):
+            def oncomplete(completion, out):
+                ret = completion.get_return_value()
+                if ret < 0:
+                    done(None, make_ex(ret, "AsyncIoctx.execute(%s): failed to execute %s::%s on %s"
+                                       % (self.ioctx.name, cls, method, key)))
+                else:
+                    done((ret, out[:ret]), None)
+            self.ioctx.aio_execute(key, cls, method, data, length,
+                                   oncomplete=oncomplete)
+        return self._submit(start)
+
+
 def set_object_locator(func):
     def retfunc(self, *args, **kwargs):
         if self.locator_key is not None:
@@ -15,16 +15,24 @@ method.
 # Copyright 2015 Hector Martin <marcan@marcan.st>
 
 import cython
+import fcntl
+import os
+import select
 import sys
+import time
 
 from cpython cimport PyObject, ref, exc
+from cpython.buffer cimport PyObject_GetBuffer, PyBuffer_Release, \
+    PyBUF_SIMPLE, PyBUF_WRITABLE
 from libc cimport errno
 from libc.stdint cimport *
 from libc.stdlib cimport realloc, free
 from libc.string cimport strdup
+from posix.unistd cimport close as close_fd
 
 from collections import Iterable
 from datetime import datetime
+from itertools import islice
 
 cimport rados
 
@@ -77,6 +85,8 @@ cdef extern from "rbd/librbd.h" nogil:
         RBD_MAX_BLOCK_NAME_SIZE
         RBD_MAX_IMAGE_NAME_SIZE
 
+        _EVENT_TYPE_PIPE "EVENT_TYPE_PIPE"
+
     ctypedef void* rados_ioctx_t
     ctypedef void* rbd_image_t
     ctypedef void* rbd_image_options_t
@@ -345,6 +355,9 @@ cdef extern from "rbd/librbd.h" nogil:
     ssize_t rbd_aio_get_return_value(rbd_completion_t c)
     void rbd_aio_release(rbd_completion_t c)
     int rbd_aio_flush(rbd_image_t image, rbd_completion_t c)
+    int rbd_set_image_notification(rbd_image_t image, int fd, int type)
+    int rbd_poll_io_events(rbd_image_t image, rbd_completion_t *comps,
+                           int numcomp)
 
     int rbd_metadata_get(rbd_image_t image, const char *key, char *value,
                          size_t *val_len)
@@ -1356,6 +1369,9 @@ cdef int diff_iterate_cb(uint64_t offset, size_t length, int write, void *cb) \
     return ret
 
 
+# close() must still find the completion queue when a reference cycle
+# through the image is collected, or its operations would not be drained
+@cython.no_gc_clear
 cdef class Image(object):
     """
     This class represents an RBD image. It is used to perform I/O on
@@ -1369,6 +1385,7 @@ cdef class Image(object):
     cdef object name
     cdef object ioctx
     cdef rados_ioctx_t _ioctx
+    cdef object _completion_queue
 
     def __init__(self, ioctx, name, snapshot=None, read_only=False):
         """
@@ -1455,9 +1472,16 @@ cdef class Image(object):
         After this is called, this object should not be used.
         """
         if not self.closed:
+            # Operations started through the completion queue reference
+            # its buffers, and librbd will write to its pipe until closed
+            if self._completion_queue is not None:
+                self._completion_queue.drain()
             self.closed = True
             with nogil:
                 ret = rbd_close(self.image)
+            if self._completion_queue is not None:
+                self._completion_queue.close()
+                self._completion_queue = None
             if ret < 0:
                 raise make_ex(ret, 'error while closing image %s' % (
                               self.name,))
@@ -2046,6 +2070,38 @@ cdef class Image(object):
             # itself and set ret_s to NULL, hence XDECREF).
             ref.Py_XDECREF(ret_s)
 
+    def read_into(self, offset, buf, fadvise_flags=0):
+        """
+        Read data from the image into a buffer supplied by the caller,
+        rather than into a newly allocated bytes object as :meth:`read`
+        does.  Raises :class:`InvalidArgument` if part of the range is
+        outside the image.
+
+        :param offset: the offset to start reading at
+        :type offset: int
+        :param buf: where to read len(buf) bytes of data to
+        :type buf: a writable, contiguous object supporting the buffer
+                   protocol, e.g. bytearray, memoryview or mmap
+        :param fadvise_flags: fadvise flags for this read
+        :type fadvise_flags: int
+        :returns: int - the number of bytes read
+        :raises: :class:`InvalidArgument`, :class:`IOError`
+        """
+        cdef:
+            uint64_t _offset = offset
+            Py_buffer _buf
+            int _fadvise_flags = fadvise_flags
+        PyObject_GetBuffer(buf, &_buf, PyBUF_WRITABLE)
+        try:
+            with nogil:
+                ret = rbd_read2(self.image, _offset, _buf.len,
+                                <char *>_buf.buf, _fadvise_flags)
+        finally:
+            PyBuffer_Release(&_buf)
+        if ret < 0:
+            raise make_ex(ret, 'error reading %s %ld~%ld' % (self.name, offset, len(buf)))
+        return ret
+
     def diff_iterate(self, offset, length, from_snapshot, iterate_cb,
                      include_parent = True, whole_object = False):
         """
@@ -2110,7 +2166,7 @@ cdef class Image(object):
         part of the write would fall outside the image.
 
         :param data: the data to be written
-        :type data: bytes
+        :type data: bytes, or any object supporting the buffer protocol
         :param offset: where to start writing data
         :type offset: int
         :param fadvise_flags: fadvise flags for this write
@@ -2119,14 +2175,18 @@ cdef class Image(object):
         :raises: :class:`IncompleteWriteError`, :class:`LogicError`,
                  :class:`InvalidArgument`, :class:`IOError`
         """
-        if not isinstance(data, bytes):
-            raise TypeError('data must be a byte string')
         cdef:
-            uint64_t _offset = offset, length = len(data)
-            char *_data = data
+            uint64_t _offset = offset, length
+            Py_buffer _data
             int _fadvise_flags = fadvise_flags
-        with nogil:
-            ret = rbd_write2(self.image, _offset, length, _data, _fadvise_flags)
+        PyObject_GetBuffer(data, &_data, PyBUF_SIMPLE)
+        try:
+            length = _data.len
+            with nogil:
+                ret = rbd_write2(self.image, _offset, length,
+                                 <char *>_data.buf, _fadvise_flags)
+        finally:
+            PyBuffer_Release(&_data)
 
         if ret == <ssize_t>length:
             return ret
@@ -2690,6 +2750,168 @@ written." % (self.name, ret, length))
 
         return completion
 
+    def completion_queue(self):
+        """
+        Get the image's :class:`CompletionQueue`, creating it on first use.
+
+        Once it exists, librbd also queues the completions of the other
+        asynchronous operations on the image; they are skipped when the
+        queue is polled, so their callbacks work as before.
+
+        :returns: :class:`CompletionQueue`
+        """
+        if self._completion_queue is None:
+            self._completion_queue = CompletionQueue(self)
+        return self._completion_queue
+
+    def export_to(self, fileobj, chunk_size=None, max_in_flight=16):
+        """
+        Copy the image, at the currently set snapshot, into a file.
+
+        Only the extents diff_iterate reports as allocated are read, up to
+        max_in_flight reads at a time through :meth:`completion_queue`.
+        Chunks that turn out to be all zeroes are not written, so the
+        file is sparse wherever the image is.
+
+        :param fileobj: seekable file opened for writing in binary mode
+        :type fileobj: file
+        :param chunk_size: largest read to issue, in bytes (default: the
+                           image's object size)
+        :type chunk_size: int
+        :param max_in_flight: how many reads to have outstanding at once
+        :type max_in_flight: int
+        :returns: int - the number of bytes of data written
+        :raises: :class:`LogicError` if the completion queue is in use,
+                 :class:`IOError`
+        """
+        size = self.size()
+        if chunk_size is None:
+            chunk_size = self.stat()['obj_size']
+
+        extents = []
+        def iterate_cb(offset, length, exists):
+            if exists:
+                extents.append((offset, length))
+        self.diff_iterate(0, size, None, iterate_cb, whole_object=True)
+
+        queue = self.completion_queue()
+        if queue.pending:
+            raise LogicError("completion queue of %s has operations pending" %
+                             self.name)
+
+        chunks = _split_extents(extents, chunk_size)
+        # id of each read to its (offset, length)
+        offsets = {}
+        written = 0
+        try:
+            while True:
+                batch = list(islice(chunks, max_in_flight - queue.pending))
+                if batch:
+                    ids = queue.submit_read(batch)
+                    offsets.update(zip(ids, batch))
+                if not queue.pending:
+                    break
+                for id_, ret, data in queue.wait():
+                    offset, length = offsets.pop(id_)
+                    if ret < 0:
+                        raise make_ex(ret, 'error reading %s %ld~%ld' %
+                                      (self.name, offset, length))
+                    if data.count(b'\0') != len(data):
+                        fileobj.seek(offset)
+                        fileobj.write(data)
+                        written += len(data)
+        finally:
+            queue.drain()
+
+        fileobj.truncate(size)
+        return written
+
+    def import_from(self, fileobj, chunk_size=None, max_in_flight=16):
+        """
+        Copy a file into the image, the reverse of :meth:`export_to`.
+
+        The image is grown to the size of the file if it is smaller.  Up
+        to max_in_flight writes are outstanding at a time, through
+        :meth:`completion_queue`.  Chunks of the file that are all zeroes
+        are not written; where diff_iterate reports that the image has
+        data under them, they are discarded instead.
+
+        :param fileobj: seekable file opened for reading in binary mode
+        :type fileobj: file
+        :param chunk_size: largest write to issue, in bytes (default: the
+                           image's object size)
+        :type chunk_size: int
+        :param max_in_flight: how many writes to have outstanding at once
+        :type max_in_flight: int
+        :returns: int - the number of bytes of data written
+        :raises: :class:`LogicError` if the completion queue is in use,
+                 :class:`IOError`
+        """
+        fileobj.seek(0, os.SEEK_END)
+        size = fileobj.tell()
+        fileobj.seek(0)
+        if self.size() < size:
+            self.resize(size)
+        if chunk_size is None:
+            chunk_size = self.stat()['obj_size']
+
+        allocated = []
+        def iterate_cb(offset, length, exists):
+            if exists:
+                allocated.append((offset, length))
+        self.diff_iterate(0, size, None, iterate_cb, whole_object=True)
+
+        queue = self.completion_queue()
+        if queue.pending:
+            raise LogicError("completion queue of %s has operations pending" %
+                             self.name)
+
+        # id of each write or discard to its (offset, length)
+        offsets = {}
+        offset = 0
+        i = 0
+        written = 0
+        try:
+            while offset < size or queue.pending:
+                writes = []
+                discards = []
+                while (offset < size and
+                       queue.pending + len(writes) + len(discards) < max_in_flight):
+                    length = min(chunk_size - offset % chunk_size, size - offset)
+                    data = fileobj.read(length)
+                    if len(data) != length:
+                        raise IOError("short read from %r at %d" % (fileobj, offset))
+                    if data.count(b'\0') != length:
+                        writes.append((offset, data))
+                    else:
+                        while (i < len(allocated) and
+                               sum(allocated[i]) <= offset):
+                            i += 1
+                        if i < len(allocated) and allocated[i][0] < offset + length:
+                            discards.append((offset, length))
+                    offset += length
+
+                if writes:
+                    ids = queue.submit_write(writes)
+                    offsets.update(zip(ids, ((o, len(data))
+                                             for o, data in writes)))
+                    written += sum(len(data) for _, data in writes)
+                if discards:
+                    ids = queue.submit_discard(discards)
+                    offsets.update(zip(ids, discards))
+                if not queue.pending:
+                    continue
+                for id_, ret, _ in queue.wait():
+                    extent_offset, extent_length = offsets.pop(id_)
+                    if ret < 0:
+                        raise make_ex(ret, 'error writing %s %ld~%ld' %
+                                      (self.name, extent_offset,
+                                       extent_length))
+        finally:
+            queue.drain()
+
+        return written
+
     def metadata_get(self, key):
         """
         Get image metadata for the given key.
@@ -2779,6 +3001,353 @@ written." % (self.name, ret, length))
         return WatcherIterator(self)
 
 
+def _split_extents(extents, chunk_size):
+    """
+    Split (offset, length) extents at multiples of chunk_size.
+    """
+    for offset, length in extents:
+        end = offset + length
+        while offset < end:
+            length = min(chunk_size - offset % chunk_size, end - offset)
+            yield offset, length
+            offset += length
+
+
+cdef enum:
+    QUEUE_OP_READ
+    QUEUE_OP_WRITE
+    QUEUE_OP_DISCARD
+
+# How many completions to collect with each rbd_poll_io_events() call
+DEF QUEUE_POLL_BATCH = 256
+
+cdef struct queued_io:
+    int kind
+    uint64_t offset
+    size_t length
+    char *buf
+    rbd_completion_t comp
+    int ret
+
+
+cdef class QueuedOp(object):
+    """An operation started through a CompletionQueue"""
+
+    cdef:
+        object id
+        int kind
+        uint64_t offset
+        size_t length
+        rbd_completion_t comp
+        PyObject *data
+        Py_buffer buf
+        bint has_buf
+
+    def __dealloc__(self):
+        if self.has_buf:
+            PyBuffer_Release(&self.buf)
+        ref.Py_XDECREF(self.data)
+        self.data = NULL
+        if self.comp != NULL:
+            with nogil:
+                rbd_aio_release(self.comp)
+            self.comp = NULL
+
+    cdef object result(self, ssize_t ret):
+        data = None
+        if self.kind == QUEUE_OP_READ and ret >= 0:
+            if <size_t>ret != self.length:
+                _PyBytes_Resize(&self.data, ret)
+            data = <object>self.data
+        return (self.id, ret, data)
+
+
+cdef class CompletionQueue(object):
+    """
+    Batched asynchronous I/O on an :class:`Image`.
+
+    Operations are started in batches, with one release of the GIL per
+    batch, and their completions are collected in bulk with
+    :meth:`poll` or :meth:`wait`, rather than each running a Python
+    callback on a librbd thread.  Each operation is identified by the id
+    returned when it was started.
+
+    librbd writes to a pipe whenever an operation completes; its read
+    end (:meth:`fileno`) can be watched with select() or an event loop.
+
+    Get one with :meth:`Image.completion_queue`.
+    """
+
+    # The queue doesn't reference its Image, which closes it, so that
+    # collecting them never skips draining the queue first
+    cdef:
+        rbd_image_t image
+        object image_name
+        object pending_ops
+        object failed
+        object next_id
+        int read_fd
+        int write_fd
+        rbd_completion_t *comps
+
+    def __cinit__(self, Image image):
+        self.image = image.image
+        self.image_name = image.name
+        self.read_fd = self.write_fd = -1
+        self.pending_ops = {}
+        self.failed = []
+        self.next_id = 0
+
+        self.comps = <rbd_completion_t *>realloc_chk(
+            NULL, sizeof(rbd_completion_t) * QUEUE_POLL_BATCH)
+
+        # librbd must never block writing a notification, and we don't
+        # want to block draining them
+        self.read_fd, self.write_fd = os.pipe()
+        for fd in (self.read_fd, self.write_fd):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+        with nogil:
+            ret = rbd_set_image_notification(self.image, self.write_fd,
+                                             _EVENT_TYPE_PIPE)
+        if ret < 0:
+            self.close()
+            raise make_ex(ret, 'error setting up completion queue for %s' %
+                          self.image_name)
+
+    def __dealloc__(self):
+        self.close()
+        free(self.comps)
+
+    def close(self):
+        self.image = NULL
+        if self.read_fd >= 0:
+            close_fd(self.read_fd)
+            close_fd(self.write_fd)
+            self.read_fd = self.write_fd = -1
+
+    cdef require_open(self):
+        if self.image == NULL:
+            raise InvalidArgument('completion queue of %s is closed' %
+                                  self.image_name)
+
+    def fileno(self):
+        """
+        :returns: int - file descriptor that becomes readable when
+                  operations complete
+        """
+        self.require_open()
+        return self.read_fd
+
+    @property
+    def pending(self):
+        """
+        The number of operations started and not yet returned by
+        :meth:`poll` or :meth:`wait`.
+        """
+        return len(self.pending_ops) + len(self.failed)
+
+    def _submit(self, int kind, extents, int fadvise_flags):
+        cdef:
+            QueuedOp op
+            list ops = []
+            queued_io *ios = NULL
+            rbd_completion_t comp
+            size_t count, i
+
+        self.require_open()
+        for extent in extents:
+            op = QueuedOp()
+            op.id = self.next_id
+            self.next_id += 1
+            op.kind = kind
+            if kind == QUEUE_OP_WRITE:
+                offset, data = extent
+                PyObject_GetBuffer(data, &op.buf, PyBUF_SIMPLE)
+                op.has_buf = True
+                op.length = op.buf.len
+            else:
+                offset, length = extent
+                op.length = length
+                if kind == QUEUE_OP_READ:
+                    op.data = PyBytes_FromStringAndSize(NULL, length)
+            op.offset = offset
+            with nogil:
+                ret = rbd_aio_create_completion(NULL, NULL, &comp)
+            if ret < 0:
+                raise make_ex(ret, "error getting a completion")
+            op.comp = comp
+            ops.append(op)
+
+        count = len(ops)
+        if not count:
+            return []
+
+        ios = <queued_io *>realloc_chk(NULL, sizeof(queued_io) * count)
+        try:
+            for i in range(count):
+                op = ops[i]
+                ios[i].kind = op.kind
+                ios[i].offset = op.offset
+                ios[i].length = op.length
+                ios[i].comp = op.comp
+                if op.kind == QUEUE_OP_READ:
+                    ios[i].buf = PyBytes_AsString(op.data)
+                elif op.kind == QUEUE_OP_WRITE:
+                    ios[i].buf = <char *>op.buf.buf
+
+            with nogil:
+                for i in range(count):
+                    if ios[i].kind == QUEUE_OP_READ:
+                        ios[i].ret = rbd_aio_read2(
+                            self.image, ios[i].offset, ios[i].length,
+                            ios[i].buf, ios[i].comp, fadvise_flags)
+                    elif ios[i].kind == QUEUE_OP_WRITE:
+                        ios[i].ret = rbd_aio_write2(
+                            self.image, ios[i].offset, ios[i].length,
+                            ios[i].buf, ios[i].comp, fadvise_flags)
+                    else:
+                        ios[i].ret = rbd_aio_discard(
+                            self.image, ios[i].offset, ios[i].length,
+                            ios[i].comp)
+
+            # An operation that failed to start is returned by the next
+            # poll, like one that failed later
+            for i in range(count):
+                op = ops[i]
+                if ios[i].ret < 0:
+                    self.failed.append((op.id, ios[i].ret, None))
+                else:
+                    self.pending_ops[<uintptr_t>op.comp] = op
+        finally:
+            free(ios)
+
+        return [op.id for op in ops]
+
+    def submit_read(self, extents, fadvise_flags=0):
+        """
+        Start reading a list of extents.
+
+        :param extents: (offset, length) of each read
+        :type extents: iterable of (int, int)
+        :param fadvise_flags: fadvise flags for the reads
+        :type fadvise_flags: int
+        :returns: list of ids, in the order of extents
+        """
+        return self._submit(QUEUE_OP_READ, extents, fadvise_flags)
+
+    def submit_write(self, extents, fadvise_flags=0):
+        """
+        Start writing a list of buffers.  Each buffer must not be modified
+        until its write has been returned by :meth:`poll` or :meth:`wait`.
+
+        :param extents: (offset, data) of each write
+        :type extents: iterable of (int, bytes-like object)
+        :param fadvise_flags: fadvise flags for the writes
+        :type fadvise_flags: int
+        :returns: list of ids, in the order of extents
+        """
+        return self._submit(QUEUE_OP_WRITE, extents, fadvise_flags)
+
+    def submit_discard(self, extents):
+        """
+        Start discarding a list of extents.
+
+        :param extents: (offset, length) of each discard
+        :type extents: iterable of (int, int)
+        :returns: list of ids, in the order of extents
+        """
+        return self._submit(QUEUE_OP_DISCARD, extents, 0)
+
+    def _drain_pipe(self):
+        try:
+            while os.read(self.read_fd, 4096):
+                pass
+        except EnvironmentError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def poll(self, max_events=None):
+        """
+        Collect the operations that have completed, without waiting.
+
+        :param max_events: the most operations to return
+        :type max_events: int
+        :returns: list of (id, return value, data) for each completed
+                  operation, in no particular order; data is the bytes
+                  read for a successful read, and None otherwise
+        """
+        cdef:
+            QueuedOp op
+            int n, i, _max
+            ssize_t ret
+
+        self.require_open()
+        if max_events is None:
+            max_events = self.pending
+        results = self.failed[:max_events]
+        del self.failed[:max_events]
+
+        # Drain before polling: librbd queues a completion before writing
+        # to the pipe, so nothing can be missed
+        self._drain_pipe()
+        while len(results) < max_events:
+            _max = min(max_events - len(results), QUEUE_POLL_BATCH)
+            with nogil:
+                n = rbd_poll_io_events(self.image, self.comps, _max)
+            if n < 0:
+                raise make_ex(n, 'error polling for completions')
+            if n == 0:
+                break
+            for i in range(n):
+                op = self.pending_ops.pop(<uintptr_t>self.comps[i], None)
+                # Completions of Image.aio_*() have been handled by their
+                # callbacks
+                if op is None:
+                    continue
+                with nogil:
+                    ret = rbd_aio_get_return_value(op.comp)
+                results.append(op.result(ret))
+        return results
+
+    def wait(self, min_events=1, max_events=None, timeout=None):
+        """
+        Wait for at least min_events operations to complete, or for all
+        of them if fewer are pending, then collect them like :meth:`poll`.
+
+        :param min_events: how many completed operations to wait for
+        :type min_events: int
+        :param max_events: the most operations to return
+        :type max_events: int
+        :param timeout: the most seconds to wait, or None to wait forever
+        :type timeout: float
+        :returns: list of (id, return value, data), as :meth:`poll`
+        """
+        results = self.poll(max_events)
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while len(results) < min_events and self.pending:
+            if max_events is not None and len(results) >= max_events:
+                break
+            remaining = None
+            if timeout is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+            select.select([self.read_fd], [], [], remaining)
+            results += self.poll(None if max_events is None
+                                 else max_events - len(results))
+        return results
+
+    def drain(self):
+        """
+        Wait for all pending operations, discarding their results.
+        """
+        while self.pending:
+            self.wait(self.pending)
+
+
 cdef class LockOwnerIterator(object):
     """
     Iterator over managed lock owners for an image
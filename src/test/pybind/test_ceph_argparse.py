@@ -18,11 +18,16 @@
 from nose.tools import eq_ as eq
 from nose.tools import *
 
-from ceph_argparse import validate_command, parse_json_funcsigs
+from ceph_argparse import validate_command, parse_json_funcsigs, \
+    matchnum, command_trie, CephPrefix, run_in_thread, worker_pool
 
+import copy
 import os
 import re
+import errno
 import json
+import threading
+import time
 
 def get_command_descriptions(what):
     CEPH_BIN = os.environ['CEPH_BIN']
@@ -1144,6 +1149,159 @@ class TestConfigKey(TestArgparse):
 
     def test_list(self):
         self.check_no_arg('config-key', 'list')
+
+
+class TestCommandTrie(object):
+    # a sample of complete, partial, abbreviated and bogus commands
+    ARGS = [
+        ['osd'],
+        ['osd', 'po'],
+        ['osd', 'pool', 'create', 'foo', '128'],
+        ['osd', 'pool', 'set', 'foo', 'size', '3'],
+        ['osd', 'tier', 'remove-overlay', 'poolname'],
+        ['osd', 'set-full-ratio', '0.0'],
+        ['mds', 'fail', 'a'],
+        ['fs', 'new', 'a', 'b', 'c'],
+        ['config-key', 'put', 'key', 'value', 'toomany'],
+        ['pg', 'dump'],
+        ['status'],
+        ['st'],
+        ['bogus', 'command'],
+    ]
+
+    @staticmethod
+    def linear_best_matches(args, copy_sig=False):
+        # copy_sig: copy each signature first, as matching used to
+        best_match_cnt = 0
+        bestcmds = []
+        for cmdtag, cmd in sigdict.items():
+            sig = copy.deepcopy(cmd['sig']) if copy_sig else cmd['sig']
+            matched = matchnum(args, sig, partial=True)
+            if matched > best_match_cnt:
+                best_match_cnt = matched
+                bestcmds = [cmdtag]
+            elif matched == best_match_cnt:
+                bestcmds.append(cmdtag)
+        return best_match_cnt, bestcmds
+
+    @staticmethod
+    def linear_candidates(words):
+        cmdtags = []
+        for cmdtag, cmd in sigdict.items():
+            for word, desc in zip(words, cmd['sig']):
+                if desc.t != CephPrefix:
+                    cmdtags.append(cmdtag)
+                    break
+                if desc.instance.prefix != word:
+                    break
+            else:
+                cmdtags.append(cmdtag)
+        return cmdtags
+
+    def test_best_matches(self):
+        trie = command_trie(sigdict)
+        for args in self.ARGS:
+            eq(self.linear_best_matches(args), trie.best_matches(args))
+            eq(self.linear_best_matches(args, copy_sig=True),
+               trie.best_matches(args))
+
+    def test_candidates(self):
+        trie = command_trie(sigdict)
+        for args in self.ARGS:
+            eq(self.linear_candidates(args[:-1]), trie.candidates(args[:-1]))
+
+    def test_reuse(self):
+        assert command_trie(sigdict) is command_trie(sigdict)
+        other = dict(sigdict)
+        assert command_trie(other) is not command_trie(sigdict)
+
+    def test_signature_unmodified(self):
+        args = ['osd', 'pool', 'set', 'foo', 'size', '3']
+        before = [repr(desc) for cmd in sigdict.values()
+                  for desc in cmd['sig']]
+        command_trie(sigdict).best_matches(args)
+        after = [repr(desc) for cmd in sigdict.values()
+                 for desc in cmd['sig']]
+        eq(before, after)
+
+    def test_benchmark_validate(self):
+        rounds = 10
+        trie = command_trie(sigdict)
+
+        start = time.time()
+        for _ in range(rounds):
+            for args in self.ARGS:
+                self.linear_best_matches(args, copy_sig=True)
+        linear = time.time() - start
+
+        start = time.time()
+        for _ in range(rounds):
+            for args in self.ARGS:
+                trie.best_matches(args)
+        indexed = time.time() - start
+
+        n = rounds * len(self.ARGS)
+        print('matching {0} commands against {1} signatures: '
+              'linear {2:.3f}ms, trie {3:.3f}ms per command'.format(
+                  n, len(sigdict), linear * 1000 / n, indexed * 1000 / n))
+
+    def test_benchmark_complete(self):
+        rounds = 10
+        trie = command_trie(sigdict)
+
+        start = time.time()
+        for _ in range(rounds):
+            for args in self.ARGS:
+                self.linear_candidates(args[:-1])
+        linear = time.time() - start
+
+        start = time.time()
+        for _ in range(rounds):
+            for args in self.ARGS:
+                trie.candidates(args[:-1])
+        indexed = time.time() - start
+
+        n = rounds * len(self.ARGS)
+        print('completing {0} commands against {1} signatures: '
+              'linear {2:.3f}ms, trie {3:.3f}ms per command'.format(
+                  n, len(sigdict), linear * 1000 / n, indexed * 1000 / n))
+
+
+
+class TestRunInThread(object):
+    def test_result(self):
+        eq(run_in_thread(lambda a, b=0: a + b, 1, b=2), 3)
+
+    def test_exception(self):
+        def fail():
+            raise ValueError('boom')
+        assert_raises(ValueError, run_in_thread, fail)
+
+    def test_timeout(self):
+        ev = threading.Event()
+        start = time.time()
+        eq(run_in_thread(ev.wait, 10, timeout=0.1),
+           (-errno.EINTR, None, 'Interrupted!'))
+        elapsed = time.time() - start
+        ev.set()
+        assert 0.1 <= elapsed < 0.4, elapsed
+
+    def test_no_polling_delay(self):
+        ev = threading.Event()
+        threading.Timer(0.05, ev.set).start()
+        start = time.time()
+        assert run_in_thread(ev.wait, 10)
+        elapsed = time.time() - start
+        # previously each wait lasted a multiple of POLL_TIME_INCR
+        assert elapsed < 0.4, elapsed
+
+    def test_threads_reused(self):
+        run_in_thread(lambda: None)
+        before = threading.active_count()
+        for _ in range(20):
+            run_in_thread(lambda: None)
+        eq(threading.active_count(), before)
+
 # Local Variables:
 # compile-command: "cd ../.. ; make -j4 &&
 #  PYTHONPATH=pybind nosetests --stop \
@@ -11,9 +11,19 @@ License version 2, as published by the Free Software
 Foundation.  See file COPYING.
 """
 
+import json
+import os
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 from unittest import TestCase
 
-from ceph_daemon import DaemonWatcher
+from ceph_daemon import DaemonWatcher, do_sockio, discover_asoks, _sum_dumps
 
 try:
     from StringIO import StringIO
@@ -40,6 +50,192 @@ class TestDaemonWatcher(TestCase):
         dw = DaemonWatcher(None)
         # Can't count on having a tty available during tests, so only test the false case
         self.assertEqual(dw.supports_color(StringIO()), False)
+
+
+class TestMultiDaemonWatcher(TestCase):
+    def test_discover_asoks(self):
+        run_dir = tempfile.mkdtemp()
+        try:
+            for name in ['ceph-osd.0.asok', 'ceph-mon.a.asok', 'other']:
+                open(os.path.join(run_dir, name), 'w').close()
+            self.assertEqual(discover_asoks(run_dir), {
+                'osd.0': os.path.join(run_dir, 'ceph-osd.0.asok'),
+                'mon.a': os.path.join(run_dir, 'ceph-mon.a.asok'),
+            })
+        finally:
+            shutil.rmtree(run_dir)
+
+    def test_sum_dumps(self):
+        dumps = [
+            {'osd': {'op': 1, 'op_latency': {'avgcount': 1, 'sum': 0.5}}},
+            {'osd': {'op': 2, 'op_latency': {'avgcount': 3, 'sum': 1.5}}},
+        ]
+        self.assertEqual(_sum_dumps(dumps), {
+            'osd': {'op': 3, 'op_latency': {'avgcount': 4, 'sum': 2.0}}})
+
+
+class TestStartup(TestCase):
+    # What 'ceph daemon' and 'ceph daemonperf' need, without librados
+    IMPORTS = "import ceph_argparse, ceph_daemon"
+
+    def run_python(self, code):
+        return subprocess.check_output([sys.executable, '-c', code],
+                                       env=os.environ)
+
+    def test_no_librados(self):
+        loaded = self.run_python(
+            self.IMPORTS + "; import sys; "
+            "print(' '.join(m for m in ('rados', 'prettytable') "
+            "if m in sys.modules))")
+        self.assertEqual(loaded.strip(), b'')
+
+    def run_ceph(self, args):
+        """
+        Run src/ceph.in with a rados module on sys.path that fails to
+        import, so any command needing librados exits with an error
+        """
+        poison = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(poison, 'rados.py'), 'w') as f:
+                f.write("raise ImportError('rados was imported')\n")
+            env = dict(os.environ)
+            env['PYTHONPATH'] = os.pathsep.join(
+                [poison] + [p for p in sys.path if p])
+            env.pop('CEPH_ARGS', None)
+            ceph = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..', 'ceph.in')
+            proc = subprocess.Popen([sys.executable, ceph] + args, env=env,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE)
+            out, err = proc.communicate()
+        finally:
+            shutil.rmtree(poison)
+        self.assertNotIn(b'rados was imported', err)
+        self.assertEqual(proc.returncode, 0, err)
+        return out
+
+    def test_ceph_version_no_librados(self):
+        self.assertIn(b'ceph version', self.run_ceph(['--version']))
+
+    def test_ceph_daemon_no_librados(self):
+        asok_dir = tempfile.mkdtemp()
+        path = os.path.join(asok_dir, 'test.asok')
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+        listener.listen(2)
+        replies = {
+            'get_command_descriptions': json.dumps({
+                'cmd000': {'sig': ['perf', 'dump'], 'help': 'dump perf',
+                           'module': 'osd', 'perm': 'r', 'avail': 'cli',
+                           'flags': 0}}).encode('utf-8'),
+            'perf dump': b'{"osd": {}}',
+        }
+
+        def serve():
+            # one connection for the descriptions, one for the command
+            for _ in range(2):
+                conn, _ = listener.accept()
+                try:
+                    cmd = b''
+                    while not cmd.endswith(b'\0'):
+                        cmd += conn.recv(4096)
+                    prefix = json.loads(cmd[:-1].decode('utf-8'))['prefix']
+                    reply = replies[prefix]
+                    conn.sendall(struct.pack('>I', len(reply)) + reply)
+                finally:
+                    conn.close()
+        thread = threading.Thread(target=serve)
+        thread.daemon = True
+        thread.start()
+        try:
+            out = self.run_ceph(['daemon', path, 'perf', 'dump'])
+            self.assertEqual(out.strip(), b'{"osd": {}}')
+            thread.join()
+        finally:
+            listener.close()
+            shutil.rmtree(asok_dir)
+
+    def test_benchmark_startup(self):
+        runs = 5
+        start = time.time()
+        for _ in range(runs):
+            self.run_python("pass")
+        bare = (time.time() - start) / runs
+
+        start = time.time()
+        for _ in range(runs):
+            self.run_python(self.IMPORTS)
+        loaded = (time.time() - start) / runs
+
+        print('interpreter startup {0:.1f}ms, with CLI modules '
+              '{1:.1f}ms'.format(bare * 1000, loaded * 1000))
+
+        ceph_bin = os.environ.get('CEPH_BIN')
+        if ceph_bin is not None:
+            start = time.time()
+            for _ in range(runs):
+                subprocess.check_output([os.path.join(ceph_bin or '.', 'ceph'),
+                                         '--version'])
+            print('ceph --version {0:.1f}ms'.format(
+                (time.time() - start) * 1000 / runs))
+
+
+class TestSockio(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'test.asok')
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.path)
+        self.listener.listen(1)
+
+    def tearDown(self):
+        self.listener.close()
+        shutil.rmtree(self.dir)
+
+    def serve(self, reply, length=None):
+        """
+        Answer one command like a daemon's admin socket, announcing
+        `length` bytes (default: all of them) and sending `reply`
+        """
+        if length is None:
+            length = len(reply)
+
+        def serve_one():
+            conn, _ = self.listener.accept()
+            try:
+                cmd = b''
+                while not cmd.endswith(b'\0'):
+                    cmd += conn.recv(4096)
+                conn.sendall(struct.pack('>I', length) + reply)
+            finally:
+                conn.close()
+        thread = threading.Thread(target=serve_one)
+        thread.start()
+        return thread
+
+    def test_reply(self):
+        thread = self.serve(b'{"foo": "bar"}')
+        self.assertEqual(do_sockio(self.path, b'{"prefix": "foo"}'),
+                         b'{"foo": "bar"}')
+        thread.join()
+
+    def test_large_reply(self):
+        reply = os.urandom(8 << 20)
+        thread = self.serve(reply)
+        self.assertEqual(do_sockio(self.path, b'{"prefix": "foo"}'), reply)
+        thread.join()
+
+    def test_short_reply(self):
+        thread = self.serve(b'{"foo"', length=100)
+        self.assertRaises(RuntimeError, do_sockio, self.path,
+                          b'{"prefix": "foo"}')
+        thread.join()
+
+    def test_no_reply(self):
+        thread = self.serve(b'', length=0)
+        self.assertEqual(do_sockio(self.path, b'{"prefix": "foo"}'), b'')
+        thread.join()
+
 # Local Variables:
 # compile-command: "cd ../.. ; make -j4 &&
 #  PYTHONPATH=pybind nosetests --stop \
@@ -1,11 +1,19 @@
 # vim: expandtab smarttab shiftwidth=4 softtabstop=4
+from nose import SkipTest
 from nose.tools import assert_raises, assert_equal, with_setup
 import cephfs as libcephfs
+from datetime import datetime
 import fcntl
 import os
+import time
 
 cephfs = None
 
+def require_benchmark():
+    # Benchmarks are slow and only print their numbers; opt in to them
+    if not os.environ.get('CEPH_TEST_BENCHMARK'):
+        raise SkipTest("set CEPH_TEST_BENCHMARK to run benchmarks")
+
 def setup_module():
     global cephfs
     cephfs = libcephfs.LibCephFS(conffile='')
@@ -97,6 +105,115 @@ def test_walk_dir():
         cephfs.rmdir(i)
     cephfs.closedir(handler)
 
+@with_setup(setup_test)
+def test_readdir_plus():
+    cephfs.mkdir(b"/dir-1", 0o755)
+    for i in range(10):
+        fd = cephfs.open(b"/dir-1/file-%d" % i, 'w', 0o644)
+        cephfs.write(fd, b"x" * i, 0)
+        cephfs.close(fd)
+    handler = cephfs.opendir(b"/dir-1")
+    entries = []
+    chunk = cephfs.readdir_plus(handler, 4)
+    while chunk:
+        assert(len(chunk) <= 4)
+        entries += chunk
+        chunk = cephfs.readdir_plus(handler, 4)
+    cephfs.closedir(handler)
+    sizes = dict((d.d_name, st.st_size) for d, st in entries)
+    assert_equal(sizes.pop(b"."), cephfs.stat(b"/dir-1").st_size)
+    sizes.pop(b"..")
+    assert_equal(sizes, dict((b"file-%d" % i, i) for i in range(10)))
+    for i in range(10):
+        cephfs.unlink(b"/dir-1/file-%d" % i)
+    cephfs.rmdir(b"/dir-1")
+
+def make_tree(fanout, depth, path=b""):
+    for i in range(fanout):
+        fd = cephfs.open(path + b"/file-%d" % i, 'w', 0o644)
+        cephfs.close(fd)
+    if depth:
+        for i in range(fanout):
+            cephfs.mkdir(path + b"/dir-%d" % i, 0o755)
+            make_tree(fanout, depth - 1, path + b"/dir-%d" % i)
+
+def remove_tree(path):
+    for dirpath, dirs, files in reversed(list(cephfs.walk(path))):
+        for name, _ in files:
+            cephfs.unlink(dirpath + b"/" + name)
+        if dirpath != path:
+            cephfs.rmdir(dirpath)
+
+@with_setup(setup_test)
+def test_walk():
+    cephfs.mkdir(b"/tree", 0o755)
+    make_tree(3, 2, b"/tree")
+    cephfs.symlink(b"/tree/dir-0", b"/tree/link")
+    for workers in (1, 4):
+        walked = dict((dirpath, (sorted(name for name, _ in dirs),
+                                 sorted(name for name, _ in files)))
+                      for dirpath, dirs, files in
+                      cephfs.walk(b"/tree", workers=workers))
+        # 1 + 3 + 9 directories; the symlink is not followed
+        assert_equal(len(walked), 13)
+        assert_equal(walked[b"/tree"],
+                     ([b"dir-0", b"dir-1", b"dir-2"],
+                      [b"file-0", b"file-1", b"file-2", b"link"]))
+        assert_equal(walked[b"/tree/dir-2/dir-1"],
+                     ([], [b"file-0", b"file-1", b"file-2"]))
+
+        # pruning
+        walked = []
+        for dirpath, dirs, files in cephfs.walk(b"/tree", workers=workers):
+            walked.append(dirpath)
+            dirs[:] = [d for d in dirs if d[0] == b"dir-0"]
+        assert_equal(sorted(walked),
+                     [b"/tree", b"/tree/dir-0", b"/tree/dir-0/dir-0"])
+
+    errors = []
+    assert_equal(list(cephfs.walk(b"/no-tree", onerror=errors.append)), [])
+    assert(isinstance(errors[0], libcephfs.ObjectNotFound))
+
+    cephfs.unlink(b"/tree/link")
+    remove_tree(b"/tree")
+    cephfs.rmdir(b"/tree")
+
+@with_setup(setup_test)
+def test_walk_benchmark():
+    require_benchmark()
+    cephfs.mkdir(b"/tree", 0o755)
+    make_tree(10, 2, b"/tree")
+    count = 10 + 10 * 10 + 10 * 10 * 10 + 10 + 10 * 10
+
+    def stat_walk(path):
+        # readdir and a stat per entry, as walkers had to before
+        entries = 0
+        handler = cephfs.opendir(path)
+        d = cephfs.readdir(handler)
+        while d:
+            if d.d_name not in [b".", b".."]:
+                cephfs.stat(path + b"/" + d.d_name)
+                entries += 1
+                if d.is_dir():
+                    entries += stat_walk(path + b"/" + d.d_name)
+            d = cephfs.readdir(handler)
+        cephfs.closedir(handler)
+        return entries
+
+    start = time.time()
+    assert_equal(stat_walk(b"/tree"), count)
+    rates = ["readdir+stat {0:.0f}".format(count / (time.time() - start))]
+    for workers in (1, 8):
+        start = time.time()
+        assert_equal(sum(len(dirs) + len(files) for _, dirs, files in
+                         cephfs.walk(b"/tree", workers=workers)), count)
+        rates.append("walk({0}) {1:.0f}".format(
+            workers, count / (time.time() - start)))
+    print("entries/s: " + ", ".join(rates))
+
+    remove_tree(b"/tree")
+    cephfs.rmdir(b"/tree")
+
 @with_setup(setup_test)
 def test_xattr():
     assert_raises(libcephfs.OperationNotSupported, cephfs.setxattr, "/", "key", b"value", 0)
@@ -147,6 +264,47 @@ def test_open():
     assert_raises(libcephfs.OperationNotSupported, cephfs.open, b'file-1', 'a')
     cephfs.unlink(b'file-1')
 
+@with_setup(setup_test)
+def test_read_into_write_buffers():
+    fd = cephfs.open(b'file-1', 'w+', 0o755)
+    cephfs.write(fd, bytearray(b"asdf"), 0)
+    cephfs.write(fd, memoryview(b"zxcv")[2:], 4)
+    buf = bytearray(8)
+    assert_equal(cephfs.read_into(fd, 0, buf), 6)
+    assert_equal(bytes(buf[:6]), b"asdfcv")
+    assert_equal(cephfs.read_into(fd, 4, memoryview(buf)[:2]), 2)
+    assert_equal(bytes(buf[:2]), b"cv")
+    assert_raises(TypeError, cephfs.read_into, fd, 0, b"1234")
+    assert_raises(TypeError, cephfs.write, fd, u"1234", 0)
+    cephfs.close(fd)
+    cephfs.unlink(b'file-1')
+
+@with_setup(setup_test)
+def test_read_into_benchmark():
+    require_benchmark()
+    size = 4 << 20
+    count = 64
+    data = os.urandom(size)
+    fd = cephfs.open(b'file-1', 'w+', 0o755)
+    cephfs.write(fd, data, 0)
+    buf = bytearray(size)
+
+    start = time.time()
+    for _ in range(count):
+        cephfs.read(fd, 0, size)
+    read_rate = count * size / (time.time() - start) / 1e9
+
+    start = time.time()
+    for _ in range(count):
+        cephfs.read_into(fd, 0, buf)
+    read_into_rate = count * size / (time.time() - start) / 1e9
+    assert_equal(bytes(buf), data)
+    cephfs.close(fd)
+    cephfs.unlink(b'file-1')
+
+    print("read {0:.2f} GB/s, read_into {1:.2f} GB/s".format(
+        read_rate, read_into_rate))
+
 @with_setup(setup_test)
 def test_link():
     fd = cephfs.open(b'file-1', 'w', 0o755)
@@ -192,6 +350,22 @@ def test_readlink():
     cephfs.unlink(b'/file-2')
     cephfs.unlink(b'/file-1')
 
+@with_setup(setup_test)
+def test_chmod_chown_utime():
+    fd = cephfs.open(b'/file-1', 'w', 0o755)
+    cephfs.close(fd)
+    cephfs.chmod(b'/file-1', 0o600)
+    assert_equal(cephfs.stat(b'/file-1').st_mode & 0o777, 0o600)
+    st = cephfs.stat(b'/file-1')
+    cephfs.chown(b'/file-1', st.st_uid, st.st_gid)
+    cephfs.utime(b'/file-1', (1000000000, 1000000000))
+    st = cephfs.stat(b'/file-1')
+    assert_equal(st.st_mtime, datetime.fromtimestamp(1000000000))
+    assert_equal(st.st_mtime_sec, 1000000000)
+    assert_equal(st.st_atime_sec, 1000000000)
+    assert_raises(libcephfs.ObjectNotFound, cephfs.chmod, b'/no-file', 0o600)
+    cephfs.unlink(b'/file-1')
+
 @with_setup(setup_test)
 def test_delete_cwd():
     assert_equal(b"/", cephfs.getcwd())
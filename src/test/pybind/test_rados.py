@@ -2,7 +2,7 @@ from __future__ import print_function
 from nose import SkipTest
 from nose.tools import eq_ as eq, ok_ as ok, assert_raises
 from rados import (Rados, Error, RadosStateError, Object, ObjectExists,
-                   ObjectNotFound, ObjectBusy, requires, opt,
+                   ObjectNotFound, ObjectBusy, InvalidArgumentError, requires, opt,
                    ANONYMOUS_AUID, ADMIN_AUID, LIBRADOS_ALL_NSPACES, WriteOpCtx, ReadOpCtx,
                    LIBRADOS_SNAP_HEAD, LIBRADOS_OPERATION_BALANCE_READS, LIBRADOS_OPERATION_SKIPRWLOCKS, MonitorLog)
 import time
@@ -15,6 +15,11 @@ import sys
 # Are we running Python 2.x
 _python2 = sys.version_info[0] < 3
 
+def require_benchmark():
+    # Benchmarks are slow and only print their numbers; opt in to them
+    if not os.environ.get('CEPH_TEST_BENCHMARK'):
+        raise SkipTest("set CEPH_TEST_BENCHMARK to run benchmarks")
+
 def test_rados_init_error():
     assert_raises(Error, Rados, conffile='', rados_id='admin',
                   name='client.admin')
@@ -334,6 +339,114 @@ class TestIoctx(object):
         self.ioctx.write('abc', b'a\0b\0c')
         eq(self.ioctx.read('abc'), b'a\0b\0c')
 
+    def test_write_buffers(self):
+        self.ioctx.write('abc', bytearray(b'abc'))
+        eq(self.ioctx.read('abc'), b'abc')
+        self.ioctx.write('abc', memoryview(b'xyz')[1:], 1)
+        eq(self.ioctx.read('abc'), b'ayz')
+        self.ioctx.write_full('abc', bytearray(b'de'))
+        self.ioctx.append('abc', memoryview(b'f'))
+        eq(self.ioctx.read('abc'), b'def')
+        assert_raises(TypeError, self.ioctx.write, 'abc', 42)
+
+    def test_read_into(self):
+        self.ioctx.write('abc', b'abcdef')
+        buf = bytearray(4)
+        eq(self.ioctx.read_into('abc', buf), 4)
+        eq(buf, bytearray(b'abcd'))
+        eq(self.ioctx.read_into('abc', memoryview(buf)[2:], 4), 2)
+        eq(buf, bytearray(b'abef'))
+        eq(self.ioctx.read_into('abc', buf, 6), 0)
+        assert_raises(TypeError, self.ioctx.read_into, 'abc', b'abcd')
+        assert_raises(ObjectNotFound, self.ioctx.read_into, 'no_such', buf)
+
+    def test_read_into_benchmark(self):
+        require_benchmark()
+        # Compare read, which allocates, and read_into a reused buffer
+        size = 4 << 20
+        count = 64
+        data = os.urandom(size)
+        self.ioctx.write_full('bench', data)
+        buf = bytearray(size)
+
+        start = time.time()
+        for _ in range(count):
+            self.ioctx.read('bench', size)
+        read_rate = count * size / (time.time() - start) / 1e9
+
+        start = time.time()
+        for _ in range(count):
+            self.ioctx.read_into('bench', buf)
+        read_into_rate = count * size / (time.time() - start) / 1e9
+        eq(bytes(buf), data)
+
+        print("read {0:.2f} GB/s, read_into {1:.2f} GB/s".format(
+            read_rate, read_into_rate))
+
+    def test_async_ioctx(self):
+        if _python2:
+            raise SkipTest("asyncio requires Python 3")
+        import asyncio
+        from rados import AsyncIoctx
+        loop = asyncio.new_event_loop()
+        try:
+            aioctx = AsyncIoctx(self.ioctx, loop=loop, max_in_flight=2)
+            run = loop.run_until_complete
+
+            eq(run(asyncio.gather(*[aioctx.write_full('obj%d' % i, b'data%d' % i)
+                                    for i in range(10)])),
+               [0] * 10)
+            eq(run(asyncio.gather(*[aioctx.read('obj%d' % i)
+                                    for i in range(10)])),
+               [b'data%d' % i for i in range(10)])
+            eq(aioctx.in_flight, 0)
+
+            run(aioctx.write('obj0', b'DA', 0))
+            eq(run(aioctx.read('obj0', 2, 3)), b'a0')
+            eq(run(aioctx.stat('obj0'))[0], 5)
+            assert_raises(ObjectNotFound, run, aioctx.stat('no_such'))
+            assert_raises(ObjectNotFound, run, aioctx.read('no_such'))
+
+            with ReadOpCtx(self.ioctx) as read_op:
+                iter, ret = self.ioctx.get_omap_vals(read_op, "", "", 10)
+                eq(run(aioctx.operate_read_op(read_op, 'obj0')), 0)
+                eq(list(iter), [])
+
+            ret, out = run(aioctx.execute('obj0', 'hello', 'say_hello', b''))
+            eq(out, b'Hello, world!')
+
+            run(aioctx.remove('obj0'))
+            assert_raises(ObjectNotFound, self.ioctx.stat, 'obj0')
+        finally:
+            loop.close()
+
+    def test_async_ioctx_benchmark(self):
+        require_benchmark()
+        if _python2:
+            raise SkipTest("asyncio requires Python 3")
+        import asyncio
+        from rados import AsyncIoctx
+        loop = asyncio.new_event_loop()
+        count = 10000
+        try:
+            for max_in_flight in (1, 16, 128, 1024):
+                aioctx = AsyncIoctx(self.ioctx, loop=loop,
+                                    max_in_flight=max_in_flight)
+                start = time.time()
+                loop.run_until_complete(asyncio.gather(
+                    *[aioctx.write_full('bench%d' % (i % 100), b'x' * 4096)
+                      for i in range(count)]))
+                write_rate = count / (time.time() - start)
+                start = time.time()
+                loop.run_until_complete(asyncio.gather(
+                    *[aioctx.read('bench%d' % (i % 100), 4096)
+                      for i in range(count)]))
+                read_rate = count / (time.time() - start)
+                print("max_in_flight {0}: {1:.0f} writes/s, {2:.0f} reads/s".format(
+                    max_in_flight, write_rate, read_rate))
+        finally:
+            loop.close()
+
     def test_trunc(self):
         self.ioctx.write('abc', b'abc')
         self.ioctx.trunc('abc', 2)
@@ -369,6 +482,73 @@ class TestIoctx(object):
                 ('ns1', 'd'), ('ns1', 'ns1-a'), ('ns1', 'ns1-b'),\
                 ('ns1', 'ns1-c'), ('ns1', 'ns1-d')])
 
+    def test_list_objects_chunked(self):
+        eq(list(self.ioctx.list_objects_chunked()), [])
+        for i in range(10):
+            self.ioctx.write('obj%d' % i, b'')
+        self.ioctx.write('other', b'')
+        self.ioctx.set_namespace("ns1")
+        self.ioctx.write('obj0', b'')
+        self.ioctx.set_namespace("")
+
+        chunks = list(self.ioctx.list_objects_chunked(chunk_size=3))
+        ok(all(0 < len(chunk) <= 3 for chunk in chunks))
+        eq(sorted(sum(chunks, [])),
+           sorted([('obj%d' % i, None, '') for i in range(10)] +
+                  [('other', None, '')]))
+
+        objects = sum(self.ioctx.list_objects_chunked(prefix='obj'), [])
+        eq(sorted(name for name, _, _ in objects),
+           ['obj%d' % i for i in range(10)])
+
+        self.ioctx.set_namespace(LIBRADOS_ALL_NSPACES)
+        objects = sum(self.ioctx.list_objects_chunked(prefix='obj0'), [])
+        eq(sorted((nspace, name) for name, _, nspace in objects),
+           [('', 'obj0'), ('ns1', 'obj0')])
+
+    def test_list_objects_chunked_shards(self):
+        for i in range(100):
+            self.ioctx.write('obj%d' % i, b'')
+        shards = [sum(self.ioctx.list_objects_chunked(shard=n, shards=4), [])
+                  for n in range(4)]
+        eq(sorted(sum(shards, [])),
+           sorted(('obj%d' % i, None, '') for i in range(100)))
+        assert_raises(InvalidArgumentError, self.ioctx.list_objects_chunked,
+                      shard=4, shards=4)
+        assert_raises(InvalidArgumentError, self.ioctx.list_objects_chunked,
+                      chunk_size=0)
+
+    def test_list_objects_seek(self):
+        for i in range(100):
+            self.ioctx.write('obj%d' % i, b'')
+        it = self.ioctx.list_objects()
+        eq(it.seek(0), 0)
+        eq(it.get_pg_hash_position(), 0)
+        eq(len(list(it)), 100)
+        it = self.ioctx.list_objects()
+        pos = it.seek(4)
+        eq(it.get_pg_hash_position(), pos)
+        ok(len(list(it)) <= 100)
+
+    def test_list_objects_benchmark(self):
+        require_benchmark()
+        count = 10000
+        completions = [self.ioctx.aio_write_full('bench%d' % i, b'')
+                       for i in range(count)]
+        for completion in completions:
+            completion.wait_for_complete()
+
+        start = time.time()
+        eq(len([obj.key for obj in self.ioctx.list_objects()]), count)
+        iter_rate = count / (time.time() - start)
+        for chunk_size in (100, 1000, 10000):
+            start = time.time()
+            eq(sum(len(chunk) for chunk in
+                   self.ioctx.list_objects_chunked(chunk_size=chunk_size)), count)
+            print("list_objects_chunked({0}): {1:.0f} objects/s".format(
+                chunk_size, count / (time.time() - start)))
+        print("list_objects: {0:.0f} objects/s".format(iter_rate))
+
     def test_xattrs(self):
         xattrs = dict(a=b'1', b=b'2', c=b'3', d=b'a\0b', e=b'\0')
         self.ioctx.write('abc', b'')
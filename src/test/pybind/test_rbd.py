@@ -2,6 +2,7 @@
 import functools
 import socket
 import os
+import tempfile
 import time
 import sys
 
@@ -33,6 +34,11 @@ pool_name = None
 IMG_SIZE = 8 << 20 # 8 MiB
 IMG_ORDER = 22 # 4 MiB objects
 
+def require_benchmark():
+    # Benchmarks are slow and only print their numbers; opt in to them
+    if not os.environ.get('CEPH_TEST_BENCHMARK'):
+        raise SkipTest("set CEPH_TEST_BENCHMARK to run benchmarks")
+
 def setup_module():
     global rados
     rados = Rados(conffile='')
@@ -395,6 +401,39 @@ class TestImage(object):
     def test_read_bad_offset(self):
         assert_raises(InvalidArgument, self.image.read, IMG_SIZE + 1, IMG_SIZE)
 
+    def test_write_read_into(self):
+        data = rand_data(256)
+        self.image.write(bytearray(data), 50)
+        self.image.write(memoryview(data)[:10], 0)
+        buf = bytearray(256)
+        eq(self.image.read_into(50, buf), 256)
+        eq(bytes(buf), data)
+        eq(self.image.read_into(0, memoryview(buf)[:10]), 10)
+        eq(bytes(buf[:10]), data[:10])
+        assert_raises(TypeError, self.image.read_into, 0, b'\0' * 10)
+        assert_raises(InvalidArgument, self.image.read_into, IMG_SIZE + 1, buf)
+
+    def test_read_into_benchmark(self):
+        require_benchmark()
+        data = rand_data(IMG_SIZE)
+        self.image.write(data, 0)
+        buf = bytearray(IMG_SIZE)
+        count = 16
+
+        start = time.time()
+        for _ in range(count):
+            self.image.read(0, IMG_SIZE)
+        read_rate = count * IMG_SIZE / (time.time() - start) / 1e9
+
+        start = time.time()
+        for _ in range(count):
+            self.image.read_into(0, buf)
+        read_into_rate = count * IMG_SIZE / (time.time() - start) / 1e9
+        eq(bytes(buf), data)
+
+        print("read {0:.2f} GB/s, read_into {1:.2f} GB/s".format(
+            read_rate, read_into_rate))
+
     def test_resize(self):
         new_size = IMG_SIZE * 2
         self.image.resize(new_size)
@@ -825,6 +864,108 @@ class TestImage(object):
         eq(retval[0], 0)
         eq(sys.getrefcount(comp), 2)
 
+    def test_completion_queue(self):
+        queue = self.image.completion_queue()
+        eq(queue, self.image.completion_queue())
+        eq(queue.poll(), [])
+        eq(queue.wait(), [])
+
+        data = [rand_data(256) for i in range(8)]
+        ids = queue.submit_write([(i * 256, d) for i, d in enumerate(data)])
+        eq(queue.pending, 8)
+        results = queue.wait(8)
+        eq(sorted(results), sorted((id_, 0, None) for id_ in ids))
+        eq(queue.pending, 0)
+
+        # the callbacks of other aio still run, and don't show up here
+        retval = [None]
+        def cb(comp):
+            retval[0] = comp.get_return_value()
+        self.image.aio_flush(cb).wait_for_complete_and_cb()
+        eq(retval[0], 0)
+
+        ids = queue.submit_read([(i * 256, 256) for i in range(8)] +
+                                [(IMG_SIZE, 20)])
+        results = dict((id_, (ret, buf)) for id_, ret, buf in queue.wait(9))
+        eq([results[id_] for id_ in ids[:8]], [(256, d) for d in data])
+        ret, buf = results[ids[8]]
+        assert(ret < 0)
+        eq(buf, None)
+
+        ids = queue.submit_discard([(0, 256)])
+        eq(queue.wait(), [(ids[0], 0, None)])
+        eq(self.image.read(0, 256), b'\0' * 256)
+
+        ids = queue.submit_read([(0, 256)])
+        eq(queue.wait(timeout=10), [(ids[0], 256, b'\0' * 256)])
+        assert_raises(TypeError, queue.submit_write, [(0, u'abc')])
+
+    def test_completion_queue_close(self):
+        queue = self.image.completion_queue()
+        queue.submit_write([(0, rand_data(256))])
+        fd = queue.fileno()
+        # closing the image waits for the write and closes the queue
+        self.image.close()
+        eq(queue.pending, 0)
+        assert_raises(InvalidArgument, queue.poll)
+        assert_raises(InvalidArgument, queue.submit_read, [(0, 256)])
+        assert_raises(OSError, os.fstat, fd)
+
+    def test_completion_queue_benchmark(self):
+        require_benchmark()
+        size = 4096
+        count = IMG_SIZE // size
+        data = rand_data(size)
+        for max_in_flight in (1, 16, 128):
+            start = time.time()
+            done = 0
+            while done < count:
+                batch = min(max_in_flight, count - done)
+                comps = [self.image.aio_write(data, (done + i) * size, None)
+                         for i in range(batch)]
+                for comp in comps:
+                    comp.wait_for_complete_and_cb()
+                done += batch
+            aio_rate = count / (time.time() - start)
+
+            queue = self.image.completion_queue()
+            start = time.time()
+            submitted = 0
+            while submitted < count or queue.pending:
+                batch = min(max_in_flight - queue.pending, count - submitted)
+                queue.submit_write([((submitted + i) * size, data)
+                                    for i in range(batch)])
+                submitted += batch
+                for _, ret, _ in queue.wait():
+                    eq(ret, 0)
+            queue_rate = count / (time.time() - start)
+            print("{0} in flight: aio_write {1:.0f} IOPS, "
+                  "completion queue {2:.0f} IOPS".format(
+                      max_in_flight, aio_rate, queue_rate))
+
+    def test_export_import(self):
+        data = rand_data(256)
+        self.image.write(data, 0)
+        self.image.write(data, IMG_SIZE - 256)
+        self.image.write(b'\0' * 256, 1 << IMG_ORDER)
+        with tempfile.TemporaryFile() as f:
+            # only the 4096 byte chunks holding data are written
+            eq(self.image.export_to(f, chunk_size=4096), 4096 * 2)
+            f.seek(0)
+            eq(f.read(), data + b'\0' * (IMG_SIZE - 512) + data)
+
+            other_name = get_temp_image_name()
+            self.rbd.create(ioctx, other_name, IMG_SIZE // 2, IMG_ORDER)
+            try:
+                with Image(ioctx, other_name) as other:
+                    # zeroes over existing data are discarded
+                    other.write(rand_data(256), 4096)
+                    eq(other.import_from(f, chunk_size=4096), 4096 * 2)
+                    eq(other.size(), IMG_SIZE)
+                    eq(other.read(0, IMG_SIZE), self.image.read(0, IMG_SIZE))
+            finally:
+                self.rbd.remove(ioctx, other_name)
+
     def test_metadata(self):
         metadata = list(self.image.metadata_list())
         eq(len(metadata), 0)